@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# serve the dashboard reads (KPIs, trends, search) from their async views,
+# so one worker keeps many concurrent dashboards waiting on the database
+os.environ.setdefault('ASYNC_DASHBOARD', '1')
 
 application = get_asgi_application()
@@ -46,7 +46,6 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'rest_framework',
     'django_filters',
     'corsheaders',
@@ -59,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'root.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -67,15 +67,20 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware'
 ]
 
+# the toolbar instruments every request, so it is for development only
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+    INTERNAL_IPS = ['127.0.0.1']
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -147,7 +152,7 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
 }
 
 SIMPLE_JWT = {
@@ -156,6 +161,51 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
 }
 
+GLOBAL_SEARCH = {
+    'PARALLEL': True,
+    'MAX_WORKERS': 4,
+    'MODEL_TIMEOUT': 2.0,
+}
+
+# background jobs, run by `manage.py run_jobs`
+JOB_QUEUE = {
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 10,
+    'LOCK_TIMEOUT': 600,
+    # post invoice stock changes from the worker instead of the request
+    'BACKGROUND_POSTING': os.environ.get('BACKGROUND_POSTING', '') == '1',
+}
+
+# route the dashboard reads (KPIs, trends, search) to their async views;
+# set by backend/asgi.py, so WSGI workers keep the sync ones
+ASYNC_DASHBOARD = os.environ.get('ASYNC_DASHBOARD', '') == '1'
+# threads (and DB connections) per process running the concurrent reads of
+# the async views, see root.utils.gather_queries
+ASYNC_QUERY_WORKERS = 4
+
+# the active business of a user is resolved once per request; name a shared
+# cache (redis, memcached) here to keep it across requests, see
+# root.utils.resolve_active_business. Per-process caches are ignored.
+ACTIVE_BUSINESS_CACHE = None
+
+# cities, units and categories, see root.utils.ReferenceDataViewSetMixin.
+# Each process keeps its own copy for LOCAL_TIMEOUT; with several processes,
+# point ALIAS at a shared cache (redis, memcached) so admin edits reach all
+# of them at once. Per-process backends (LocMem) are ignored.
+REFERENCE_DATA_CACHE = {
+    'ALIAS': None,
+    'MAX_AGE': 60 * 60,
+}
+
+# per-route latency, query and payload figures served at /metrics/, see
+# root.metrics. The scraper sends `Authorization: Bearer <TOKEN>`; with
+# several processes, point CACHE_ALIAS at a shared cache (not LocMem) so
+# every worker answers with the figures of all of them.
+METRICS = {
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+    'CACHE_ALIAS': None,
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'USER_CREATE_PASSWORD_RETYPE': True,
@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Inventory, InventoryItem
+from .models import Inventory, InventoryItem, StockMovement, StockSnapshot
 
 admin.site.register(Inventory)
 admin.site.register(InventoryItem)
-
+admin.site.register(StockMovement)
+admin.site.register(StockSnapshot)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from inventory.models import StockSnapshot
+
+
+class Command(BaseCommand):
+    help = "Snapshot the stock on hand of every inventory item, so balance queries only replay the ledger since."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, help="Only snapshot the inventory of this business id.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        taken = StockSnapshot.objects.take(options.get('business'), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Took {taken} stock snapshots."))
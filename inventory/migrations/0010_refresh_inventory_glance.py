@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models.functions import Cast, Coalesce
+
+
+def refresh_inventory_glance(apps, schema_editor):
+    Inventory = apps.get_model('inventory', 'Inventory')
+    InventoryItem = apps.get_model('inventory', 'InventoryItem')
+
+    def total(expression):
+        return models.Subquery(
+            InventoryItem.objects
+            .filter(inventory_id=models.OuterRef('pk'))
+            .order_by()
+            .values('inventory_id')
+            .annotate(total=models.Sum(expression))
+            .values('total')
+        )
+
+    Inventory.objects.update(
+        total_quantity_on_hand=Coalesce(total(models.F('quantity_on_hand')), 0),
+        net_inventory_value=Coalesce(
+            total(models.F('quantity_on_hand') * models.F('unit_cost')), 0.0
+        ),
+        total_value_reserved=Cast(Coalesce(
+            total(models.F('quantity_reserved') * models.F('unit_cost')), 0.0
+        ), models.IntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_inventoryitem_unit_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(refresh_inventory_glance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_refresh_inventory_glance'),
+        ('root', '0014_customer_customer_business_cursor_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventoryitem',
+            index=models.Index(fields=['inventory', '-created_at', 'id'], name='ii_inventory_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_inventoryitem_ii_inventory_cursor_idx'),
+        ('root', '0015_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventoryitem',
+            index=models.Index(fields=['business', 'product'], name='ii_business_product_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+
+def snapshot_opening_stock(apps, schema_editor):
+    """
+    Anchor the ledger: the stock on hand when it was introduced.
+    """
+    InventoryItem = apps.get_model('inventory', 'InventoryItem')
+    StockSnapshot = apps.get_model('inventory', 'StockSnapshot')
+
+    taken_at = django.utils.timezone.now()
+    StockSnapshot.objects.bulk_create([
+        StockSnapshot(
+            business_id=item['business_id'], item_id=item['id'], product_id=item['product_id'],
+            quantity_on_hand=item['quantity_on_hand'], taken_at=taken_at,
+        )
+        for item in InventoryItem.objects.values('id', 'business_id', 'product_id', 'quantity_on_hand')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_inventoryitem_ii_business_product_idx'),
+        ('root', '0015_searchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('O', 'OPENING'), ('P', 'PURCHASE'), ('S', 'SALE'), ('A', 'ADJUSTMENT')], max_length=1)),
+                ('quantity', models.IntegerField()),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source_type', models.CharField(blank=True, default='', max_length=100)),
+                ('source_id', models.BigIntegerField(blank=True, null=True)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='root.business')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='inventory.inventoryitem')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='root.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_on_hand', models.IntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='root.business')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='inventory.inventoryitem')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='root.product')),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='InventoryItemHistory',
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['item', 'occurred_at'], name='sm_item_occurred_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['business', 'product', 'occurred_at'], name='sm_product_occurred_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['source_type', 'source_id'], name='sm_source_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocksnapshot',
+            unique_together={('item', 'taken_at')},
+        ),
+        migrations.RunPython(snapshot_opening_stock, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,12 @@
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+from django.db.models.functions import Cast, Coalesce
 from root.utils import generateTransactionId
-from root.models import BaseQuerySet, Business, BaseItem, Location
+from root.models import BaseQuerySet, Business, BaseItem, CollectionVersion, Location
+from sales.models import PurchaseInvoiceItemRestock
 # from sales.utils import printObject
 
 # Create your models here.
@@ -13,22 +18,200 @@ class InventoryQuerySet(BaseQuerySet):
 
 class InventoryManager(models.Manager):
 
+    COST_METHODS = ('last', 'weighted')
+
     def get_queryset(self):
         return InventoryQuerySet(self.model)
     
-    def total_inventory_value(self, id):
-        
-        items = self.get_queryset().get_items(id)
+    def total_inventory_value(self, business_id):
+        """
+        Read from the glance row kept current by refresh_glance().
+        """
+        value = (
+            self.get_queryset()
+            .for_business(business_id)
+            .values_list('net_inventory_value', flat=True)
+            .first()
+        )
+        return value or 0
+
+    def total_restocks_required(self, business_id):
+        return InventoryItem.objects.filter(
+            business_id=business_id,
+            quantity_on_hand__lte=models.F('reorder_level')
+        ).count()
+
+    def kpis(self, business_id):
+        restocks_required = (
+            InventoryItem.objects
+            .filter(inventory_id=models.OuterRef('pk'), quantity_on_hand__lte=models.F('reorder_level'))
+            .order_by()
+            .values('inventory_id')
+            .annotate(count=models.Count('id'))
+            .values('count')
+        )
+
+        glance = self.get_queryset().for_business(business_id).annotate(
+            total_restocks_required=Coalesce(models.Subquery(restocks_required), 0)
+        ).values(
+            'net_inventory_value', 'total_quantity_on_hand',
+            'total_value_reserved', 'total_restocks_required'
+        ).first() or {}
+
+        return {
+            "total_inventory_value": glance.get('net_inventory_value') or 0,
+            "total_quantity_on_hand": glance.get('total_quantity_on_hand') or 0,
+            "total_value_reserved": glance.get('total_value_reserved') or 0,
+            "total_restocks_required": glance.get('total_restocks_required') or 0,
+        }
+
+    def refresh_glance(self, **filters):
+        """
+        Recompute the glance columns (total_quantity_on_hand,
+        net_inventory_value, total_value_reserved) of the matching
+        inventories in a single UPDATE.
+        """
+        def total(expression):
+            return models.Subquery(
+                InventoryItem.objects
+                .filter(inventory_id=models.OuterRef('pk'))
+                .order_by()
+                .values('inventory_id')
+                .annotate(total=models.Sum(expression))
+                .values('total')
+            )
+
+        business_ids = [filters['business_id']] if 'business_id' in filters else (
+            self.get_queryset().filter(**filters).values_list('business_id', flat=True)
+        )
+        for business_id in business_ids:
+            CollectionVersion.objects.bump(business_id, 'inventory')
+
+        return self.get_queryset().filter(**filters).update(
+            total_quantity_on_hand=Coalesce(total(models.F('quantity_on_hand')), 0),
+            net_inventory_value=Coalesce(
+                total(models.F('quantity_on_hand') * models.F('unit_cost')), 0.0
+            ),
+            total_value_reserved=Cast(Coalesce(
+                total(models.F('quantity_reserved') * models.F('unit_cost')), 0.0
+            ), models.IntegerField()),
+        )
+
+    def apply_glance_delta(self, pk, business_id, before=None, after=None):
+        """
+        Move the glance columns of inventory `pk` by the change of a single
+        item, with one F() UPDATE where refresh_glance() re-aggregates all
+        of its items. `before` and `after` are the item's
+        (quantity_on_hand, quantity_reserved, unit_cost), None for an item
+        that did not exist before or no longer does afterwards. The
+        reserved value is rounded per item.
+        """
+        def share(state):
+            quantity_on_hand, quantity_reserved, unit_cost = state or (0, 0, 0)
+            cost = unit_cost or 0
+            return (quantity_on_hand or 0), (quantity_on_hand or 0) * cost, round((quantity_reserved or 0) * cost)
+
+        quantity, value, value_reserved = (
+            new - old for new, old in zip(share(after), share(before))
+        )
+        CollectionVersion.objects.bump(business_id, 'inventory')
+        if not (quantity or value or value_reserved):
+            return 0
+
+        return self.get_queryset().filter(pk=pk).update(
+            total_quantity_on_hand=Coalesce(models.F('total_quantity_on_hand'), 0) + quantity,
+            net_inventory_value=Coalesce(models.F('net_inventory_value'), 0.0) + value,
+            total_value_reserved=Coalesce(models.F('total_value_reserved'), 0) + value_reserved,
+        )
+
+    def unit_cost_expression(self, cost_method='last'):
+        """
+        Per item unit cost. 'last' is the cost stored on the inventory
+        row, 'weighted' the quantity weighted average over the product's
+        purchase restock history, falling back to the last cost.
+        """
+        if cost_method not in self.COST_METHODS:
+            raise ValueError(f"cost_method must be one of {self.COST_METHODS}")
 
-        total = 0
-        for item in items:
-            total += item.quantity * item.unit_cost
+        if cost_method == 'last':
+            return models.F('unit_cost')
 
-        return total      
+        weighted_average = (
+            PurchaseInvoiceItemRestock.objects
+            .filter(
+                purchase_invoice__business_id=models.OuterRef('business_id'),
+                purchase_invoice_item__product_id=models.OuterRef('product_id'),
+                quantity__gt=0
+            )
+            .order_by()
+            .values('purchase_invoice_item__product_id')
+            .annotate(average=models.ExpressionWrapper(
+                models.Sum(models.F('quantity') * models.F('purchase_invoice_item__unit_cost'))
+                / models.Sum('quantity'),
+                output_field=models.FloatField()
+            ))
+            .values('average')
+        )
+        return Coalesce(models.Subquery(weighted_average), models.F('unit_cost'))
 
-    def total_restocks_required(self, id):
-        items = self.get_queryset().get_items(id)
-        return items.filter(quantity_on_hand__lte = models.F('reorder_level')).count()
+    def valuation(self, business_id, cost_method='last'):
+        """
+        Stock value of a business in total, per location and per product,
+        computed with three aggregate queries.
+        """
+        unit_cost = self.unit_cost_expression(cost_method)
+        items = InventoryItem.objects.filter(business_id=business_id).annotate(
+            line_value=models.ExpressionWrapper(
+                models.F('quantity_on_hand') * unit_cost,
+                output_field=models.FloatField()
+            ),
+        ).order_by()
+
+        totals = {
+            'quantity_on_hand': models.Sum('quantity_on_hand', default=0),
+            'quantity_reserved': models.Sum('quantity_reserved', default=0),
+            'value': models.Sum('line_value', default=0.0),
+        }
+
+        return {
+            "cost_method": cost_method,
+            **items.aggregate(**totals),
+            "by_location": list(
+                items
+                .values('location_id', location_name=models.F('location__name'))
+                .annotate(**totals)
+                .order_by('location_name')
+            ),
+            "by_product": list(
+                items
+                .values('product_id', product_name=models.F('product__name'))
+                .annotate(**totals)
+                .order_by('-value')
+            ),
+        }
+
+
+class InventoryItemQuerySet(BaseQuerySet):
+    pass
+
+
+class InventoryItemManager(models.Manager):
+
+    def get_queryset(self):
+        return InventoryItemQuerySet(self.model)
+
+    def available_to_promise(self, business_id, product_ids=None):
+        """
+        {product_id: quantity_on_hand - quantity_reserved}, read straight
+        off the inventory rows through the (business, product) index.
+        """
+        queryset = self.get_queryset().for_business(business_id)
+        if product_ids is not None:
+            queryset = queryset.filter(product_id__in=product_ids)
+
+        return dict(queryset.values_list(
+            'product_id', models.F('quantity_on_hand') - models.F('quantity_reserved')
+        ))
 
 
 class Inventory(models.Model):
@@ -60,30 +243,216 @@ class InventoryItem(BaseItem):
     reorder_level = models.IntegerField(null=True, blank=True)
     last_transaction = models.CharField(max_length=256, null=True, blank=True)
 
+    objects = InventoryItemManager()
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
     
     def apply_restock_delta(self, is_sold, delta: int, last_transaction: str ):
         """
-        Applies a restock delta to this inventory row.
+        Applies a restock delta to this inventory row, as an F() update so
+        concurrent deltas of the same row are never lost.
         """
-        if not is_sold:
-            self.quantity += delta
-            self.quantity_on_hand += delta
-        else:
-            self.quantity -= delta
-            self.quantity_on_hand -= delta
+        if is_sold:
+            delta = -delta
 
-        self.last_transaction = last_transaction
-        self.save(update_fields=['quantity', 'quantity_on_hand', 'last_transaction'])
+        InventoryItem.objects.filter(pk=self.pk).update(
+            quantity=models.F('quantity') + delta,
+            quantity_on_hand=models.F('quantity_on_hand') + delta,
+            last_transaction=last_transaction,
+        )
+        self.refresh_from_db(fields=['quantity', 'quantity_on_hand', 'last_transaction'])
+        StockMovement.objects.record('S' if is_sold else 'P', None, {self: delta})
+        Inventory.objects.apply_glance_delta(
+            self.inventory_id, self.business_id,
+            before=(self.quantity_on_hand - delta, self.quantity_reserved, self.unit_cost),
+            after=(self.quantity_on_hand, self.quantity_reserved, self.unit_cost),
+        )
     
     class Meta:
         unique_together = [('inventory', 'product')]
+        indexes = [
+            models.Index(fields=['inventory', '-created_at', 'id'], name='ii_inventory_cursor_idx'),
+            models.Index(fields=['business', 'product'], name='ii_business_product_idx'),
+        ]
+
+
+class StockMovementQuerySet(BaseQuerySet):
+
+    def for_product(self, product_id):
+        return self.filter(product_id=product_id)
+
+    def between(self, start=None, end=None):
+        queryset = self
+        if start:
+            queryset = queryset.filter(occurred_at__gte=start)
+        if end:
+            queryset = queryset.filter(occurred_at__lt=end)
+        return queryset
+
 
+class StockMovementManager(models.Manager):
 
-class InventoryItemHistory(InventoryItem):
-    version_no = models.IntegerField()
-    item = models.ForeignKey(InventoryItem, models.CASCADE, related_name='history')
-    effective_at = models.DateTimeField(auto_now=True)
-    changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, models.CASCADE)
-    change_reason = models.TextField(null=True, blank=True)
+    def get_queryset(self):
+        return StockMovementQuerySet(self.model)
+
+    def record(self, kind, source, deltas, occurred_at=None):
+        """
+        Append one movement per inventory item. `deltas` maps InventoryItem
+        (or a (item_id, product_id, business_id) tuple) to the signed
+        change of quantity_on_hand; `source` is the document that caused
+        it, or None.
+        """
+        occurred_at = occurred_at or timezone.now()
+        source_type = source._meta.label_lower if source is not None else ''
+        source_id = source.pk if source is not None else None
+
+        movements = []
+        for item, quantity in deltas.items():
+            if not quantity:
+                continue
+            if isinstance(item, InventoryItem):
+                item = (item.pk, item.product_id, item.business_id)
+
+            item_id, product_id, business_id = item
+            movements.append(self.model(
+                business_id=business_id, item_id=item_id, product_id=product_id,
+                kind=kind, quantity=quantity, occurred_at=occurred_at,
+                source_type=source_type, source_id=source_id,
+            ))
+
+        return self.bulk_create(movements)
+
+    def movements(self, business_id, product_id, start=None, end=None):
+        """
+        Movements of one product in [start, end), oldest first.
+        """
+        return (
+            self.get_queryset()
+            .for_business(business_id)
+            .for_product(product_id)
+            .between(start, end)
+            .order_by('occurred_at', 'id')
+        )
+
+    def balance_as_of(self, business_id, at, product_ids=None):
+        """
+        {product_id: quantity on hand at `at`}, from each item's latest
+        snapshot taken at or before `at` plus the movements after it.
+        """
+        snapshots = StockSnapshot.objects.filter(
+            item_id=models.OuterRef('pk'), taken_at__lte=at
+        ).order_by('-taken_at')
+
+        moved = (
+            self.get_queryset()
+            .filter(
+                item_id=models.OuterRef('pk'),
+                occurred_at__gt=models.OuterRef('snapshot_at'),
+                occurred_at__lte=at,
+            )
+            .order_by()
+            .values('item_id')
+            .annotate(total=models.Sum('quantity'))
+            .values('total')
+        )
+
+        items = InventoryItem.objects.filter(business_id=business_id)
+        if product_ids is not None:
+            items = items.filter(product_id__in=product_ids)
+
+        return dict(
+            items
+            .annotate(
+                snapshot_at=Coalesce(
+                    models.Subquery(snapshots.values('taken_at')[:1]),
+                    models.Value(datetime.min.replace(tzinfo=dt_timezone.utc)),
+                ),
+                snapshot_quantity=Coalesce(models.Subquery(snapshots.values('quantity_on_hand')[:1]), 0),
+            )
+            .annotate(balance=models.F('snapshot_quantity') + Coalesce(models.Subquery(moved), 0))
+            .values_list('product_id', 'balance')
+        )
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of quantity_on_hand changes, one row per inventory
+    item per posting, pointing back at the document that caused it.
+    """
+
+    MOVEMENT_KINDS = [
+        ("O", "OPENING"),
+        ("P", "PURCHASE"),
+        ("S", "SALE"),
+        ("A", "ADJUSTMENT"),
+    ]
+
+    business = models.ForeignKey(Business, models.CASCADE, related_name='stock_movements')
+    item = models.ForeignKey(InventoryItem, models.CASCADE, related_name='movements')
+    product = models.ForeignKey('root.Product', models.CASCADE, related_name='stock_movements')
+    kind = models.CharField(max_length=1, choices=MOVEMENT_KINDS)
+    quantity = models.IntegerField()
+    occurred_at = models.DateTimeField(default=timezone.now)
+    source_type = models.CharField(max_length=100, blank=True, default='')
+    source_id = models.BigIntegerField(null=True, blank=True)
+
+    objects = StockMovementManager()
+
+    def __str__(self):
+        return f"{self.item_id}: {self.quantity:+} ({self.get_kind_display()})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'occurred_at'], name='sm_item_occurred_idx'),
+            models.Index(fields=['business', 'product', 'occurred_at'], name='sm_product_occurred_idx'),
+            models.Index(fields=['source_type', 'source_id'], name='sm_source_idx'),
+        ]
+
+
+class StockSnapshotManager(models.Manager):
+
+    def take(self, business_id=None, taken_at=None, batch_size=1000):
+        """
+        Record the current quantity_on_hand of every inventory item (of one
+        business, optionally) as a snapshot.
+        """
+        taken_at = taken_at or timezone.now()
+        items = InventoryItem.objects.order_by()
+        if business_id:
+            items = items.filter(business_id=business_id)
+
+        snapshots = (
+            self.model(
+                business_id=item['business_id'], item_id=item['id'], product_id=item['product_id'],
+                quantity_on_hand=item['quantity_on_hand'], taken_at=taken_at,
+            )
+            for item in items.values('id', 'business_id', 'product_id', 'quantity_on_hand').iterator(batch_size)
+        )
+
+        taken = 0
+        while batch := list(islice(snapshots, batch_size)):
+            taken += len(self.bulk_create(batch))
+        return taken
+
+
+class StockSnapshot(models.Model):
+    """
+    quantity_on_hand of an inventory item at a point in time. Balances at
+    any date start from the latest snapshot before it, so only the ledger
+    since then is scanned.
+    """
+
+    business = models.ForeignKey(Business, models.CASCADE, related_name='stock_snapshots')
+    item = models.ForeignKey(InventoryItem, models.CASCADE, related_name='snapshots')
+    product = models.ForeignKey('root.Product', models.CASCADE, related_name='stock_snapshots')
+    quantity_on_hand = models.IntegerField()
+    taken_at = models.DateTimeField()
+
+    objects = StockSnapshotManager()
+
+    def __str__(self):
+        return f"{self.item_id}@{self.taken_at}: {self.quantity_on_hand}"
+
+    class Meta:
+        unique_together = [('item', 'taken_at')]
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from root.models import Business
-from .models import Inventory
+from root.utils import in_batched_side_effects, run_batched
+from .models import Inventory, InventoryItem, StockMovement
 
 @receiver(post_save, sender=Business)
 def create_inventory_for_new_business(sender, **kwargs):
@@ -12,3 +13,72 @@ def create_inventory_for_new_business(sender, **kwargs):
 
     return
 
+
+STOCK_FIELDS = ('quantity_on_hand', 'quantity_reserved', 'unit_cost')
+
+
+@receiver(post_save, sender=InventoryItem)
+def refresh_inventory_glance(sender, instance: InventoryItem, created, **kwargs):
+    """
+    A single item moves the glance by its own change. Batches (bulk
+    deletes, imports) refresh it once as they end, and so do saves whose
+    stored row or new values are unknown.
+    """
+    stored = getattr(instance, '_stored_stock', None)
+    update_fields = kwargs.get('update_fields')
+    after = tuple(
+        getattr(instance, field) if update_fields is None or field in update_fields else stored[field]
+        for field in STOCK_FIELDS
+    ) if created or stored else None
+
+    if in_batched_side_effects() or kwargs.get('raw') or after is None or any(
+        hasattr(value, 'resolve_expression') for value in after
+    ):
+        run_batched(Inventory.objects.refresh_glance, pk=instance.inventory_id)
+        if stored and stored['inventory_id'] != instance.inventory_id:
+            run_batched(Inventory.objects.refresh_glance, pk=stored['inventory_id'])
+        return
+
+    before = None if created else tuple(stored[field] for field in STOCK_FIELDS)
+    if stored and stored['inventory_id'] != instance.inventory_id:
+        Inventory.objects.apply_glance_delta(stored['inventory_id'], instance.business_id, before=before)
+        before = None
+    Inventory.objects.apply_glance_delta(instance.inventory_id, instance.business_id, before, after)
+
+
+@receiver(post_delete, sender=InventoryItem)
+def refresh_inventory_glance_after_delete(sender, instance: InventoryItem, **kwargs):
+    if in_batched_side_effects():
+        run_batched(Inventory.objects.refresh_glance, pk=instance.inventory_id)
+        return
+
+    Inventory.objects.apply_glance_delta(
+        instance.inventory_id, instance.business_id,
+        before=tuple(getattr(instance, field) for field in STOCK_FIELDS),
+    )
+
+
+@receiver(pre_save, sender=InventoryItem)
+def readStockBeforeInventoryItemSave(sender, instance: InventoryItem, **kwargs):
+    instance._stored_stock = None
+    if instance.pk and not kwargs.get('raw'):
+        instance._stored_stock = (
+            InventoryItem.objects.filter(pk=instance.pk).values('inventory_id', *STOCK_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=InventoryItem)
+def recordStockMovementAfterInventoryItem(sender, instance: InventoryItem, created, **kwargs):
+    """
+    Single-row saves (opening stock, manual corrections) go to the ledger
+    here, as the difference to the stored row; set-based postings record
+    their movements themselves.
+    """
+    if kwargs.get('raw'):
+        return
+
+    stored = getattr(instance, '_stored_stock', None)
+    if created:
+        StockMovement.objects.record('O', None, {instance: instance.quantity_on_hand})
+    elif stored is not None and instance.quantity_on_hand != stored['quantity_on_hand']:
+        StockMovement.objects.record('A', None, {instance: instance.quantity_on_hand - stored['quantity_on_hand']})
@@ -1,3 +1,162 @@
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from core.models import User
+from root.models import Business, City, Customer, Product, Supplier, Unit
+from root.utils import batched_side_effects
+from sales.models import PurchaseInvoice, PurchaseInvoiceItem, SalesInvoice, SalesInvoiceItem
+from .models import Inventory, InventoryItem, StockMovement, StockSnapshot
+
+
+class StockLedgerTests(TestCase):
+    """
+    Every change of stock on hand lands in the movement ledger, so the
+    balance at any date can be rebuilt from snapshots plus movements.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        cls.supplier = Supplier.objects.create(name='Supplier', business=cls.business)
+        cls.customer = Customer.objects.create(
+            name='Customer', business=cls.business,
+            city=City.objects.create(name='City', postal_code='0')
+        )
+        cls.product = Product.objects.create(business=cls.business, name='Product', unit=Unit.objects.create(name='pcs'))
+
+    def receive(self, quantity):
+        invoice = PurchaseInvoice.objects.create(
+            business=self.business, supplier=self.supplier, created_by=self.user, status='D'
+        )
+        PurchaseInvoiceItem.objects.create(
+            business=self.business, purchase_invoice=invoice, product=self.product,
+            quantity=quantity, quantity_received=quantity, unit_cost=2.0
+        )
+        invoice.status = 'R'
+        invoice.save()
+        return invoice
+
+    def sell(self, quantity):
+        invoice = SalesInvoice.objects.create(
+            business=self.business, customer=self.customer, created_by=self.user, status='D'
+        )
+        SalesInvoiceItem.objects.create(
+            business=self.business, sales_invoice=invoice, product=self.product,
+            quantity=quantity, quantity_received=quantity, unit_price=1.0
+        )
+        invoice.status = 'C'
+        invoice.save()
+        return invoice
+
+    def balance(self, at):
+        return StockMovement.objects.balance_as_of(self.business.id, at).get(self.product.id)
+
+    def test_postings_are_recorded_against_their_documents(self):
+        item = InventoryItem.objects.create(
+            business=self.business, inventory=self.business.inventory_glance,
+            product=self.product, quantity=5, quantity_on_hand=5
+        )
+        purchase = self.receive(10)
+        sale = self.sell(3)
+        item.refresh_from_db()
+
+        self.assertEqual(
+            list(StockMovement.objects.movements(self.business.id, self.product.id)
+                 .values_list('kind', 'quantity', 'source_type', 'source_id')),
+            [
+                ('O', 5, '', None),
+                ('P', 10, 'sales.purchaseinvoice', purchase.id),
+                ('S', -3, 'sales.salesinvoice', sale.id),
+            ]
+        )
+        self.assertEqual(self.balance(timezone.now()), item.quantity_on_hand)
+
+    def test_balance_as_of_replays_movements_after_the_latest_snapshot(self):
+        item = InventoryItem.objects.create(
+            business=self.business, inventory=self.business.inventory_glance,
+            product=self.product, quantity=5, quantity_on_hand=5
+        )
+        self.receive(10)
+        after_receipt = timezone.now()
+        StockSnapshot.objects.take(self.business.id)
+
+        item.refresh_from_db()
+        item.quantity_on_hand = 12
+        item.save()
+        self.sell(4)
+
+        self.assertEqual(self.balance(after_receipt), 15)
+        self.assertEqual(self.balance(timezone.now()), 8)
+
+
+class InventoryGlanceTests(TestCase):
+    """
+    Single item writes move the glance by their own change; batches
+    recompute it once.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        unit = Unit.objects.create(name='pcs')
+        cls.products = [Product.objects.create(business=cls.business, name=f'P{i}', unit=unit) for i in range(3)]
+
+    def glance(self):
+        return tuple(
+            Inventory.objects.filter(business=self.business)
+            .values_list('total_quantity_on_hand', 'net_inventory_value', 'total_value_reserved')
+            .get()
+        )
+
+    def assertGlanceIsFresh(self):
+        glance = self.glance()
+        Inventory.objects.refresh_glance(business_id=self.business.id)
+        self.assertEqual(glance, self.glance())
+
+    def test_item_writes_apply_their_delta(self):
+        inventory = self.business.inventory_glance
+        with mock.patch.object(Inventory.objects, 'refresh_glance') as refresh_glance:
+            first, second = [
+                InventoryItem.objects.create(
+                    business=self.business, inventory=inventory, product=product,
+                    quantity_on_hand=quantity, unit_cost=2.5
+                )
+                for product, quantity in zip(self.products, (4, 6))
+            ]
+            third = InventoryItem.objects.create(
+                business=self.business, inventory=inventory, product=self.products[2], quantity_on_hand=3
+            )
+            self.assertEqual(self.glance(), (13, 25.0, 0))
+
+            first.quantity_reserved = 2
+            first.save()
+            second.quantity_on_hand = 1
+            second.unit_cost = 4.0
+            # the stored quantity counts, not the stale one in memory
+            second.save(update_fields=['unit_cost'])
+            third.delete()
+            first.apply_restock_delta(True, 2, 'T-1')
+        refresh_glance.assert_not_called()
+
+        self.assertEqual(self.glance(), (8, 29.0, 5))
+        self.assertGlanceIsFresh()
+
+    def test_batches_refresh_once(self):
+        items = InventoryItem.objects.bulk_create([
+            InventoryItem(
+                business=self.business, inventory=self.business.inventory_glance, product=product,
+                quantity_on_hand=5, unit_cost=1.0
+            )
+            for product in self.products
+        ])
 
-# Create your tests here.
+        with mock.patch.object(Inventory.objects, 'refresh_glance') as refresh_glance:
+            with batched_side_effects():
+                for item in items:
+                    item.quantity_on_hand = 1
+                    item.save()
+        refresh_glance.assert_called_once_with(pk=self.business.inventory_glance.id)
@@ -4,14 +4,18 @@ from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
-from root.utils import get_active_business
+from root.deletes import BulkDeleteViewSetMixin
+from root.utils import ConditionalGetViewSetMixin, ExportViewSetMixin, get_active_business
+from root.pagination import CreatedAtCursorPagination
 from root.models import BaseQuerySet
 from .models import Inventory, InventoryItem
 from .serializers import AvailableProductSerializer, InventoryItemCreateSerializer, InventoryItemSerializer, InventoryItemUpdateSerializer, InventorySerializer
 
 # Create your views here.
 
-class InventoryViewSet(ModelViewSet):
+class InventoryViewSet(ConditionalGetViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['inventory']
 
     serializer_class = InventorySerializer
 
@@ -23,8 +27,12 @@ class InventoryViewSet(ModelViewSet):
         return Inventory.objects.filter(business_id = business.id)
 
 
-class InventoryItemsViewSet(ModelViewSet):
+class InventoryItemsViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, ExportViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['inventory', 'products', 'locations']
+    bulk_delete_field = 'items_ids'
 
+    pagination_class = CreatedAtCursorPagination
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = [
         'inventory__id', 'location__name', 'product__name', 'track_code',
@@ -32,6 +40,10 @@ class InventoryItemsViewSet(ModelViewSet):
     search_fields = [
         'id', 'location__name', 'product__name', 'track_code', 'unit_cost', 'unit_price'
     ]
+    export_fields = [
+        'id', 'product_id', 'product__name', 'location__name', 'track_code', 'quantity', 'quantity_on_hand',
+        'quantity_reserved', 'unit_cost', 'unit_price', 'reorder_level', 'last_transaction', 'updated_at'
+    ]
 
     def get_queryset(self):
         return InventoryItem.objects.filter(inventory_id = self.kwargs['inventory_pk'])
@@ -85,29 +97,12 @@ class InventoryItemsViewSet(ModelViewSet):
             return Response({
                 "detail": "Internal Server Error"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
-        item_ids = request.data.get('items_ids', [])
-        if not item_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            InventoryItem.objects.filter(id__in=item_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-        
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
 
-class InventoryKPIViewSet(GenericViewSet):
+class InventoryKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
+
+    versioned_collections = ['inventory']
+    version_window = 60 * 5
     serializer_class = None
 
     @action(['GET'], detail=False, url_name='total-inventory-value', url_path='total-inventory-value')
@@ -129,6 +124,23 @@ class InventoryKPIViewSet(GenericViewSet):
             "detail": "Method not allowed"
         }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
     
+    @action(['GET'], detail=False, url_name='valuation', url_path='valuation')
+    def valuation(self, request):
+        business = get_active_business(request)
+        if not business:
+            return Response({
+                'detail': 'Unauthorized'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        cost_method = request.query_params.get('cost_method', 'last')
+        if cost_method not in Inventory.objects.COST_METHODS:
+            return Response({
+                'detail': f"cost_method must be one of {', '.join(Inventory.objects.COST_METHODS)}."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        valuation = Inventory.objects.valuation(business.id, cost_method)
+        return Response(valuation, status=status.HTTP_200_OK)
+
     @action(['GET'], detail=False, url_name='total-restocks-required', url_path='total-restocks-required')
     def total_restocks_required(self, request):
         if request.method == 'GET':
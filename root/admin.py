@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import (
     City, Category, Customer, Location, 
     Product, Supplier, Unit, Business,
-    Expense
+    Expense, DailyRollup
 )
 
 admin.site.register(City)
@@ -14,4 +14,5 @@ admin.site.register(Location)
 admin.site.register(Product)
 admin.site.register(Supplier)
 admin.site.register(Expense)
+admin.site.register(DailyRollup)
 
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class RootConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'root'
+
+    def ready(self):
+        import root.signals
+        from root.metrics import install
+        install()
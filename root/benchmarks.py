@@ -0,0 +1,167 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from inventory.models import Inventory
+from sales.models import SalesInvoice
+
+
+# (name, path); {sales_invoice} and {inventory} are filled in from the tenant
+ENDPOINTS = [
+    ('sales-invoices', '/sales-invoices/'),
+    ('sales-invoice', '/sales-invoices/{sales_invoice}/'),
+    ('sales-invoice-items', '/sales-invoices/{sales_invoice}/items/'),
+    ('purchase-invoices', '/purchase-invoices/'),
+    ('returned-items', '/returned-items/'),
+    ('products', '/products/'),
+    ('customers', '/customers/'),
+    ('inventory-items', '/inventory/{inventory}/items/'),
+    ('search', '/search/?search=coffee'),
+    ('kpis', '/kpis/'),
+    ('sales-kpis/daily-total-sales', '/sales-kpis/daily-total-sales/'),
+    ('sales-kpis/monthly-sales-trend', '/sales-kpis/monthly-sales-trend/'),
+    ('sales-kpis/average-order-value', '/sales-kpis/average-order-value/'),
+    ('purchases-kpis/monthly-total-purchases', '/purchases-kpis/monthly-total-purchases/'),
+    ('expenses-kpis/monthly-expenses-trend', '/expenses-kpis/monthly-expenses-trend/'),
+]
+
+COLUMNS = ['p50_ms', 'p95_ms', 'queries', 'peak_kib']
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+
+def fetch(client, path):
+    response = client.get(path)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def measure(client, path, repeat=20, warmup=3):
+    """
+    Latency percentiles over `repeat` warm requests, the query count of
+    the last one and the peak of memory allocated while serving one more
+    under tracemalloc (which would skew the timings if always on).
+    """
+    for _ in range(warmup):
+        fetch(client, path)
+
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = fetch(client, path)
+            timings.append((time.perf_counter() - started) * 1000)
+        # read now, the next request resets connection.queries
+        queries = len(captured)
+
+    tracemalloc.start()
+    try:
+        fetch(client, path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'queries': queries,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run(business, repeat=20, warmup=3, endpoints=None):
+    """
+    Measure every endpoint (or those named in `endpoints`) as the owner
+    of `business`.
+    """
+    client = APIClient()
+    client.force_authenticate(business.owner)
+    values = {
+        'sales_invoice': SalesInvoice.objects.filter(business=business).order_by('-id').values_list('id', flat=True).first(),
+        'inventory': Inventory.objects.filter(business=business).values_list('id', flat=True).first(),
+    }
+
+    results = {}
+    for name, path in ENDPOINTS:
+        if endpoints and name not in endpoints:
+            continue
+        results[name] = measure(client, path.format(**values), repeat, warmup)
+    return results
+
+
+def environment():
+    return {
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results, **options):
+    with open(path, 'w') as file:
+        json.dump({**options, 'environment': environment(), 'endpoints': results}, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(results, baseline, tolerance=0.25, noise_ms=2.0):
+    """
+    {endpoint: [regressions]} against the baseline's endpoints. Any extra
+    query is a regression; latency and memory only past `tolerance`
+    (and, for latency, `noise_ms`), timings being noisy.
+    """
+    regressions = {}
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+
+        found = []
+        if result['status'] != before['status']:
+            found.append(f"status {before['status']} -> {result['status']}")
+        if result['queries'] > before['queries']:
+            found.append(f"queries {before['queries']} -> {result['queries']}")
+        for metric in ('p50_ms', 'p95_ms'):
+            if result[metric] > before[metric] * (1 + tolerance) and result[metric] - before[metric] > noise_ms:
+                found.append(f"{metric} {before[metric]} -> {result[metric]}")
+        if result['peak_kib'] > before['peak_kib'] * (1 + tolerance):
+            found.append(f"peak_kib {before['peak_kib']} -> {result['peak_kib']}")
+        if found:
+            regressions[name] = found
+    return regressions
+
+
+def report(results, baseline=None):
+    """
+    The results as a text table, with the change against the baseline.
+    """
+    baseline = baseline or {}
+    width = max(len(name) for name in results) if results else 10
+    lines = [f"{'endpoint':<{width}}  status  " + '  '.join(f'{metric:>18}' for metric in COLUMNS)]
+    for name, result in results.items():
+        cells = []
+        for metric in COLUMNS:
+            cell = f"{result[metric]}"
+            if name in baseline and baseline[name].get(metric):
+                cell += f" ({(result[metric] - baseline[name][metric]) / baseline[name][metric]:+.0%})"
+            cells.append(f'{cell:>18}')
+        lines.append(f"{name:<{width}}  {result['status']:>6}  " + '  '.join(cells))
+    return '\n'.join(lines)
@@ -0,0 +1,118 @@
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from sales.utils import deferred_totals
+from .models import Job
+from .utils import batched_side_effects, get_active_business
+
+
+logger = logging.getLogger(__name__)
+
+BULK_DELETE_CHUNK_SIZE = getattr(settings, 'BULK_DELETE_CHUNK_SIZE', 200)
+BULK_DELETE_BACKGROUND_THRESHOLD = getattr(settings, 'BULK_DELETE_BACKGROUND_THRESHOLD', 1000)
+
+
+class BulkDeleter:
+    """
+    Deletes rows of `model` owned by a business a chunk at a time, each
+    chunk in its own short transaction, so neither the locks nor the rows
+    Django collects for the cascade grow with the number of ids.
+
+    Within a chunk the per-row side effects of the delete signals are
+    coalesced: invoice totals are recomputed once per surviving invoice
+    (deferred_totals) and the inventory glance and daily rollups once per
+    business and day (batched_side_effects).
+    """
+
+    def __init__(self, model, business_id, chunk_size=BULK_DELETE_CHUNK_SIZE):
+        self.model = model
+        self.business_id = business_id
+        self.chunk_size = chunk_size
+        self.deleted = {}       # {model label: rows}, cascades included
+
+    def run(self, ids):
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), self.chunk_size):
+            self.delete_chunk(ids[start:start + self.chunk_size])
+            Job.objects.report_progress(
+                done=min(start + self.chunk_size, len(ids)), total=len(ids), deleted=self.deleted
+            )
+
+        return {
+            'deleted': self.deleted.get(self.model._meta.label, 0),
+            'cascaded': {label: rows for label, rows in self.deleted.items() if label != self.model._meta.label},
+        }
+
+    def delete_chunk(self, ids):
+        with deferred_totals(), batched_side_effects():
+            _, deleted = self.model.objects.filter(business_id=self.business_id, pk__in=ids).delete()
+
+        for label, rows in deleted.items():
+            self.deleted[label] = self.deleted.get(label, 0) + rows
+
+
+def runBulkDelete(model, business_id, ids, chunk_size=BULK_DELETE_CHUNK_SIZE):
+    """
+    Job task of a background bulk delete; `model` is the model label.
+    """
+    return BulkDeleter(apps.get_model(model), business_id, chunk_size).run(ids)
+
+
+class BulkDeleteViewSetMixin:
+    """
+    POST {<bulk_delete_field>: [ids]} to <collection>/bulk-delete/ to
+    delete rows of the active business in chunks (see BulkDeleter). Large
+    requests, or ones sent with `background: true`, are handed to the job
+    queue and answered with 202 and the job to poll at /jobs/<id>/.
+    """
+
+    bulk_delete_field = 'ids'
+
+    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
+    def bulk_delete(self, request):
+
+        business = get_active_business(request)
+        if not business:
+            return Response({
+                'detail': 'Unauthorized'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            ids = [int(pk) for pk in request.data.get(self.bulk_delete_field, [])]
+        except (TypeError, ValueError):
+            ids = []
+        if not ids:
+            return Response({
+                'detail': 'Bad Request.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        model = self.get_queryset().model
+        background = request.data.get('background') in (True, 'true', '1')
+        if background or len(ids) > BULK_DELETE_BACKGROUND_THRESHOLD:
+            job = Job.objects.enqueue(
+                'root.deletes.runBulkDelete',
+                {'model': model._meta.label, 'business_id': business.id, 'ids': ids},
+                business_id=business.id,
+            )
+            return Response({
+                'detail': 'Accepted.',
+                'job': job.id,
+            }, status=status.HTTP_202_ACCEPTED)
+
+        try:
+            result = BulkDeleter(model, business.id).run(ids)
+            return Response({
+                'detail': 'Success.',
+                **result,
+            }, status=status.HTTP_200_OK)
+
+        except Exception:
+            logger.exception("Bulk delete of %s failed.", model._meta.label)
+            return Response({
+                'detail': 'Internal Server Error.'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
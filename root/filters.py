@@ -1,17 +1,27 @@
-from django.db.models import Q
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import connection, transaction
 
 from inventory.models import InventoryItem
 from inventory.serializers import InventoryItemSerializer
 from sales.models import PurchaseInvoice, PurchaseInvoiceItem, ReturnedItem, SalesInvoice, SalesInvoiceItem
 from sales.serializers import PurchaseInvoiceItemSerializer, ReturnedItemSerializer, SalesInvoiceItemSerializer, SalesInvoiceSerializer, SimplePurchaseInvoiceSerializer
-from .models import Customer, Product, Location, Supplier
+from .models import Customer, Product, Location, SearchDocument, Supplier
+from .utils import can_query_concurrently
 from .serializers import CustomerSerializer, ProductSerializer, LocationSerializer, SimpleCustomerSerializer, SupplierSerializer
 
 class MultiModelSearchEngine:
     """
     A flexible search engine that can run search operations across
     multiple Django models, serialize the results, and format a
-    unified response.
+    unified response. Matching runs against the business scoped
+    SearchDocument index rather than the source tables.
 
     Members:
         queryset     - The base queryset (optional; depends on usage)
@@ -23,6 +33,8 @@ class MultiModelSearchEngine:
         self.queryset = queryset
         self.models = {}         # {Model: [fields]}
         self.serializers = {}    # {Model: Serializer}
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
     # -----------------------------
     # Model + Serializer Management
@@ -30,15 +42,20 @@ class MultiModelSearchEngine:
 
     def set_models(self, models: dict):
         """
-        Replace all models with the provided {Model: [fields]} mapping.
+        Replace all models with the provided {Model: [fields]} mapping
+        and register their fields with the search index.
         """
-        self.models = models
+        self.models = {}
+        for model, fields in models.items():
+            self.add_model(model, fields)
 
     def add_model(self, model, fields: list):
         """
-        Add a model + fields to the search configuration.
+        Add a model + fields to the search configuration. Only text
+        fields belong here, they make up the indexed document.
         """
         self.models[model] = fields
+        SearchDocument.objects.register(model, fields)
 
     def set_serializers(self, serializers: dict):
         """
@@ -66,79 +83,195 @@ class MultiModelSearchEngine:
     # Core Search Logic
     # -----------------------------
 
-    def search(self, key: str):
+    def collect(self, model, ids, business_id, limit):
+        """
+        Read and serialize the hits of a single model in rank order.
+        `partial` is set when the hits reached `limit` and more may exist.
+        """
+        serializer_class = self.serializers.get(model)
+        if not serializer_class:
+            raise Exception(f"No serializer found for model: {model.__name__}")
+
+        objects = []
+        if ids:
+            queryset = model.objects.filter(business_id=business_id)
+            if hasattr(serializer_class, 'setup_eager_loading'):
+                queryset = serializer_class.setup_eager_loading(queryset)
+
+            found = queryset.in_bulk(ids)
+            objects = [found[pk] for pk in ids if pk in found]
+
+        try:
+            serialized = serializer_class(objects, many=True).data
+        except Exception:
+            raise Exception("Error serializing objects")
+
+        return {
+            "model": f"{model.__name__}",
+            "count": len(serialized),
+            "results": serialized,
+            "partial": len(ids) >= limit,
+            "timed_out": False,
+        }
+
+    def collect_in_thread(self, model, ids, business_id, limit, timeout):
         """
-        Execute a search across all registered models using the
-        configured fields, returning raw serialized data.
+        collect() on a worker thread. The thread has its own connection,
+        bounded by a statement timeout on PostgreSQL and closed afterwards
+        so abandoned workers do not hold on to it.
+        """
+        try:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute("SET LOCAL statement_timeout = %s", [int(timeout * 1000)])
+                return self.collect(model, ids, business_id, limit)
+        finally:
+            connection.close()
+
+    def can_run_in_parallel(self):
+        return can_query_concurrently()
+
+    def timed_out(self, model):
+        return {
+            "model": f"{model.__name__}",
+            "count": 0,
+            "results": [],
+            "partial": True,
+            "timed_out": True,
+        }
+
+    def search(self, key: str, business_id, limit: int = 10, parallel=None, timeout=None):
+        """
+        Look `key` up in the business' search index and serialize the
+        best `limit` matches of every registered model, in rank order.
+        Only the models with hits are read, one query each.
+
+        With `parallel` the models are read concurrently, each within
+        `timeout` seconds; a model that runs over comes back empty with
+        `timed_out` set instead of holding up the response.
+
+        Timing out does not stop a read that already started: a thread
+        cannot be interrupted, so the worker runs on and holds its slot
+        of the pool until its query returns. On PostgreSQL the statement
+        timeout set by collect_in_thread() bounds that query to `timeout`
+        as well; elsewhere only MAX_WORKERS bounds the stragglers.
         """
         if not key or not isinstance(key, str):
             return []
 
-        results = []
+        config = self.config()
+        if parallel is None:
+            parallel = config['PARALLEL']
+        timeout = timeout or config['MODEL_TIMEOUT']
+
+        hits = SearchDocument.objects.search(business_id, key, self.models, limit)
+        ids = {model: hits.get(SearchDocument.objects.label(model), []) for model in self.models}
 
-        for model, fields in self.models.items():
-            if not fields:
+        if not parallel or not self.can_run_in_parallel():
+            return [self.collect(model, ids[model], business_id, limit) for model in self.models]
+
+        futures = {
+            model: self.executor().submit(
+                self.collect_in_thread, model, ids[model], business_id, limit, timeout
+            )
+            for model in self.models if ids[model]
+        }
+        deadline = time.monotonic() + timeout
+
+        results = []
+        for model in self.models:
+            future = futures.get(model)
+            if not future:
+                results.append(self.collect(model, [], business_id, limit))
                 continue
 
             try:
-                queryset = model.objects.all()
-            except Exception:
-                continue  # avoids model misconfigurations
+                results.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+            except FuturesTimeoutError:
+                # drops the read if it is still queued; a running one
+                # finishes on its own (see above)
+                future.cancel()
+                results.append(self.timed_out(model))
 
-            # Build OR-based Q object across all fields
-            q_obj = Q()
-            for field in fields:
-                try:
-                    lookup = f"{field}__icontains"
-                    q_obj |= Q(**{lookup: key})
+        return results
 
-                except Exception:
-                    # Skip invalid lookups (numeric fields etc.)
-                    continue
+    async def asearch(self, key: str, business_id, limit: int = 10, timeout=None):
+        """
+        search() for async views: the models with hits are read
+        concurrently on worker threads, each within `timeout` seconds,
+        while the event loop serves other requests.
+        """
+        if not key or not isinstance(key, str):
+            return []
 
-            try:
-                filtered = queryset.filter(q_obj)
-            except Exception:
-                continue
+        timeout = timeout or self.config()['MODEL_TIMEOUT']
+        hits = await sync_to_async(SearchDocument.objects.search)(business_id, key, self.models, limit)
+        ids = {model: hits.get(SearchDocument.objects.label(model), []) for model in self.models}
+
+        if not await sync_to_async(self.can_run_in_parallel)():
+            return await sync_to_async(
+                lambda: [self.collect(model, ids[model], business_id, limit) for model in self.models]
+            )()
 
-            serializer_class = self.serializers.get(model)
-            if serializer_class:
-                try:
-                    serialized = serializer_class(filtered, many=True).data
+        async def collect(model):
+            if not ids[model]:
+                return self.collect(model, [], business_id, limit)
+            try:
+                return await asyncio.wait_for(
+                    sync_to_async(self.collect_in_thread, thread_sensitive=False)(
+                        model, ids[model], business_id, limit, timeout
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                return self.timed_out(model)
 
-                except Exception:
-                    raise Exception("Error serializing objects")
+        return await asyncio.gather(*(collect(model) for model in self.models))
 
-            else:
-                raise Exception(f"No serializer found for model: {model.__name__}")
+    # -----------------------------
+    # Execution Settings
+    # -----------------------------
 
-            results.append({
-                "model": f"{model.__name__}",
-                "count": len(serialized),
-                "results": serialized,
-            })
+    @staticmethod
+    def config():
+        return {
+            'PARALLEL': True,
+            'MAX_WORKERS': 4,
+            'MODEL_TIMEOUT': 2.0,
+            **getattr(settings, 'GLOBAL_SEARCH', {}),
+        }
 
-        return results
+    def executor(self):
+        """
+        Thread pool shared by all searches of the process, so concurrent
+        requests cannot multiply the number of open connections.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config()['MAX_WORKERS'], thread_name_prefix='global-search'
+                )
+        return self._executor
 
 
 GlobalSearch = MultiModelSearchEngine()
 GlobalSearch.set_models({
     SalesInvoice: [
-        'id', 'invoice_number', 'customer__name', 'status', 'payment_status', 'sub_total', 'total', 'discount', 'tax', 'notes', 'created_by__email'
+        'id', 'invoice_number', 'customer__name', 'status', 'payment_status', 'notes', 'created_by__email'
     ],
     SalesInvoiceItem: [
-        'id', 'sales_invoice__id', 'sales_invoice__invoice_number', 'product__name', 'track_code', 'quantity_received', 'unit_price', 'discount'
+        'id', 'sales_invoice__id', 'sales_invoice__invoice_number', 'product__name', 'track_code'
     ],
     PurchaseInvoice: [
-        'id', 'invoice_number', 'supplier__name', 'status', 'payment_status',
-        'sub_total', 'total', 'amount_paid', 'goods_received', 'delivery', 'notes'
+        'id', 'invoice_number', 'supplier__name', 'status', 'payment_status', 'notes'
     ],
     PurchaseInvoiceItem: [
         'id', 'purchase_invoice__id', 'purchase_invoice__invoice_number', 'product__name',
-        'track_code', 'notes', 'unit_cost', 'quantity_received'
+        'track_code', 'notes'
     ],
     InventoryItem: [
-        'id', 'location__name', 'product__name', 'track_code', 'unit_cost', 'unit_price'
+        'id', 'location__name', 'product__name', 'track_code'
     ],
     ReturnedItem: [
         'id', 'invoice_item__sales_invoice__id', 'invoice_item__product__name'
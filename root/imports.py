@@ -0,0 +1,287 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+from inventory.models import Inventory, InventoryItem, StockMovement
+from .models import City, CollectionVersion, Customer, Location, Product, SearchDocument, Supplier, Unit
+
+
+class InvalidRow:
+    """
+    A line of an upload that could not be read as a row; the importer
+    reports it like a row that failed validation.
+    """
+
+    def __init__(self, message):
+        self.errors = {'non_field_errors': [message]}
+
+
+def readRows(file, format=None):
+    """
+    Yield the rows of a CSV or JSONL upload as dicts, one line at a time,
+    so the file is never held in memory. The format defaults to the file
+    extension. Lines that are not valid CSV or not a JSON object come
+    through as an InvalidRow.
+    """
+    format = (format or getattr(file, 'name', '').rsplit('.', 1)[-1]).lower()
+    if format not in ('csv', 'jsonl'):
+        raise ValueError(f"Unsupported import format '{format}', expected csv or jsonl.")
+
+    if isinstance(file, io.TextIOBase):
+        lines = file
+    else:
+        lines = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                yield next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                yield InvalidRow(f"Invalid CSV: {error}.")
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield InvalidRow(f"Invalid JSON: {error}.")
+            continue
+        yield row if isinstance(row, dict) else InvalidRow("Expected a JSON object.")
+
+
+class LookupCache:
+    """
+    Foreign keys of an import referenced by name (or id), resolved with
+    one query per model and chunk for the values not seen before.
+    """
+
+    def __init__(self):
+        self.keys = {}      # {(Model, scope): {value: pk}}
+
+    def resolve(self, model, values, fields=('name',), **scope):
+        keys = self.keys.setdefault((model, tuple(sorted(scope.items()))), {})
+        missing = {str(value).strip() for value in values if value not in (None, '')} - keys.keys()
+        if missing:
+            for field in ('id', *fields):
+                lookup = missing
+                if field == 'id':
+                    lookup = {value for value in missing if value.isdigit()}
+                if not lookup:
+                    continue
+
+                for pk, value in model.objects.filter(**scope, **{f'{field}__in': lookup}).values_list('pk', field):
+                    keys.setdefault(str(value), pk)
+
+        return keys
+
+    def get(self, model, value, **scope):
+        keys = self.keys.get((model, tuple(sorted(scope.items()))), {})
+        return keys.get(str(value).strip()) if value not in (None, '') else None
+
+
+class BulkImporter:
+    """
+    Streams rows into `model` in chunks: the chunk's foreign keys are
+    resolved through the lookup cache, every row is cleaned with the model
+    fields' own validators and the valid rows are inserted with one
+    bulk_create. Invalid rows are skipped and reported with their line.
+
+    Subclasses declare `fields` (plain columns) and `foreign_keys`
+    ({column: (Model, lookup fields, scoped to the business)}).
+    """
+
+    model = None
+    collection = None
+    fields = []
+    required = []
+    foreign_keys = {}
+    MAX_ERRORS = 1000
+    BOOLEANS = {'true': True, 'yes': True, 'y': True, 'false': False, 'no': False, 'n': False}
+
+    def __init__(self, business_id, chunk_size=1000):
+        self.business_id = business_id
+        self.chunk_size = chunk_size
+        self.lookups = LookupCache()
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        rows = enumerate(rows, start=1)
+        while chunk := list(islice(rows, self.chunk_size)):
+            self.import_chunk(chunk)
+
+        return self.result()
+
+    def result(self):
+        """
+        What was imported so far; also reported when the upload breaks off.
+        """
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def import_chunk(self, chunk):
+        invalid = [(line, row) for line, row in chunk if isinstance(row, InvalidRow)]
+        for line, row in invalid:
+            self.reject(line, row.errors)
+        if invalid:
+            chunk = [(line, row) for line, row in chunk if not isinstance(row, InvalidRow)]
+
+        for column, (model, fields, scoped) in self.foreign_keys.items():
+            scope = {'business_id': self.business_id} if scoped else {}
+            self.lookups.resolve(model, [row.get(column) for _, row in chunk], fields, **scope)
+
+        instances = []
+        for line, row in chunk:
+            try:
+                instance = self.build(row)
+                instance._import_line = line
+                instances.append(instance)
+            except ValidationError as error:
+                self.reject(line, error.message_dict if hasattr(error, 'error_dict') else {'non_field_errors': error.messages})
+
+        instances = self.check(instances)
+        if instances:
+            with transaction.atomic():
+                created = self.model.objects.bulk_create(instances, batch_size=self.chunk_size)
+                self.after_create(created)
+            self.created += len(created)
+
+    def build(self, row):
+        values, errors = {}, {}
+        for column in self.fields:
+            field = self.model._meta.get_field(column)
+            value = row.get(column)
+            if isinstance(field, models.BooleanField) and isinstance(value, str):
+                value = self.BOOLEANS.get(value.strip().lower(), value)
+            if value in (None, ''):
+                if column in self.required:
+                    errors[column] = ["This field is required."]
+                continue
+            try:
+                values[column] = field.clean(value, None)
+            except ValidationError as error:
+                errors[column] = error.messages
+
+        for column, (model, _, scoped) in self.foreign_keys.items():
+            value = row.get(column)
+            scope = {'business_id': self.business_id} if scoped else {}
+            pk = self.lookups.get(model, value, **scope)
+            if pk is not None:
+                values[f'{column}_id'] = pk
+            elif value not in (None, ''):
+                errors[column] = [f"Unknown {model._meta.verbose_name} '{value}'."]
+            elif column in self.required:
+                errors[column] = ["This field is required."]
+
+        if errors:
+            raise ValidationError(errors)
+
+        return self.model(business_id=self.business_id, **values)
+
+    def reject(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append({'row': line, 'errors': errors})
+
+    def check(self, instances):
+        """
+        Chunk-level validation, against the database or each other.
+        """
+        return instances
+
+    def after_create(self, instances):
+        SearchDocument.objects.index(instances)
+        CollectionVersion.objects.bump(self.business_id, self.collection)
+
+
+class ProductImporter(BulkImporter):
+    model = Product
+    collection = 'products'
+    fields = ['name', 'desc', 'is_active']
+    required = ['name', 'unit']
+    foreign_keys = {'unit': (Unit, ('name', 'abv'), False)}
+
+
+class CustomerImporter(BulkImporter):
+    model = Customer
+    collection = 'customers'
+    fields = ['name', 'phone', 'email', 'address', 'notes']
+    required = ['name', 'city']
+    foreign_keys = {'city': (City, ('name',), False)}
+
+
+class SupplierImporter(BulkImporter):
+    model = Supplier
+    collection = 'suppliers'
+    fields = ['name', 'business_name', 'phone', 'email', 'notes']
+    required = ['name']
+
+
+class OpeningStockImporter(BulkImporter):
+    """
+    Opening stock: one inventory row per product, logged as an opening
+    movement in the stock ledger.
+    """
+
+    model = InventoryItem
+    collection = 'inventory'
+    fields = ['quantity', 'track_code', 'notes', 'unit_cost', 'unit_price', 'reorder_level']
+    required = ['product', 'quantity']
+    foreign_keys = {
+        'product': (Product, ('name',), True),
+        'location': (Location, ('name',), True),
+    }
+
+    def __init__(self, business_id, chunk_size=1000):
+        super().__init__(business_id, chunk_size)
+        self.inventory_id = Inventory.objects.filter(business_id=business_id).values_list('id', flat=True).first()
+        self.default_location_id = Location.objects.filter(
+            business_id=business_id, is_default=True
+        ).values_list('id', flat=True).first()
+        self.seen = set()
+
+    def build(self, row):
+        item = super().build(row)
+        item.inventory_id = self.inventory_id
+        item.quantity_on_hand = item.quantity
+        item.location_id = item.location_id or self.default_location_id
+        return item
+
+    def check(self, instances):
+        stocked = set(InventoryItem.objects.filter(
+            business_id=self.business_id, product_id__in=[item.product_id for item in instances]
+        ).values_list('product_id', flat=True))
+
+        accepted = []
+        for item in instances:
+            if item.product_id in stocked or item.product_id in self.seen:
+                self.reject(item._import_line, {'product': ["This product is already stocked."]})
+                continue
+            self.seen.add(item.product_id)
+            accepted.append(item)
+        return accepted
+
+    def after_create(self, instances):
+        StockMovement.objects.record('O', None, {item: item.quantity_on_hand for item in instances})
+        super().after_create(instances)
+        Inventory.objects.refresh_glance(pk=self.inventory_id)
+
+
+IMPORTERS = {
+    'products': ProductImporter,
+    'customers': CustomerImporter,
+    'suppliers': SupplierImporter,
+    'opening-stock': OpeningStockImporter,
+}
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from root import benchmarks
+from root.models import Business
+from root.seeding import SCALES, TenantSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the hot API endpoints (latency, query count, peak memory) against a seeded tenant and "
+        "compare the run with a baseline file. Unless --business is given, the tenant is generated in a "
+        "throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small', help="Size of the seeded tenant.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--business', type=int, help="Benchmark this existing business instead of seeding one.")
+        parser.add_argument('--endpoint', action='append', dest='endpoints', choices=[name for name, _ in benchmarks.ENDPOINTS])
+        parser.add_argument('--repeat', type=int, default=20, help="Measured requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=3, help="Unmeasured requests per endpoint first.")
+        parser.add_argument('--baseline', default=str(settings.BASE_DIR / 'benchmarks' / 'baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help="Write this run as the new baseline.")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed latency and memory growth, as a fraction.")
+        parser.add_argument('--fail-on-regression', action='store_true', help="Exit with an error on any regression.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        databases = None
+        try:
+            if options.get('business'):
+                business = Business.objects.filter(pk=options['business']).select_related('owner').first()
+                if business is None:
+                    raise CommandError(f"No business {options['business']}.")
+            else:
+                databases = setup_databases(verbosity=0, interactive=False)
+                self.stdout.write(f"Seeding a {options['scale']} tenant...")
+                business = TenantSeeder(options['scale'], options['seed']).run(name='Benchmark')
+
+            results = benchmarks.run(business, options['repeat'], options['warmup'], options.get('endpoints'))
+        finally:
+            if databases is not None:
+                teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+
+        baseline = benchmarks.load_baseline(options['baseline'])
+        if baseline and not options['save_baseline']:
+            for key in ('scale', 'seed'):
+                if baseline.get(key) != options[key]:
+                    self.stderr.write(f"The baseline was recorded with {key}={baseline.get(key)}, not {options[key]}.")
+            if baseline.get('environment') != benchmarks.environment():
+                self.stderr.write(f"The baseline was recorded on {baseline.get('environment')}.")
+
+        self.stdout.write(benchmarks.report(results, baseline and baseline['endpoints']))
+
+        if options['save_baseline']:
+            benchmarks.save_baseline(options['baseline'], results, scale=options['scale'], seed=options['seed'], repeat=options['repeat'])
+            self.stdout.write(self.style.SUCCESS(f"Saved the baseline to {options['baseline']}."))
+            return
+
+        if not baseline:
+            self.stdout.write(f"No baseline at {options['baseline']}; run with --save-baseline to record one.")
+            return
+
+        regressions = benchmarks.compare(results, baseline['endpoints'], options['tolerance'])
+        for name, found in regressions.items():
+            self.stderr.write(f"{name}: " + ', '.join(found))
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} endpoints regressed.")
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
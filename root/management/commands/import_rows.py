@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from root.imports import IMPORTERS, readRows
+
+
+class Command(BaseCommand):
+    help = "Bulk import products, customers, suppliers or opening stock of a business from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--business', type=int, required=True)
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        importer = IMPORTERS[options['kind']](options['business'], options['chunk_size'])
+        with open(options['path'], 'rb') as file:
+            try:
+                result = importer.run(readRows(file, options.get('format')))
+            except ValueError as error:
+                raise CommandError(error)
+
+        for error in result['errors']:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(f"Created {result['created']} rows, {result['failed']} failed."))
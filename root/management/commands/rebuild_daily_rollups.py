@@ -0,0 +1,47 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from root.models import DailyRollup, Expense
+from sales.models import PurchaseInvoice, ReturnedItem, SalesInvoice, SalesInvoiceItem
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailyRollup table from invoices, expenses and returns."
+
+    SOURCES = [
+        SalesInvoice.objects,
+        SalesInvoiceItem.objects,
+        PurchaseInvoice.objects,
+        Expense.objects,
+        ReturnedItem.objects,
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, help="Only rebuild rows of this business id.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        business_id = options.get('business')
+
+        rows = defaultdict(dict)
+        for manager in self.SOURCES:
+            for row in manager.daily_rollup(business_id).iterator():
+                rows[(row['business_id'], row['day'])].update({
+                    field: row[field] or 0 for field in manager.ROLLUP
+                })
+
+        rollups = [
+            DailyRollup(business_id=business, day=day, **values)
+            for (business, day), values in rows.items()
+        ]
+
+        with transaction.atomic():
+            existing = DailyRollup.objects.all()
+            if business_id:
+                existing = existing.filter(business_id=business_id)
+            existing.delete()
+            DailyRollup.objects.bulk_create(rollups, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rollups)} daily rollup rows."))
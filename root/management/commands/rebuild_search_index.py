@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from root.models import SearchDocument
+
+
+class Command(BaseCommand):
+    help = "Rebuild the global search index from every searchable model."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, help="Only rebuild documents of this business id.")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = SearchDocument.objects.rebuild(options.get('business'), options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} search documents."))
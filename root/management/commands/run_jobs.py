@@ -0,0 +1,67 @@
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection
+
+from root.models import Job
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs until stopped (or, with --once, until the queue is drained)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Number of worker threads.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due.")
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: self.stopping.set())
+
+        Job.objects.requeue_abandoned()
+
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        self.counts = {'D': 0, 'F': 0, 'Q': 0}
+        self.counts_lock = threading.Lock()
+
+        workers = [
+            threading.Thread(target=self.work, args=(f"{name}:{n}", options), daemon=True)
+            for n in range(max(options['concurrency'], 1))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {self.counts['D']} jobs, {self.counts['F']} failed, {self.counts['Q']} queued for retry."
+        ))
+
+    def work(self, name, options):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    jobs = Job.objects.claim(name)
+                except OperationalError as error:
+                    # e.g. "database is locked" on SQLite: back off and retry
+                    self.stderr.write(f"{name}: {error}")
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+
+                if not jobs:
+                    if options['once']:
+                        return
+                    self.stopping.wait(options['poll_interval'])
+                    continue
+
+                for job in jobs:
+                    job.run()
+                    with self.counts_lock:
+                        self.counts[job.status] += 1
+        finally:
+            connection.close()
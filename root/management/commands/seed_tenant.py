@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import User
+from root.seeding import SCALES, TenantSeeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic businesses with products, customers, suppliers and a history of sales and "
+        "purchase invoices, restocks, returns and expenses, for load tests and benchmarks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small', help="Preset sizes, see root.seeding.SCALES.")
+        parser.add_argument('--businesses', type=int, default=1, help="Number of businesses to generate.")
+        parser.add_argument('--owner', help="Email of an existing user to own the businesses (default: a new user each).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed generates the same tenant.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        for count in SCALES['small']:
+            parser.add_argument(f"--{count.replace('_', '-')}", type=int, dest=count, help=f"Override the preset {count}.")
+
+    def handle(self, *args, **options):
+        owner = None
+        if options.get('owner'):
+            owner = User.objects.filter(email=options['owner']).first()
+            if owner is None:
+                raise CommandError(f"No user with email '{options['owner']}'.")
+
+        counts = {count: options.get(count) for count in SCALES['small']}
+        for n in range(options['businesses']):
+            seeder = TenantSeeder(options['scale'], options['seed'] + n, options['batch_size'], **counts)
+            business = seeder.run(owner=owner)
+            self.stdout.write(self.style.SUCCESS(
+                f"Seeded business {business.id} ({business.name}, owner {business.owner.email}): "
+                + ", ".join(f"{value} {count.replace('_', ' ')}" for count, value in seeder.counts.items())
+                + "."
+            ))
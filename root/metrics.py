@@ -0,0 +1,332 @@
+import contextvars
+import os
+import socket
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import BaseSerializer
+
+from .utils import shared_cache
+
+
+METRICS = {
+    'ENABLED': True,
+    'TOKEN': '',                # bearer token of the scraper; staff sessions may read the metrics too
+    'CACHE_ALIAS': None,        # a shared cache where each process publishes its figures for the others to merge
+    'FLUSH_INTERVAL': 10,       # seconds between publications of a process' figures
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+PROCESSES_KEY = 'metrics:processes'
+
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def metrics_config():
+    return {**METRICS, **getattr(settings, 'METRICS', {})}
+
+
+class RequestStats:
+    """
+    What one request spent, filled in by the query and serializer hooks
+    of whatever thread runs on its behalf (see gather_queries).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+    def add(self, queries=0, db_time=0.0, serializer_time=0.0):
+        with self.lock:
+            self.queries += queries
+            self.db_time += db_time
+            self.serializer_time += serializer_time
+
+
+class MetricsRegistry:
+    """
+    Per (route, method) figures of this process: request counts by status
+    class, latency and query count histograms, and DB time, serializer
+    time and response size totals.
+
+    With a shared CACHE_ALIAS every process publishes its figures there
+    now and then; render() sums the latest figures of all processes, so
+    the scraper sees the whole deployment whichever worker answers it.
+    Without one (or with a per-process cache) each process exposes only
+    its own figures. Processes that stopped publishing drop out of the
+    merge once their figures expire.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.process = f"{socket.gethostname()}:{os.getpid()}"
+        self.flushed_at = 0.0
+
+    @staticmethod
+    def empty():
+        return {
+            'requests': {},
+            'latency': [0] * len(LATENCY_BUCKETS) + [0, 0.0],   # buckets, count, sum
+            'queries': [0] * len(QUERY_BUCKETS) + [0, 0],
+            'db_seconds': 0.0,
+            'serializer_seconds': 0.0,
+            'response_bytes': 0,
+        }
+
+    @staticmethod
+    def observe_histogram(histogram, buckets, value):
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[index] += 1
+        histogram[-2] += 1
+        histogram[-1] += value
+
+    def observe(self, route, method, status_code, latency, stats, size):
+        with self.lock:
+            figures = self.routes.setdefault((route, method), self.empty())
+            status_class = f"{status_code // 100}xx"
+            figures['requests'][status_class] = figures['requests'].get(status_class, 0) + 1
+            self.observe_histogram(figures['latency'], LATENCY_BUCKETS, latency)
+            self.observe_histogram(figures['queries'], QUERY_BUCKETS, stats.queries)
+            figures['db_seconds'] += stats.db_time
+            figures['serializer_seconds'] += stats.serializer_time
+            figures['response_bytes'] += size
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [route, method, {**figures, 'requests': dict(figures['requests']),
+                                 'latency': list(figures['latency']), 'queries': list(figures['queries'])}]
+                for (route, method), figures in self.routes.items()
+            ]
+
+    def flush(self, force=False):
+        config = metrics_config()
+        now = time.monotonic()
+        if not force and now - self.flushed_at < config['FLUSH_INTERVAL']:
+            return
+        self.flushed_at = now
+
+        cache = shared_cache(config['CACHE_ALIAS'])
+        if cache is None:
+            return
+
+        timeout = self.publication_timeout(config)
+        cache.set(f"metrics:{self.process}", self.snapshot(), timeout)
+        # every flush renews this process' entry, so a lost update heals
+        # and the entries of stopped processes age out
+        now = time.time()
+        processes = {
+            process: published_at for process, published_at in (cache.get(PROCESSES_KEY) or {}).items()
+            if now - published_at < timeout
+        }
+        processes[self.process] = now
+        cache.set(PROCESSES_KEY, processes, timeout)
+
+    @staticmethod
+    def publication_timeout(config):
+        return config['FLUSH_INTERVAL'] * 30
+
+    def collect(self):
+        """
+        The figures of every process that published lately, summed per
+        route, this process' own ones as they are now.
+        """
+        config = metrics_config()
+        cache = shared_cache(config['CACHE_ALIAS'])
+        published = {}
+        if cache is not None:
+            now, timeout = time.time(), self.publication_timeout(config)
+            processes = {
+                process for process, published_at in (cache.get(PROCESSES_KEY) or {}).items()
+                if now - published_at < timeout
+            } - {self.process}
+            published = cache.get_many([f"metrics:{process}" for process in processes])
+
+        merged = {}
+        for snapshot in [self.snapshot(), *published.values()]:
+            for route, method, figures in snapshot:
+                total = merged.setdefault((route, method), self.empty())
+                for status_class, count in figures['requests'].items():
+                    total['requests'][status_class] = total['requests'].get(status_class, 0) + count
+                for histogram in ('latency', 'queries'):
+                    total[histogram] = [a + b for a, b in zip(total[histogram], figures[histogram])]
+                for field in ('db_seconds', 'serializer_seconds', 'response_bytes'):
+                    total[field] += figures[field]
+        return merged
+
+    def render(self):
+        """
+        All figures in the Prometheus text exposition format.
+        """
+        merged = sorted(self.collect().items())
+        lines = []
+
+        def family(name, kind, help):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, key, buckets):
+            for (route, method), figures in merged:
+                labels = f'route="{escape(route)}",method="{method}"'
+                values = figures[key]
+                for bound, count in zip(buckets, values):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {values[-2]}')
+                lines.append(f'{name}_count{{{labels}}} {values[-2]}')
+                lines.append(f'{name}_sum{{{labels}}} {values[-1]}')
+
+        def counter(name, key):
+            for (route, method), figures in merged:
+                lines.append(f'{name}{{route="{escape(route)}",method="{method}"}} {figures[key]}')
+
+        family('http_requests_total', 'counter', 'Requests by route, method and status class.')
+        for (route, method), figures in merged:
+            for status_class, count in sorted(figures['requests'].items()):
+                lines.append(
+                    f'http_requests_total{{route="{escape(route)}",method="{method}",status="{status_class}"}} {count}'
+                )
+
+        family('http_request_duration_seconds', 'histogram', 'Time to the response, by route.')
+        histogram('http_request_duration_seconds', 'latency', LATENCY_BUCKETS)
+        family('http_request_db_queries', 'histogram', 'SQL queries per request, by route.')
+        histogram('http_request_db_queries', 'queries', QUERY_BUCKETS)
+        family('http_request_db_seconds_total', 'counter', 'Time spent in SQL queries, by route.')
+        counter('http_request_db_seconds_total', 'db_seconds')
+        family('http_request_serializer_seconds_total', 'counter', 'Time spent serializing (queries included), by route.')
+        counter('http_request_serializer_seconds_total', 'serializer_seconds')
+        family('http_response_size_bytes_total', 'counter', 'Response body bytes, by route.')
+        counter('http_response_size_bytes_total', 'response_bytes')
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def routeOf(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return (match.route or match.view_name or '').lstrip('^').rstrip('$')
+
+
+class MetricsMiddleware:
+    """
+    Records latency, SQL queries and DB time, serializer time and response
+    size of every request against its URL route. Goes first in
+    MIDDLEWARE so the time of the other middleware is included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics_config()['ENABLED']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        registry.flush()
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        self.finish(request, response, stats, started)
+        await sync_to_async(registry.flush)()
+        return response
+
+    @staticmethod
+    def start():
+        stats = RequestStats()
+        return stats, _request_stats.set(stats), time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, stats, started):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.url_name == 'metrics':
+            return
+
+        size = 0 if response.streaming else len(response.content)
+        registry.observe(
+            routeOf(request), request.method, response.status_code,
+            time.perf_counter() - started, stats, size,
+        )
+
+
+def recordQuery(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(queries=1, db_time=time.perf_counter() - started)
+
+
+def instrumentConnection(sender, connection, **kwargs):
+    if recordQuery not in connection.execute_wrappers:
+        connection.execute_wrappers.append(recordQuery)
+
+
+def install():
+    """
+    Hook the query and serializer timings in; called from RootConfig.ready().
+    Every connection, including those of worker threads, gets the query
+    wrapper as it connects. Serializer time is taken around `.data` of
+    the outermost serializer, nested ones being part of it.
+    """
+    if not metrics_config()['ENABLED']:
+        return
+
+    connection_created.connect(instrumentConnection, dispatch_uid='metrics-queries')
+    for connection in connections.all(initialized_only=True):
+        instrumentConnection(None, connection)
+
+    data = BaseSerializer.data
+    if getattr(data.fget, 'instrumented', False):
+        return
+
+    def timedData(self):
+        stats = _request_stats.get()
+        if stats is None:
+            return data.fget(self)
+        started = time.perf_counter()
+        try:
+            return data.fget(self)
+        finally:
+            stats.add(serializer_time=time.perf_counter() - started)
+
+    timedData.instrumented = True
+    BaseSerializer.data = property(timedData)
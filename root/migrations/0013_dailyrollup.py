@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-17 22:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('root', '0012_expense'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('sales_total', models.FloatField(default=0)),
+                ('sales_invoices', models.IntegerField(default=0)),
+                ('items_sold', models.IntegerField(default=0)),
+                ('purchases_total', models.FloatField(default=0)),
+                ('purchase_invoices', models.IntegerField(default=0)),
+                ('expenses_total', models.FloatField(default=0)),
+                ('expenses', models.IntegerField(default=0)),
+                ('returned_items', models.IntegerField(default=0)),
+                ('returned_quantity', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='root.business')),
+            ],
+            options={
+                'unique_together': {('business', 'day')},
+            },
+        ),
+    ]
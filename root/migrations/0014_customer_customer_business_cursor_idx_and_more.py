@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('root', '0013_dailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['business', '-created_at', 'id'], name='customer_business_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['business', '-created_at', 'id'], name='product_business_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:08
+
+import django.db.models.deletion
+from django.db import OperationalError, migrations, models
+
+
+POSTGRESQL_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX root_searchdocument_body_fts ON root_searchdocument USING GIN (to_tsvector('simple', body))",
+    "CREATE INDEX root_searchdocument_body_trgm ON root_searchdocument USING GIN (body gin_trgm_ops)",
+]
+
+SQLITE_INDEXES = [
+    "CREATE VIRTUAL TABLE root_searchdocument_fts USING fts5(body, content='root_searchdocument', content_rowid='id')",
+    """CREATE TRIGGER root_searchdocument_fts_insert AFTER INSERT ON root_searchdocument BEGIN
+        INSERT INTO root_searchdocument_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+    """CREATE TRIGGER root_searchdocument_fts_delete AFTER DELETE ON root_searchdocument BEGIN
+        INSERT INTO root_searchdocument_fts(root_searchdocument_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END""",
+    """CREATE TRIGGER root_searchdocument_fts_update AFTER UPDATE ON root_searchdocument BEGIN
+        INSERT INTO root_searchdocument_fts(root_searchdocument_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO root_searchdocument_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for statement in POSTGRESQL_INDEXES:
+            schema_editor.execute(statement)
+
+    elif vendor == 'sqlite':
+        try:
+            for statement in SQLITE_INDEXES:
+                schema_editor.execute(statement)
+        except OperationalError:
+            # sqlite built without FTS5, searches fall back to icontains
+            pass
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS root_searchdocument_body_trgm")
+        schema_editor.execute("DROP INDEX IF EXISTS root_searchdocument_body_fts")
+
+    elif vendor == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS root_searchdocument_fts_{trigger}")
+        schema_editor.execute("DROP TABLE IF EXISTS root_searchdocument_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('root', '0014_customer_customer_business_cursor_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('body', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='root.business')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['business', 'model'], name='searchdoc_business_model_idx')],
+                'unique_together': {('model', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
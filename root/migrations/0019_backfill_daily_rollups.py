@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_daily_rollups(apps, schema_editor):
+    """
+    Fill DailyRollup from the history that predates it, as
+    `manage.py rebuild_daily_rollups` does; the rows the signals wrote
+    since 0013 are rebuilt along with the rest.
+    """
+    DailyRollup = apps.get_model('root', 'DailyRollup')
+    sources = [
+        (apps.get_model('sales', 'SalesInvoice'), 'created_at', {
+            'sales_total': Coalesce(models.Sum('total'), 0.0),
+            'sales_invoices': models.Count('id'),
+        }),
+        (apps.get_model('sales', 'SalesInvoiceItem'), 'sales_invoice__created_at', {
+            'items_sold': Coalesce(models.Sum('quantity'), 0),
+        }),
+        (apps.get_model('sales', 'PurchaseInvoice'), 'created_at', {
+            'purchases_total': Coalesce(models.Sum('total'), 0.0),
+            'purchase_invoices': models.Count('id'),
+        }),
+        (apps.get_model('root', 'Expense'), 'created_at', {
+            'expenses_total': Coalesce(models.Sum('amount'), 0.0),
+            'expenses': models.Count('id'),
+        }),
+        (apps.get_model('sales', 'ReturnedItem'), 'created_at', {
+            'returned_items': models.Count('id'),
+            'returned_quantity': Coalesce(models.Sum('quantity'), 0),
+        }),
+    ]
+
+    rows = defaultdict(dict)
+    for model, date_field, aggregates in sources:
+        grouped = (
+            model.objects
+            .order_by()
+            .annotate(day=TruncDate(date_field))
+            .values('business_id', 'day')
+            .annotate(**aggregates)
+        )
+        for row in grouped.iterator():
+            rows[(row['business_id'], row['day'])].update({
+                field: row[field] or 0 for field in aggregates
+            })
+
+    DailyRollup.objects.all().delete()
+    DailyRollup.objects.bulk_create([
+        DailyRollup(business_id=business_id, day=day, **values)
+        for (business_id, day), values in rows.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('root', '0018_job_progress'),
+        ('sales', '0011_salesreservation_expires_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_rollups, migrations.RunPython.noop),
+    ]
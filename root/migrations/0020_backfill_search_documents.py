@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.db import migrations
+
+
+# GlobalSearch's fields (root.filters) as of this migration
+SEARCH_FIELDS = {
+    ('sales', 'SalesInvoice'): [
+        'id', 'invoice_number', 'customer__name', 'status', 'payment_status', 'notes', 'created_by__email'
+    ],
+    ('sales', 'SalesInvoiceItem'): [
+        'id', 'sales_invoice__id', 'sales_invoice__invoice_number', 'product__name', 'track_code'
+    ],
+    ('sales', 'PurchaseInvoice'): [
+        'id', 'invoice_number', 'supplier__name', 'status', 'payment_status', 'notes'
+    ],
+    ('sales', 'PurchaseInvoiceItem'): [
+        'id', 'purchase_invoice__id', 'purchase_invoice__invoice_number', 'product__name',
+        'track_code', 'notes'
+    ],
+    ('inventory', 'InventoryItem'): [
+        'id', 'location__name', 'product__name', 'track_code'
+    ],
+    ('sales', 'ReturnedItem'): [
+        'id', 'invoice_item__sales_invoice__id', 'invoice_item__product__name'
+    ],
+    ('root', 'Product'): [
+        'id', 'name', 'desc', 'unit__name'
+    ],
+    ('root', 'Customer'): [
+        'id', 'name', 'phone', 'email', 'address', 'city__name'
+    ],
+    ('root', 'Supplier'): [
+        'id', 'name', 'business_name', 'phone', 'email', 'notes'
+    ],
+    ('root', 'Location'): [
+        'id', 'name', 'address'
+    ],
+}
+
+
+def body(instance, fields):
+    values = []
+    for path in fields:
+        value = instance
+        for attr in path.split('__'):
+            value = getattr(value, attr, None)
+            if value is None:
+                break
+
+        if value not in (None, ''):
+            values.append(str(value))
+
+    return ' '.join(values)
+
+
+def backfill_search_documents(apps, schema_editor, batch_size=500):
+    """
+    Index the rows that existed before 0015 created the index, as
+    `manage.py rebuild_search_index` does.
+    """
+    SearchDocument = apps.get_model('root', 'SearchDocument')
+
+    for (app_label, model_name), fields in SEARCH_FIELDS.items():
+        model = apps.get_model(app_label, model_name)
+        related = {path.rsplit('__', 1)[0] for path in fields if '__' in path}
+        queryset = model.objects.select_related(*related).order_by()
+
+        batch = []
+        for instance in queryset.iterator(chunk_size=batch_size):
+            batch.append(SearchDocument(
+                business_id=instance.business_id,
+                model=model._meta.label_lower,
+                object_id=instance.pk,
+                body=body(instance, fields),
+            ))
+            if len(batch) == batch_size:
+                SearchDocument.objects.bulk_create(
+                    batch, update_conflicts=True, unique_fields=['model', 'object_id'],
+                    update_fields=['business', 'body', 'updated_at'],
+                )
+                batch = []
+        SearchDocument.objects.bulk_create(
+            batch, update_conflicts=True, unique_fields=['model', 'object_id'],
+            update_fields=['business', 'body', 'updated_at'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('root', '0019_backfill_daily_rollups'),
+        ('sales', '0011_salesreservation_expires_at'),
+        ('inventory', '0013_stock_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,16 @@
-from django.db import models
-from django.db.models.functions import TruncDate
+import re
+import threading
+import traceback
+import uuid
+import weakref
+from collections import defaultdict
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.functions import Coalesce, RowNumber, TruncDate
 from calendar import monthrange
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, time, timedelta
 from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
 
 # Create your models here.
 
@@ -12,37 +20,55 @@ class BaseQuerySet(models.QuerySet):
         return self.filter(business_id=business_id)
 
     def in_period(self, days):
+        return self.filter(self.period_filter(days))
+
+    @staticmethod
+    def period_filter(days):
+        """
+        Q() matching rows created in the last `days` days. Used both by
+        in_period() and as the `filter=` of conditional aggregates.
+        """
         start = datetime.today() - timedelta(days=days)
-        return self.filter(created_at__gte = start)
+        return models.Q(created_at__gte = start)
     
     def monthly_trend(self, business_id, field):
         today = date.today()
-        year = today.year
-        month = today.month
 
-        # 1. Get correct number of days in the month
-        _, days_in_month = monthrange(year, month)
-
-        # 2. Aggregate sales by date
+        # 1. Aggregate sales by date
         qs = (
             self
             .for_business(business_id)
             .filter(
-                created_at__year=year,
-                created_at__month=month
+                created_at__year=today.year,
+                created_at__month=today.month
             )
             .annotate(day=TruncDate("created_at"))
             .values("day")
             .annotate(total=models.Sum(field))
         )
 
-        # 3. Convert queryset to lookup map
+        # 2. Convert queryset to lookup map
         sales_map = {
             item["day"]: float(item["total"])
             for item in qs
         }
 
-        # 4. Build full month result
+        return self.month_series(sales_map)
+
+    @staticmethod
+    def month_series(values_map):
+        """
+        Expand a {date: value} map into one entry per day of the current
+        month, zero filling missing and future days.
+        """
+        today = date.today()
+        year = today.year
+        month = today.month
+
+        # 1. Get correct number of days in the month
+        _, days_in_month = monthrange(year, month)
+
+        # 2. Build full month result
         result = []
 
         for day_num in range(1, days_in_month + 1):
@@ -51,7 +77,7 @@ class BaseQuerySet(models.QuerySet):
             if current_date > today:
                 total_sales = 0.0
             else:
-                total_sales = sales_map.get(current_date, 0.0)
+                total_sales = float(values_map.get(current_date) or 0.0)
 
             result.append({
                 "day": current_date.isoformat(),
@@ -60,6 +86,31 @@ class BaseQuerySet(models.QuerySet):
 
         return result
 
+    def daily_rollup(self, aggregates, business_id=None, day=None, date_field='created_at'):
+        """
+        Group rows by (business, day) and compute `aggregates` for each
+        group. Optionally restricted to one business and / or one day.
+        Feeds the DailyRollup table.
+        """
+        queryset = self
+        if business_id:
+            queryset = queryset.for_business(business_id)
+
+        if day:
+            start = datetime.combine(day, time.min, tzinfo=timezone.get_current_timezone())
+            queryset = queryset.filter(**{
+                f'{date_field}__gte': start,
+                f'{date_field}__lt': start + timedelta(days=1),
+            })
+
+        return (
+            queryset
+            .order_by()
+            .annotate(day=TruncDate(date_field))
+            .values('business_id', 'day')
+            .annotate(**aggregates)
+        )
+
 
 class City(models.Model):
 
@@ -90,6 +141,31 @@ class Unit(models.Model):
         return f"{ self.name }"
 
 
+class BusinessManager(models.Manager):
+
+    def kpis(self, business_id):
+        """
+        Row counts of every business owned reference table, computed as
+        scalar subqueries of a single query against Business.
+        """
+        def count_of(model):
+            return Coalesce(models.Subquery(
+                model.objects
+                .filter(business_id=models.OuterRef('pk'))
+                .order_by()
+                .values('business_id')
+                .annotate(count=models.Count('id'))
+                .values('count')
+            ), 0)
+
+        return self.get_queryset().filter(pk=business_id).values(
+            total_customers=count_of(Customer),
+            total_products=count_of(Product),
+            total_suppliers=count_of(Supplier),
+            total_locations=count_of(Location),
+        ).first() or {}
+
+
 class Business(models.Model):
 
     name = models.CharField(max_length=256)
@@ -103,6 +179,8 @@ class Business(models.Model):
     logo = models.ImageField(upload_to="business_logos/", null=True, blank=True)
     is_active = models.BooleanField(default=False)
 
+    objects = BusinessManager()
+
     def __str__(self):
         return f"{ self.name }"
 
@@ -150,6 +228,11 @@ class Customer(models.Model):
     def __str__(self):
         return f"{self.email}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', '-created_at', 'id'], name='customer_business_cursor_idx'),
+        ]
+
 
 class LocationQuerySet(BaseQuerySet):
     pass
@@ -209,6 +292,11 @@ class Product(models.Model):
     def __str__(self):
         return f"{self.name}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', '-created_at', 'id'], name='product_business_cursor_idx'),
+        ]
+
 
 class BaseItem(models.Model):
 
@@ -261,8 +349,16 @@ class ExpenseQuerySet(BaseQuerySet):
 
 class ExpenseManager(models.Manager):
 
+    ROLLUP = {
+        'expenses_total': Coalesce(models.Sum('amount'), 0.0),
+        'expenses': models.Count('id'),
+    }
+
     def get_queryset(self):
         return ExpenseQuerySet(self.model)
+
+    def daily_rollup(self, business_id=None, day=None):
+        return self.get_queryset().daily_rollup(self.ROLLUP, business_id, day)
     
     def total_expenses(self, business_id, num_days=None):
 
@@ -272,15 +368,22 @@ class ExpenseManager(models.Manager):
         return self.get_queryset().for_business(business_id).count()
     
     def total_expense_amount(self, business_id, num_days=None):
-        queryset = self.get_queryset().for_business(business_id)
-
         if num_days:
-            queryset = queryset.in_period(num_days)
+            return DailyRollup.objects.period_totals(business_id, num_days)['expenses_total']
 
+        queryset = self.get_queryset().for_business(business_id)
         return queryset.aggregate(total=models.Sum("amount"))["total"] or 0
 
     def monthly_expenses_trend(self, business_id):
-        return self.get_queryset().monthly_trend(business_id, 'amount')
+        return DailyRollup.objects.monthly_trend(business_id, 'expenses_total')
+
+    async def amonthly_expenses_trend(self, business_id):
+        return await DailyRollup.objects.amonthly_trend(business_id, 'expenses_total')
+
+    def kpis(self, business_id):
+        return self.get_queryset().for_business(business_id).aggregate(
+            total_expenses=models.Count('id'),
+        )
 
 class Expense(models.Model):
     business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='expenses')
@@ -290,3 +393,675 @@ class Expense(models.Model):
     amount = models.FloatField(default=0)
 
     objects = ExpenseManager()
+
+
+class DailyRollupQuerySet(BaseQuerySet):
+
+    def in_last_days(self, num_days):
+        """
+        Rows for the last `num_days` calendar days, today included.
+        """
+        return self.filter(day__gt=timezone.localdate() - timedelta(days=num_days))
+
+    def month_rows(self, business_id, field):
+        today = timezone.localdate()
+        return (
+            self
+            .for_business(business_id)
+            .filter(day__year=today.year, day__month=today.month)
+            .values_list('day', field)
+        )
+
+    def monthly_trend(self, business_id, field):
+        return self.month_series(dict(self.month_rows(business_id, field)))
+
+    async def amonthly_trend(self, business_id, field):
+        return self.month_series(dict([row async for row in self.month_rows(business_id, field)]))
+
+
+_business_deletions = threading.local()     # {business id: weakref to the BusinessDeletion of its transaction}
+
+
+class BusinessDeletion:
+    """
+    Marks a business whose delete is cascading in this thread's
+    transaction. transaction.on_commit() holds the only strong reference:
+    once the transaction commits, or rolls the delete back, the mark is
+    gone with it, like PendingVersions.
+    """
+
+    def __call__(self):
+        pass
+
+    @staticmethod
+    def start(business_id):
+        deletion = BusinessDeletion()
+        if not hasattr(_business_deletions, 'marks'):
+            _business_deletions.marks = {}
+        _business_deletions.marks[business_id] = weakref.ref(deletion)
+        transaction.on_commit(deletion)
+
+    @staticmethod
+    def under_way(business_id):
+        reference = getattr(_business_deletions, 'marks', {}).get(business_id)
+        return reference is not None and reference() is not None
+
+
+class DailyRollupManager(models.Manager):
+
+    def get_queryset(self):
+        return DailyRollupQuerySet(self.model)
+
+    def refresh(self, business_id, day, *managers):
+        """
+        Recompute the columns owned by each source manager (its ROLLUP)
+        for a single (business, day) row. Only that day's source rows are
+        read, so the cost does not grow with history.
+
+        The row is locked before the sources are read: concurrent refreshes
+        of the same day run one after the other, each reading what the
+        previous one committed, so none writes totals that miss the rows
+        of another (READ COMMITTED). Nothing is written for a business
+        that is being deleted or no longer exists.
+        """
+        with transaction.atomic(using=self.db):
+            # the rows deleted with a business (and the invoices they
+            # save on the way) would insert its rollup again
+            if BusinessDeletion.under_way(business_id) or not Business.objects.filter(pk=business_id).exists():
+                return None, False
+            rollup, created = self.select_for_update().get_or_create(business_id=business_id, day=day)
+
+            values = {}
+            for manager in managers:
+                rows = list(manager.daily_rollup(business_id, day))
+                row = rows[0] if rows else {}
+                values.update({
+                    field: row.get(field) or 0 for field in manager.ROLLUP
+                })
+
+            for field, value in values.items():
+                setattr(rollup, field, value)
+            rollup.save(update_fields=[*values, 'updated_at'])
+
+        return rollup, created
+
+    def period_totals(self, business_id, num_days):
+        queryset = self.get_queryset().for_business(business_id).in_last_days(num_days)
+        return queryset.aggregate(**{
+            field: models.Sum(field, default=0) for field in self.model.METRICS
+        })
+
+    def monthly_trend(self, business_id, field):
+        return self.get_queryset().monthly_trend(business_id, field)
+
+    async def amonthly_trend(self, business_id, field):
+        return await self.get_queryset().amonthly_trend(business_id, field)
+
+    def kpis(self, business_id):
+        """
+        Today's and month to date figures for every metric, in one query.
+        """
+        today = timezone.localdate()
+        daily = models.Q(day=today)
+        monthly = models.Q(day__gte=today.replace(day=1))
+
+        aggregates = {}
+        for field in self.model.METRICS:
+            aggregates[f'daily_{field}'] = models.Sum(field, filter=daily, default=0)
+            aggregates[f'monthly_{field}'] = models.Sum(field, filter=monthly, default=0)
+
+        return self.get_queryset().for_business(business_id).filter(monthly).aggregate(**aggregates)
+
+
+class DailyRollup(models.Model):
+    """
+    Per business, per day totals of sales, purchases, expenses and
+    returns. Maintained from model signals and rebuilt with
+    `manage.py rebuild_daily_rollups`.
+    """
+
+    METRICS = [
+        'sales_total', 'sales_invoices', 'items_sold',
+        'purchases_total', 'purchase_invoices',
+        'expenses_total', 'expenses',
+        'returned_items', 'returned_quantity',
+    ]
+
+    business = models.ForeignKey(Business, models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    sales_total = models.FloatField(default=0)
+    sales_invoices = models.IntegerField(default=0)
+    items_sold = models.IntegerField(default=0)
+    purchases_total = models.FloatField(default=0)
+    purchase_invoices = models.IntegerField(default=0)
+    expenses_total = models.FloatField(default=0)
+    expenses = models.IntegerField(default=0)
+    returned_items = models.IntegerField(default=0)
+    returned_quantity = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DailyRollupManager()
+
+    def __str__(self):
+        return f"{self.business_id}-{self.day}"
+
+    class Meta:
+        unique_together = [('business', 'day')]
+
+
+class SearchDocumentManager(models.Manager):
+    """
+    One SearchDocument per searchable row, holding the text of the fields
+    registered for its model. Lookups are scoped to a business, ranked and
+    capped per model. PostgreSQL matches through the tsvector and trigram
+    GIN indexes, SQLite through the FTS5 table (both created by migration
+    0015); any other backend falls back to icontains on the body.
+    """
+
+    fields = {}     # {Model: [field paths]}
+    _dependents = {}
+
+    def register(self, model, fields):
+        self.fields[model] = fields
+        self._dependents.clear()
+
+    def dependents(self, model):
+        """
+        {(registered model, lookup): {fields of `model`}}: the documents
+        whose body reads columns of `model` through a relation, the lookup
+        from their model to the row of `model` and the columns they read.
+        """
+        if model not in self._dependents:
+            found = defaultdict(set)
+            for dependent, paths in self.fields.items():
+                for path in paths:
+                    parts = path.split('__')
+                    current = dependent
+                    for depth, part in enumerate(parts[:-1]):
+                        current = current._meta.get_field(part).related_model
+                        if current is model:
+                            field = model._meta.get_field(parts[depth + 1])
+                            if not field.primary_key:
+                                found[(dependent, '__'.join(parts[:depth + 1]))].add(field)
+            self._dependents[model] = dict(found)
+        return self._dependents[model]
+
+    def related_models(self):
+        """
+        The models whose columns appear in the documents of others.
+        """
+        related = set()
+        for model, paths in self.fields.items():
+            for path in paths:
+                current = model
+                for part in path.split('__')[:-1]:
+                    current = current._meta.get_field(part).related_model
+                    related.add(current)
+        return {model for model in related if self.dependents(model)}
+
+    @staticmethod
+    def label(model):
+        return model._meta.label_lower
+
+    @staticmethod
+    def tokens(key):
+        return re.findall(r'\w+', key or '')
+
+    def body(self, instance, fields):
+        values = []
+        for path in fields:
+            value = instance
+            for attr in path.split('__'):
+                value = getattr(value, attr, None)
+                if value is None:
+                    break
+
+            if value not in (None, ''):
+                values.append(str(value))
+
+        return ' '.join(values)
+
+    def index(self, instances, batch_size=500):
+        """
+        Insert or refresh the documents of `instances`, which may belong
+        to different registered models, with one upsert per batch.
+        """
+        by_model = defaultdict(list)
+        for instance in instances:
+            if type(instance) in self.fields and instance.pk is not None:
+                by_model[type(instance)].append(instance)
+
+        # load the related rows the bodies traverse once per model
+        for model, group in by_model.items():
+            related = {path.rsplit('__', 1)[0] for path in self.fields[model] if '__' in path}
+            models.prefetch_related_objects(group, *related)
+
+        documents = [
+            self.model(
+                business_id=instance.business_id,
+                model=self.label(model),
+                object_id=instance.pk,
+                body=self.body(instance, self.fields[model]),
+            )
+            for model, group in by_model.items() for instance in group
+        ]
+
+        return self.bulk_create(
+            documents, batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['model', 'object_id'],
+            update_fields=['business', 'body', 'updated_at'],
+        )
+
+    def remove(self, model, object_ids):
+        return self.filter(model=self.label(model), object_id__in=object_ids).delete()
+
+    def rebuild(self, business_id=None, batch_size=500):
+        """
+        Drop and re-create the documents of every registered model,
+        optionally for a single business. Returns the number indexed.
+        """
+        existing = self.get_queryset()
+        if business_id:
+            existing = existing.filter(business_id=business_id)
+        existing.delete()
+
+        indexed = 0
+        for model, fields in self.fields.items():
+            related = {path.rsplit('__', 1)[0] for path in fields if '__' in path}
+            queryset = model.objects.select_related(*related).order_by()
+            if business_id:
+                queryset = queryset.filter(business_id=business_id)
+            indexed += self.index_queryset(queryset, batch_size)
+
+        return indexed
+
+    def index_queryset(self, queryset, batch_size=500):
+        indexed = 0
+        batch = []
+        for instance in queryset.iterator(chunk_size=batch_size):
+            batch.append(instance)
+            if len(batch) == batch_size:
+                indexed += len(self.index(batch, batch_size))
+                batch = []
+        indexed += len(self.index(batch, batch_size))
+        return indexed
+
+    def reindex_dependents(self, instance, changed, batch_size=500):
+        """
+        Refresh the documents that show any of the `changed` field names
+        of `instance`, e.g. the invoices and lines of a renamed customer
+        or product. Returns the number indexed.
+        """
+        indexed = 0
+        for (model, lookup), fields in self.dependents(type(instance)).items():
+            if not {field.name for field in fields} & set(changed):
+                continue
+            queryset = model.objects.filter(**{lookup: instance.pk}).order_by()
+            indexed += self.index_queryset(queryset, batch_size)
+        return indexed
+
+    def search(self, business_id, key, models=None, limit=10):
+        """
+        Best `limit` matches of `key` per model for one business, as
+        {model label: [object ids in rank order]}.
+        """
+        tokens = self.tokens(key)
+        if not tokens:
+            return {}
+
+        labels = [self.label(model) for model in (models or self.fields)]
+        connection = connections[self.db]
+
+        if connection.vendor == 'postgresql':
+            rows = self._search_postgresql(connection, business_id, key, tokens, labels, limit)
+        elif connection.vendor == 'sqlite' and self._has_fts_table(connection):
+            rows = self._search_sqlite(connection, business_id, tokens, labels, limit)
+        else:
+            rows = self._search_fallback(business_id, key, labels, limit)
+
+        hits = defaultdict(list)
+        for model, object_id in rows:
+            hits[model].append(object_id)
+        return dict(hits)
+
+    def _has_fts_table(self, connection):
+        return f'{self.model._meta.db_table}_fts' in connection.introspection.table_names()
+
+    def _search_postgresql(self, connection, business_id, key, tokens, labels, limit):
+        table = self.model._meta.db_table
+        pattern = '%' + re.sub(r'([\\%_])', r'\\\1', key.strip()) + '%'
+        sql = f"""
+            SELECT model, object_id FROM (
+                SELECT d.model, d.object_id, ROW_NUMBER() OVER (
+                    PARTITION BY d.model ORDER BY
+                    ts_rank(to_tsvector('simple', d.body), to_tsquery('simple', %s))
+                    + similarity(d.body, %s) DESC, d.object_id DESC
+                ) AS position
+                FROM {table} d
+                WHERE d.business_id = %s
+                  AND d.model = ANY(%s)
+                  AND (to_tsvector('simple', d.body) @@ to_tsquery('simple', %s) OR d.body ILIKE %s)
+            ) ranked
+            WHERE position <= %s
+            ORDER BY model, position
+        """
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [tsquery, key, business_id, labels, tsquery, pattern, limit])
+            return cursor.fetchall()
+
+    def _search_sqlite(self, connection, business_id, tokens, labels, limit):
+        table = self.model._meta.db_table
+        placeholders = ', '.join(['%s'] * len(labels))
+        sql = f"""
+            SELECT model, object_id FROM (
+                SELECT d.model, d.object_id, ROW_NUMBER() OVER (
+                    PARTITION BY d.model ORDER BY matches.rank, d.object_id DESC
+                ) AS position
+                FROM (
+                    SELECT rowid AS document_id, bm25({table}_fts) AS rank
+                    FROM {table}_fts WHERE {table}_fts MATCH %s
+                ) matches
+                JOIN {table} d ON d.id = matches.document_id
+                WHERE d.business_id = %s AND d.model IN ({placeholders})
+            ) ranked
+            WHERE position <= %s
+            ORDER BY model, position
+        """
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, business_id, *labels, limit])
+            return cursor.fetchall()
+
+    def _search_fallback(self, business_id, key, labels, limit):
+        return (
+            self.get_queryset()
+            .filter(business_id=business_id, model__in=labels, body__icontains=key.strip())
+            .annotate(position=models.Window(
+                RowNumber(), partition_by=models.F('model'), order_by=models.F('object_id').desc()
+            ))
+            .filter(position__lte=limit)
+            .order_by('model', 'position')
+            .values_list('model', 'object_id')
+        )
+
+
+class SearchDocument(models.Model):
+    """
+    Denormalized, per business search text of one row of a searchable
+    model (see GlobalSearch in root.filters). Kept current by signals and
+    rebuilt with `manage.py rebuild_search_index`.
+    """
+
+    business = models.ForeignKey(Business, models.CASCADE, related_name='search_documents')
+    model = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    body = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SearchDocumentManager()
+
+    def __str__(self):
+        return f"{self.model}-{self.object_id}"
+
+    class Meta:
+        unique_together = [('model', 'object_id')]
+        indexes = [
+            models.Index(fields=['business', 'model'], name='searchdoc_business_model_idx'),
+        ]
+
+
+_running_job = threading.local()
+
+
+class JobManager(models.Manager):
+    """
+    A job queue on a plain table, so background work needs no broker.
+    Jobs are enqueued in the caller's transaction and only become visible
+    to workers once it commits. Workers claim jobs with
+    SELECT ... FOR UPDATE SKIP LOCKED where the backend supports it; on
+    SQLite, which serializes writers anyway, the conditional UPDATE of
+    the claim alone keeps two workers from taking the same job.
+    """
+
+    @staticmethod
+    def config():
+        return {
+            'MAX_ATTEMPTS': 3,
+            'RETRY_DELAY': 10,          # seconds, doubled on every attempt
+            'LOCK_TIMEOUT': 600,        # seconds before a running job counts as abandoned
+            'BACKGROUND_POSTING': False,
+            **getattr(settings, 'JOB_QUEUE', {}),
+        }
+
+    def enqueue(self, task, payload=None, key=None, business_id=None, run_at=None, max_attempts=None):
+        """
+        Queue `task` (dotted path of a function called with **payload). A
+        key makes the call idempotent: while a job with the same key is
+        still waiting, that job is returned instead of queueing another.
+        """
+        job = self.model(
+            task=task, payload=payload or {}, key=key, business_id=business_id,
+            run_at=run_at or timezone.now(),
+            max_attempts=max_attempts or self.config()['MAX_ATTEMPTS'],
+        )
+        if key is None:
+            job.save()
+            return job
+
+        try:
+            with transaction.atomic():
+                job.save()
+            return job
+        except IntegrityError:
+            # claimed in the meantime: then this one is queued after all
+            existing = self.filter(key=key, status='Q').first()
+            return existing or self.enqueue(task, payload, key, business_id, run_at, max_attempts)
+
+    def claim(self, worker, limit=1):
+        """
+        Mark up to `limit` due jobs as running for `worker` and return them.
+        """
+        token = f"{worker}:{uuid.uuid4().hex}"
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db):
+            due = self.filter(status='Q', run_at__lte=timezone.now()).order_by('run_at', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            ids = list(due.values_list('id', flat=True)[:limit])
+            if not ids:
+                return []
+
+            self.filter(pk__in=ids, status='Q').update(
+                status='R', locked_by=token, locked_at=timezone.now(),
+                attempts=models.F('attempts') + 1,
+            )
+        return list(self.filter(locked_by=token, status='R'))
+
+    def report_progress(self, **progress):
+        """
+        Store how far the job running in this thread got, for clients
+        polling it; a no-op when called outside of a job.
+        """
+        job = getattr(_running_job, 'job', None)
+        if job is not None:
+            job.progress = progress
+            self.filter(pk=job.pk).update(progress=progress)
+
+    def requeue_abandoned(self):
+        """
+        Put jobs back whose worker died while running them.
+        """
+        expired = timezone.now() - timedelta(seconds=self.config()['LOCK_TIMEOUT'])
+        return self.filter(status='R', locked_at__lt=expired).update(status='Q', locked_by='', locked_at=None)
+
+
+class Job(models.Model):
+    """
+    One unit of background work, run by `manage.py run_jobs`.
+    """
+
+    JOB_STATUSES = [
+        ("Q", "QUEUED"),
+        ("R", "RUNNING"),
+        ("D", "DONE"),
+        ("F", "FAILED"),
+    ]
+
+    business = models.ForeignKey(Business, models.CASCADE, related_name='jobs', null=True, blank=True)
+    task = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict, blank=True)
+    key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=1, choices=JOB_STATUSES, default='Q')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    progress = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = JobManager()
+
+    def __str__(self):
+        return f"{self.task} ({self.get_status_display()})"
+
+    def run(self):
+        """
+        Run a claimed job and record the outcome; failures are retried
+        with exponential backoff until max_attempts is reached.
+        """
+        _running_job.job = self
+        try:
+            import_string(self.task)(**self.payload)
+        except Exception:
+            self.last_error = traceback.format_exc()
+            superseded = self.key and Job.objects.filter(key=self.key, status='Q').exists()
+            if self.attempts < self.max_attempts and not superseded:
+                delay = Job.objects.config()['RETRY_DELAY'] * 2 ** (self.attempts - 1)
+                self.status, self.run_at = 'Q', timezone.now() + timedelta(seconds=delay)
+            else:
+                self.status, self.finished_at = 'F', timezone.now()
+        else:
+            self.status, self.finished_at, self.last_error = 'D', timezone.now(), ''
+        finally:
+            _running_job.job = None
+
+        self.locked_by, self.locked_at = '', None
+        self.save(update_fields=['status', 'run_at', 'finished_at', 'last_error', 'locked_by', 'locked_at'])
+        return self.status == 'D'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+            models.Index(fields=['locked_by'], name='job_locked_by_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='Q'), name='job_unique_queued_key'),
+        ]
+
+
+_pending_versions = threading.local()     # {database alias: weakref to the PendingVersions of its transaction}
+
+
+class PendingVersions:
+    """
+    The bumps collected in one transaction, written by calling it once the
+    transaction commits. transaction.on_commit() holds the only strong
+    reference: when Django drops the callback with a rolled back
+    transaction or savepoint, the object goes with it and the weak
+    reference kept by CollectionVersionManager.bump() turns None, so the
+    next bump registers a fresh one.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.keys = set()
+
+    def __call__(self):
+        keys, self.keys = self.keys, None
+        self.manager.flush(keys)
+
+
+class CollectionVersionManager(models.Manager):
+    """
+    A counter per business and collection ('sales-invoices', 'inventory',
+    ...), bumped whenever a row of the collection changes, so a GET can
+    tell whether what the client holds is still current without running
+    its queryset (see ConditionalGetViewSetMixin in root.utils).
+
+    Bumps are collected per transaction and written once it commits, a
+    few queries however many rows it touched. A reader can see
+    new rows under the old version for that moment, which only costs the
+    client one more download; never old rows under a new version.
+    """
+
+    def bump(self, business_id, *collections):
+        if not business_id:
+            return
+
+        keys = {(business_id, collection) for collection in collections}
+        reference = getattr(_pending_versions, self.db, None)
+        pending = reference() if reference is not None else None
+        # join the flush still waiting for this transaction to commit, if any
+        if pending is not None and pending.keys is not None:
+            pending.keys.update(keys)
+            return
+
+        pending = PendingVersions(self)
+        pending.keys.update(keys)
+        if transaction.get_connection(self.db).in_atomic_block:
+            setattr(_pending_versions, self.db, weakref.ref(pending))
+        transaction.on_commit(pending, using=self.db)
+
+    def flush(self, keys):
+        # the business may be gone with a rolled back savepoint
+        existing = set(Business.objects.filter(pk__in={business_id for business_id, _ in keys}).values_list('pk', flat=True))
+        keys = [(business_id, collection) for business_id, collection in keys if business_id in existing]
+        if not keys:
+            return
+
+        now = timezone.now()
+        self.bulk_create([
+            self.model(business_id=business_id, collection=collection, updated_at=now)
+            for business_id, collection in keys
+        ], ignore_conflicts=True)
+
+        by_business = defaultdict(set)
+        for business_id, collection in keys:
+            by_business[business_id].add(collection)
+        for business_id, collections in by_business.items():
+            self.filter(business_id=business_id, collection__in=collections).update(
+                version=models.F('version') + 1, updated_at=now
+            )
+
+    def current(self, business_id, collections):
+        """
+        ({collection: version}, last modified) of a business' collections.
+        """
+        rows = self.filter(business_id=business_id, collection__in=collections).values_list(
+            'collection', 'version', 'updated_at'
+        )
+        versions, last_modified = {}, None
+        for collection, version, updated_at in rows:
+            versions[collection] = version
+            last_modified = max(last_modified or updated_at, updated_at)
+        return versions, last_modified
+
+
+class CollectionVersion(models.Model):
+    business = models.ForeignKey(Business, models.CASCADE, related_name='collection_versions')
+    collection = models.CharField(max_length=50)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = CollectionVersionManager()
+
+    def __str__(self):
+        return f"{self.business_id}-{self.collection}@{self.version}"
+
+    class Meta:
+        unique_together = [('business', 'collection')]
@@ -0,0 +1,21 @@
+from django.db.models import QuerySet
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (-created_at, id). Every page is a range scan
+    on the model's (business, -created_at, id) index, so deep pages cost
+    the same as the first one and no COUNT(*) is ever issued.
+    """
+
+    ordering = ('-created_at', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # viewsets return [] when there is no active business
+        if not isinstance(queryset, QuerySet):
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,337 @@
+import io
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import User
+from inventory.models import Inventory, InventoryItem, StockMovement, StockSnapshot
+from sales.models import (
+    PurchaseInvoice, PurchaseInvoiceItem, PurchaseInvoiceItemRestock, ReturnedItem, SalesInvoice,
+    SalesInvoiceItem, SalesInvoiceItemDeduction,
+)
+from .models import Business, City, CollectionVersion, Customer, Expense, Location, Product, SearchDocument, Supplier, Unit
+from .signals import COLLECTIONS
+
+
+SCALES = {
+    'small': {
+        'locations': 2, 'products': 50, 'customers': 100, 'suppliers': 10,
+        'sales_invoices': 500, 'purchase_invoices': 100, 'expenses': 100, 'days': 90,
+    },
+    'medium': {
+        'locations': 3, 'products': 500, 'customers': 2000, 'suppliers': 50,
+        'sales_invoices': 10000, 'purchase_invoices': 2000, 'expenses': 1000, 'days': 365,
+    },
+    'large': {
+        'locations': 5, 'products': 5000, 'customers': 20000, 'suppliers': 200,
+        'sales_invoices': 100000, 'purchase_invoices': 20000, 'expenses': 5000, 'days': 730,
+    },
+}
+
+ADJECTIVES = ['Premium', 'Classic', 'Organic', 'Compact', 'Deluxe', 'Eco', 'Heavy Duty', 'Mini', 'Smart', 'Vintage']
+NOUNS = ['Coffee', 'Rice', 'Soap', 'Lamp', 'Kettle', 'Notebook', 'Charger', 'Blanket', 'Bottle', 'Cable',
+         'Sugar', 'Towel', 'Battery', 'Bucket', 'Pen', 'Shirt', 'Sandals', 'Juice', 'Flour', 'Tea']
+FIRST_NAMES = ['Amina', 'Brian', 'Chen', 'Diana', 'Emeka', 'Fatuma', 'George', 'Hana', 'Ivan', 'Joy',
+               'Kofi', 'Lina', 'Moses', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Samuel', 'Tariq']
+LAST_NAMES = ['Otieno', 'Smith', 'Wang', 'Mwangi', 'Okafor', 'Garcia', 'Kamau', 'Ali', 'Novak', 'Mensah']
+EXPENSES = ['Rent', 'Electricity', 'Water', 'Internet', 'Transport', 'Salaries', 'Repairs', 'Marketing', 'Packaging']
+RETURN_REASONS = ['Damaged', 'Wrong item', 'Expired', 'Customer changed mind', None]
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let bulk_create store the created_at/date_issued/... values set on the
+    instances instead of now, so the seeded history spans `days`.
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    flags = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in flags:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class TenantSeeder:
+    """
+    Generates a synthetic business with a realistic shape: a catalogue
+    stocked at a few locations, customers and suppliers, and `days` of
+    history of received purchase invoices, completed sales invoices with
+    their stock deductions, some returns and expenses. Every table is
+    filled with bulk inserts a chunk at a time; the derived data (stock
+    ledger, daily rollups, search index, inventory glance) is rebuilt
+    once at the end.
+
+    The same `seed` always produces the same tenant, so benchmark runs
+    against it are comparable.
+    """
+
+    RETURN_RATE = 0.02
+
+    def __init__(self, scale='small', seed=0, batch_size=1000, **counts):
+        self.counts = {**SCALES[scale], **{key: value for key, value in counts.items() if value is not None}}
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.end = timezone.now().replace(microsecond=0)
+        self.start = self.end - timedelta(days=self.counts['days'])
+
+    def run(self, name=None, owner=None):
+        with transaction.atomic(), explicit_timestamps(
+            SalesInvoice, SalesInvoiceItem, SalesInvoiceItemDeduction, PurchaseInvoice, PurchaseInvoiceItem,
+            PurchaseInvoiceItemRestock, ReturnedItem, Expense, StockMovement,
+        ):
+            self.create_business(name, owner)
+            self.create_catalogue()
+            self.create_purchases()
+            self.create_sales()
+            self.create_expenses()
+
+        self.rebuild_derived_data()
+        return self.business
+
+    def moment(self, day=None):
+        """
+        A random datetime within business hours of `day`, or of any day of
+        the period.
+        """
+        if day is None:
+            day = self.random.randrange(self.counts['days'])
+        opening = timezone.make_aware(datetime.combine((self.start + timedelta(days=day)).date(), time(8)))
+        return min(opening + timedelta(seconds=self.random.randrange(10 * 60 * 60)), self.end)
+
+    def moments(self, count):
+        """
+        `count` datetimes spread over the period, oldest first, busier
+        towards the end as a growing business would be.
+        """
+        days = self.counts['days']
+        return sorted(self.moment(min(int(days * self.random.random() ** 0.8), days - 1)) for _ in range(count))
+
+    def chunks(self, values):
+        for start in range(0, len(values), self.batch_size):
+            yield values[start:start + self.batch_size]
+
+    def create_business(self, name, owner):
+        number = Business.objects.count() + 1
+        if owner is None:
+            owner = User.objects.create_user(f'seed-owner-{number}-{self.random.randrange(10 ** 6)}@example.com', None)
+
+        self.user = owner
+        self.business = Business.objects.create(
+            name=name or f'Seed Business {number}', owner=owner, phone=f'+2547{self.random.randrange(10 ** 8):08}',
+            address=f'{self.random.randrange(1, 500)} Market Street', is_active=True,
+        )
+        self.inventory = Inventory.objects.get(business=self.business)
+
+    def create_catalogue(self):
+        random, counts = self.random, self.counts
+        units = [Unit.objects.get_or_create(name=name, defaults={'abv': abv})[0]
+                 for name, abv in (('Piece', 'pcs'), ('Kilogram', 'kg'), ('Litre', 'l'), ('Box', 'box'))]
+        cities = [City.objects.get_or_create(name=name, defaults={'postal_code': code})[0]
+                  for name, code in (('Nairobi', '00100'), ('Mombasa', '80100'), ('Kisumu', '40100'))]
+
+        self.locations = Location.objects.bulk_create([
+            Location(business=self.business, name=f'Branch {n + 1}', address=f'{n + 1} High Street', is_default=n == 0)
+            for n in range(max(counts['locations'], 1))
+        ])
+        self.products = Product.objects.bulk_create([
+            Product(
+                business=self.business, name=f'{random.choice(ADJECTIVES)} {random.choice(NOUNS)} {n + 1}',
+                desc=f'Synthetic product {n + 1}', unit=random.choice(units),
+            )
+            for n in range(counts['products'])
+        ], batch_size=self.batch_size)
+        self.customers = Customer.objects.bulk_create([
+            Customer(
+                business=self.business, name=f'{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}',
+                phone=f'+2547{random.randrange(10 ** 8):08}', email=f'customer{n + 1}@example.com',
+                city=random.choice(cities),
+            )
+            for n in range(counts['customers'])
+        ], batch_size=self.batch_size)
+        self.suppliers = Supplier.objects.bulk_create([
+            Supplier(
+                business=self.business, name=f'{random.choice(LAST_NAMES)} Wholesalers {n + 1}',
+                business_name=f'{random.choice(NOUNS)} Distributors Ltd', phone=f'+2547{random.randrange(10 ** 8):08}',
+            )
+            for n in range(counts['suppliers'])
+        ], batch_size=self.batch_size)
+
+        # opening stock, enough to cover most of the sales to come
+        self.costs = {product.id: round(random.uniform(1, 200), 2) for product in self.products}
+        self.items = InventoryItem.objects.bulk_create([
+            InventoryItem(
+                business=self.business, inventory=self.inventory, product=product,
+                location=random.choice(self.locations), quantity=0, quantity_on_hand=random.randrange(20, 200),
+                unit_cost=self.costs[product.id], unit_price=round(self.costs[product.id] * random.uniform(1.1, 1.6), 2),
+                reorder_level=random.randrange(5, 30),
+            )
+            for product in self.products
+        ], batch_size=self.batch_size)
+        self.items = {item.product_id: item for item in self.items}
+        StockMovement.objects.record(
+            'O', None, {item: item.quantity_on_hand for item in self.items.values()}, occurred_at=self.start
+        )
+
+    def invoice_lines(self):
+        """
+        1-5 distinct products and their quantities.
+        """
+        products = self.random.sample(self.products, min(self.random.randint(1, 5), len(self.products)))
+        return [(product, self.random.randint(1, 10)) for product in products]
+
+    def create_purchases(self):
+        random = self.random
+        received = {}
+        for moments in self.chunks(self.moments(self.counts['purchase_invoices'])):
+            invoices, lines = [], []
+            for at in moments:
+                invoice_lines = self.invoice_lines()
+                sub_total = sum(quantity * self.costs[product.id] for product, quantity in invoice_lines)
+                invoices.append(PurchaseInvoice(
+                    business=self.business, supplier=random.choice(self.suppliers), created_by=self.user,
+                    invoice_number=f'PI-{at:%Y%m%d}-{random.randrange(10 ** 6):06}',
+                    status='R', payment_status=random.choice(['P', 'P', 'P', 'PP', 'PEN']),
+                    sub_total=sub_total, total=sub_total, amount_paid=sub_total,
+                    goods_received=sum(quantity for _, quantity in invoice_lines),
+                    delivery=at.date(), date_due=(at + timedelta(days=30)).date(),
+                    is_restocked=True, created_at=at, updated_at=at,
+                ))
+                lines.append(invoice_lines)
+
+            invoices = PurchaseInvoice.objects.bulk_create(invoices)
+            items = PurchaseInvoiceItem.objects.bulk_create([
+                PurchaseInvoiceItem(
+                    business=self.business, purchase_invoice=invoice, product=product, quantity=quantity,
+                    unit_cost=self.costs[product.id], quantity_received=quantity, is_restocked=True,
+                    created_at=invoice.created_at, updated_at=invoice.created_at,
+                )
+                for invoice, invoice_lines in zip(invoices, lines) for product, quantity in invoice_lines
+            ], batch_size=self.batch_size)
+            PurchaseInvoiceItemRestock.objects.bulk_create([
+                PurchaseInvoiceItemRestock(
+                    purchase_invoice_id=item.purchase_invoice_id, purchase_invoice_item=item, quantity=item.quantity,
+                    received_at=item.created_at.date(), created_at=item.created_at, updated_at=item.created_at,
+                )
+                for item in items
+            ], batch_size=self.batch_size)
+            self.record_movements('P', items, 1)
+            for item in items:
+                received[item.product_id] = received.get(item.product_id, 0) + item.quantity
+
+        self.update_stock(received)
+
+    def create_sales(self):
+        random = self.random
+        deducted = {}
+        for moments in self.chunks(self.moments(self.counts['sales_invoices'])):
+            invoices, lines = [], []
+            for at in moments:
+                invoice_lines = self.invoice_lines()
+                sub_total = sum(quantity * self.items[product.id].unit_price for product, quantity in invoice_lines)
+                tax = {'value': 16.0, 'type': 'percentage'} if random.random() < 0.3 else {}
+                invoices.append(SalesInvoice(
+                    business=self.business, customer=random.choice(self.customers), created_by=self.user,
+                    invoice_number=f'SI-{at:%Y%m%d}-{random.randrange(10 ** 6):06}',
+                    status='C', payment_status=random.choice(['P', 'P', 'P', 'P', 'PP', 'PEN']),
+                    sub_total=round(sub_total, 2), tax=tax,
+                    total=round(sub_total * (1 + tax.get('value', 0) / 100), 2),
+                    is_deducted=True, date_issued=at, created_at=at,
+                ))
+                lines.append(invoice_lines)
+
+            invoices = SalesInvoice.objects.bulk_create(invoices)
+            items = SalesInvoiceItem.objects.bulk_create([
+                SalesInvoiceItem(
+                    business=self.business, sales_invoice=invoice, product=product, quantity=quantity,
+                    unit_price=self.items[product.id].unit_price, is_deducted=True,
+                    created_at=invoice.created_at, updated_at=invoice.created_at,
+                )
+                for invoice, invoice_lines in zip(invoices, lines) for product, quantity in invoice_lines
+            ], batch_size=self.batch_size)
+            SalesInvoiceItemDeduction.objects.bulk_create([
+                SalesInvoiceItemDeduction(
+                    sales_invoice_id=item.sales_invoice_id, sales_invoice_item=item, quantity=item.quantity,
+                    received_at=item.created_at.date(), created_at=item.created_at, updated_at=item.created_at,
+                )
+                for item in items
+            ], batch_size=self.batch_size)
+            self.record_movements('S', items, -1)
+            for item in items:
+                deducted[item.product_id] = deducted.get(item.product_id, 0) - item.quantity
+
+            self.create_returns([item for item in items if random.random() < self.RETURN_RATE])
+
+        self.update_stock(deducted)
+
+    def create_returns(self, items):
+        returns = []
+        for item in items:
+            quantity = self.random.randint(1, item.quantity)
+            item.is_returned = quantity == item.quantity
+            item.is_partially_returned = not item.is_returned
+            at = min(item.created_at + timedelta(days=self.random.randint(0, 14)), self.end)
+            returns.append(ReturnedItem(
+                business=self.business, invoice_item=item, quantity=quantity,
+                reason=self.random.choice(RETURN_REASONS), created_at=at, updated_at=at,
+            ))
+
+        SalesInvoiceItem.objects.bulk_update(items, ['is_returned', 'is_partially_returned'], batch_size=self.batch_size)
+        ReturnedItem.objects.bulk_create(returns, batch_size=self.batch_size)
+
+    def create_expenses(self):
+        Expense.objects.bulk_create([
+            Expense(
+                business=self.business, name=self.random.choice(EXPENSES), desc='Synthetic expense',
+                amount=round(self.random.uniform(5, 2000), 2), created_at=at,
+            )
+            for at in self.moments(self.counts['expenses'])
+        ], batch_size=self.batch_size)
+
+    def record_movements(self, kind, items, sign):
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                business=self.business, item_id=self.items[item.product_id].pk, product_id=item.product_id,
+                kind=kind, quantity=sign * item.quantity, occurred_at=item.created_at,
+                source_type=item._meta.label_lower, source_id=item.pk,
+            )
+            for item in items
+        ], batch_size=self.batch_size)
+
+    def update_stock(self, deltas):
+        """
+        Apply the net movement of every product to its inventory row. Sales
+        may take a product below zero on paper; restock it instead, as an
+        adjustment, so the tenant ends with a plausible stock level.
+        """
+        adjustments = {}
+        for product_id, delta in deltas.items():
+            item = self.items[product_id]
+            item.quantity_on_hand += delta
+            if item.quantity_on_hand < item.reorder_level:
+                adjustments[item] = item.reorder_level * 2 - item.quantity_on_hand
+                item.quantity_on_hand = item.reorder_level * 2
+            item.quantity = item.quantity_on_hand
+
+        InventoryItem.objects.bulk_update(self.items.values(), ['quantity', 'quantity_on_hand'], batch_size=self.batch_size)
+        StockMovement.objects.record('A', None, adjustments, occurred_at=self.end)
+
+    def rebuild_derived_data(self):
+        business_id = self.business.id
+        call_command('rebuild_daily_rollups', business=business_id, stdout=io.StringIO())
+        with transaction.atomic():
+            SearchDocument.objects.rebuild(business_id)
+        StockSnapshot.objects.take(business_id, batch_size=self.batch_size)
+        with transaction.atomic():
+            Inventory.objects.refresh_glance(business_id=business_id)
+            CollectionVersion.objects.bump(business_id, *set(COLLECTIONS.values()))
@@ -12,6 +12,32 @@ from .models import (
 )
 
 
+class EagerLoadingMixin:
+    """
+    Declarative eager loading plan for a serializer. Viewsets using
+    root.utils.EagerLoadingViewSetMixin apply it to their querysets so
+    nested fields do not issue one query per row.
+
+        select_related   - forward relations joined into the main query
+        prefetch_related - reverse / many relations fetched in one query each
+        annotations      - {name: expression} computed in the main query
+    """
+
+    select_related = []
+    prefetch_related = []
+    annotations = {}
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related:
+            queryset = queryset.select_related(*cls.select_related)
+        if cls.prefetch_related:
+            queryset = queryset.prefetch_related(*cls.prefetch_related)
+        if cls.annotations:
+            queryset = queryset.annotate(**cls.annotations)
+        return queryset
+
+
 class CitySerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -85,7 +111,9 @@ class CustomerSerializer(serializers.ModelSerializer):
         return instance
 
 
-class SimpleCustomerSerializer(serializers.ModelSerializer):
+class SimpleCustomerSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['city']
 
     city = CitySerializer()
 
@@ -122,7 +150,9 @@ class SimpleLocationSerializer(serializers.Serializer):
         fields = ['id', 'name', 'address']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['business', 'unit']
 
     business = SimpleBusinessSerializer(read_only=True)
     unit = UnitSerializer(read_only=True)
@@ -0,0 +1,131 @@
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from inventory.models import InventoryItem
+from sales.models import PurchaseInvoice, PurchaseInvoiceItem, ReturnedItem, SalesInvoice, SalesInvoiceItem
+from .filters import GlobalSearch
+from .models import (
+    Business, BusinessConfig, BusinessDeletion, Category, City, CollectionVersion, Customer, DailyRollup, Expense, Location, Product,
+    SearchDocument, Supplier, Unit
+)
+from .utils import collect_batched, invalidate_active_business, invalidate_reference_data, run_batched
+
+
+### keep the daily rollup in step with expenses
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def refreshDailyRollupAfterExpense(sender, instance: Expense, **kwargs):
+    run_batched(
+        DailyRollup.objects.refresh,
+        instance.business_id, timezone.localdate(instance.created_at),
+        Expense.objects
+    )
+
+
+# the rows that cascade with a business leave its rollup alone
+@receiver(pre_delete, sender=Business)
+def markBusinessDeletion(sender, instance: Business, **kwargs):
+    BusinessDeletion.start(instance.pk)
+
+
+### drop the cached active business when a business or its config changes
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Business)
+def invalidateActiveBusinessAfterBusiness(sender, instance: Business, **kwargs):
+    invalidate_active_business(instance.owner_id)
+
+
+@receiver(post_save, sender=BusinessConfig)
+@receiver(post_delete, sender=BusinessConfig)
+def invalidateActiveBusinessAfterBusinessConfig(sender, instance: BusinessConfig, **kwargs):
+    invalidate_active_business(instance.user_id)
+
+
+### keep the search index in step with every searchable model
+def indexSearchDocument(sender, instance, **kwargs):
+    SearchDocument.objects.index([instance])
+
+
+def removeSearchDocument(sender, instance, **kwargs):
+    collect_batched(SearchDocument.objects.remove, instance.pk, sender)
+
+
+for model in GlobalSearch.models:
+    label = SearchDocument.objects.label(model)
+    post_save.connect(indexSearchDocument, sender=model, dispatch_uid=f'index-{label}')
+    post_delete.connect(removeSearchDocument, sender=model, dispatch_uid=f'remove-{label}')
+
+
+### refresh the documents that show a renamed customer, product, supplier, city...
+def searchedFields(sender, update_fields=None):
+    fields = {field for fields in SearchDocument.objects.dependents(sender).values() for field in fields}
+    if update_fields is not None:
+        fields = {field for field in fields if {field.name, field.attname} & set(update_fields)}
+    return fields
+
+
+def readSearchedFieldsBeforeSave(sender, instance, **kwargs):
+    instance._stored_searched_fields = None
+    fields = searchedFields(sender, kwargs.get('update_fields'))
+    if instance.pk and fields and not kwargs.get('raw'):
+        instance._stored_searched_fields = (
+            sender._default_manager.filter(pk=instance.pk).values(*[field.attname for field in fields]).first()
+        )
+
+
+def reindexSearchDependentsAfterSave(sender, instance, created, **kwargs):
+    stored = getattr(instance, '_stored_searched_fields', None)
+    if created or not stored:
+        return
+
+    changed = [
+        field.name for field in searchedFields(sender)
+        if field.attname in stored and getattr(instance, field.attname) != stored[field.attname]
+    ]
+    if changed:
+        SearchDocument.objects.reindex_dependents(instance, changed)
+
+
+for model in SearchDocument.objects.related_models():
+    label = model._meta.label_lower
+    pre_save.connect(readSearchedFieldsBeforeSave, sender=model, dispatch_uid=f'searched-{label}')
+    post_save.connect(reindexSearchDependentsAfterSave, sender=model, dispatch_uid=f'reindex-{label}')
+
+
+### bump the collection version of every write, for conditional GETs
+COLLECTIONS = {
+    SalesInvoice: 'sales-invoices',
+    SalesInvoiceItem: 'sales-invoices',
+    PurchaseInvoice: 'purchase-invoices',
+    PurchaseInvoiceItem: 'purchase-invoices',
+    ReturnedItem: 'returned-items',
+    InventoryItem: 'inventory',
+    Product: 'products',
+    Customer: 'customers',
+    Supplier: 'suppliers',
+    Location: 'locations',
+    Expense: 'expenses',
+}
+
+
+def bumpCollectionVersion(sender, instance, **kwargs):
+    CollectionVersion.objects.bump(instance.business_id, COLLECTIONS[sender])
+
+
+for model in COLLECTIONS:
+    label = model._meta.label_lower
+    post_save.connect(bumpCollectionVersion, sender=model, dispatch_uid=f'version-{label}')
+    post_delete.connect(bumpCollectionVersion, sender=model, dispatch_uid=f'unversion-{label}')
+
+
+### drop the cached reference tables when a row changes (in the admin)
+def invalidateReferenceData(sender, instance, **kwargs):
+    label = sender._meta.label_lower
+    transaction.on_commit(lambda: invalidate_reference_data(label))
+
+
+for model in (City, Category, Unit):
+    label = model._meta.label_lower
+    post_save.connect(invalidateReferenceData, sender=model, dispatch_uid=f'reference-{label}')
+    post_delete.connect(invalidateReferenceData, sender=model, dispatch_uid=f'unreference-{label}')
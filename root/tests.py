@@ -1,3 +1,837 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from core.models import User
+from inventory.models import Inventory, InventoryItem, StockMovement
+from sales.models import ReturnedItem, SalesInvoice, SalesInvoiceItem
+from . import benchmarks
+from .deletes import BulkDeleter
+from .filters import GlobalSearch
+from .imports import CustomerImporter, readRows
+from .metrics import registry
+from .views import AsyncKeyPerformanceIndicatorsView, AsyncMonthlyExpensesTrendView, AsyncMultiModelSearchView
+from .models import (
+    Business, Category, City, CollectionVersion, Customer, DailyRollup, Expense, Job, Location, Product, SearchDocument,
+    Supplier, Unit
+)
+from .seeding import TenantSeeder
+from .utils import ASYNC_QUERY_WORKERS, _reference_data, gather_queries
+
+
+calls = []
+
+
+def record_call(value):
+    calls.append(value)
+
+
+def fail(value):
+    raise RuntimeError(value)
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_queued_key_is_idempotent(self):
+        first = Job.objects.enqueue('root.tests.record_call', {'value': 1}, key='k')
+        second = Job.objects.enqueue('root.tests.record_call', {'value': 2}, key='k')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.filter(key='k').count(), 1)
+
+    def test_claimed_job_runs_once(self):
+        Job.objects.enqueue('root.tests.record_call', {'value': 1}, key='k')
+
+        [job] = Job.objects.claim('worker')
+        self.assertEqual(Job.objects.claim('other'), [])
+        # a new job with the same key may queue while the first one runs
+        Job.objects.enqueue('root.tests.record_call', {'value': 2}, key='k')
+
+        self.assertTrue(job.run())
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'D')
+
+    @override_settings(JOB_QUEUE={'RETRY_DELAY': 0})
+    def test_failures_are_retried_until_max_attempts(self):
+        job = Job.objects.enqueue('root.tests.fail', {'value': 'boom'}, max_attempts=2)
+
+        for status in ('Q', 'F'):
+            [job] = Job.objects.claim('worker')
+            self.assertFalse(job.run())
+            job.refresh_from_db()
+            self.assertEqual(job.status, status)
+
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+
+class BulkImportTests(TestCase):
+    """
+    Imports create the valid rows of a file in bulk and report the
+    invalid ones by line.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        Unit.objects.create(name='pieces', abv='pcs')
+        City.objects.create(name='City', postal_code='0')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, kind, name, content):
+        return self.client.post(
+            f'/import/{kind}/', {'file': SimpleUploadedFile(name, content.encode())}, format='multipart'
+        )
+
+    def test_products_are_created_and_bad_rows_reported(self):
+        rows = ['name,desc,unit,is_active'] + [f'Product {i},,pcs,true' for i in range(50)] + [',,pcs,', 'Other,,kg,']
+
+        response = self.upload('products', 'products.csv', '\n'.join(rows))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (50, 2))
+        self.assertEqual(
+            response.data['errors'],
+            [
+                {'row': 51, 'errors': {'name': ['This field is required.']}},
+                {'row': 52, 'errors': {'unit': ["Unknown unit 'kg'."]}},
+            ]
+        )
+        self.assertEqual(Product.objects.filter(business=self.business).count(), 50)
+
+    def test_undecodable_lines_are_reported_by_row(self):
+        rows = [json.dumps({'name': f'Customer {i}', 'city': 'City'}) for i in range(3)] + ['{"name": ', '[]']
+
+        response = self.upload('customers', 'customers.jsonl', '\n'.join(rows))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 2))
+        self.assertEqual([error['row'] for error in response.data['errors']], [4, 5])
+        self.assertEqual(response.data['errors'][1]['errors'], {'non_field_errors': ['Expected a JSON object.']})
+
+    def test_a_broken_upload_reports_what_was_created(self):
+        # the bad byte is decoded after the first chunk of 1000 rows went in
+        content = '\n'.join(['name,desc,unit'] + [f'Product {i},,pcs' for i in range(1500)]).encode() + b'\n\xff,,pcs\n'
+
+        response = self.client.post(
+            '/import/products/', {'file': SimpleUploadedFile('products.csv', content)}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('utf-8', response.data['detail'])
+        self.assertEqual(response.data['created'], 1000)
+        self.assertEqual(Product.objects.filter(business=self.business).count(), 1000)
+
+    def test_lookups_are_cached_across_chunks(self):
+        rows = '\n'.join(json.dumps({'name': f'Customer {i}', 'city': 'City'}) for i in range(30))
+
+        # one city lookup in all; per chunk an insert and a search index
+        # upsert (with its city prefetch) in a savepoint
+        with self.assertNumQueries(1 + 3 * 5):
+            result = CustomerImporter(self.business.id, chunk_size=10).run(readRows(io.StringIO(rows), 'jsonl'))
+
+        self.assertEqual(result['created'], 30)
+        self.assertEqual(Customer.objects.filter(business=self.business).count(), 30)
+
+    def test_opening_stock_is_logged_once_per_product(self):
+        unit = Unit.objects.get()
+        Product.objects.bulk_create([Product(business=self.business, name=f'P{i}', unit=unit) for i in range(3)])
+        rows = ['product,quantity'] + [f'P{i},{i + 1}' for i in range(3)] + ['P0,9']
+
+        response = self.upload('opening-stock', 'stock.csv', '\n'.join(rows))
+
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 4)
+        self.assertEqual(
+            sorted(InventoryItem.objects.values_list('quantity_on_hand', flat=True)), [1, 2, 3]
+        )
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(kind='O').values_list('quantity', flat=True)), [1, 2, 3]
+        )
+
+
+class ConditionalGetTests(TestCase):
+    """
+    A GET whose validators still match the business' collection versions
+    is answered with a 304 before the queryset runs.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        self.city = City.objects.create(name='City', postal_code='0')
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.objects.create(business=self.business, name='Customer', city=self.city)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_collection_is_not_modified(self):
+        response = self.client.get('/customers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+        # the active business, its config and the versions; no queryset
+        with self.assertNumQueries(3):
+            response = self.client.get('/customers/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+    def test_write_bumps_the_version(self):
+        etag = self.client.get('/customers/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.objects.create(business=self.business, name='Other', city=self.city)
+
+        self.assertEqual(
+            CollectionVersion.objects.get(business=self.business, collection='customers').version, 2
+        )
+        response = self.client.get('/customers/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_write_after_a_rolled_back_savepoint_bumps_the_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Customer.objects.create(business=self.business, name='Dropped', city=self.city)
+                    raise ValueError
+            except ValueError:
+                pass
+            Customer.objects.create(business=self.business, name='Other', city=self.city)
+
+        self.assertEqual(
+            CollectionVersion.objects.get(business=self.business, collection='customers').version, 2
+        )
+
+    def test_versions_are_per_business(self):
+        etag = self.client.get('/customers/')['ETag']
+
+        other = Business.objects.create(name='Other', owner=self.user, phone='1', is_active=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.objects.create(business=other, name='Other', city=self.city)
+
+        self.assertEqual(self.client.get('/customers/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class CursorPaginationTests(TestCase):
+    """
+    List endpoints page by (-created_at, id), so following `next` visits
+    every row once, even rows created in the same instant.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        city = City.objects.create(name='City', postal_code='0')
+        customers = Customer.objects.bulk_create([
+            Customer(business=self.business, name=f'Customer {i}', city=city) for i in range(7)
+        ])
+        # five of them share one timestamp, across page boundaries
+        instant = timezone.now()
+        Customer.objects.filter(pk__in=[customer.pk for customer in customers[1:6]]).update(created_at=instant)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_walk_every_row_once(self):
+        expected = list(
+            Customer.objects.filter(business=self.business).order_by('-created_at', 'id').values_list('id', flat=True)
+        )
+
+        seen = []
+        url = '/customers/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, expected)
+
+    def test_page_size_defaults_to_fifty(self):
+        Customer.objects.bulk_create([
+            Customer(business=self.business, name=f'More {i}', city=City.objects.get()) for i in range(50)
+        ])
+
+        response = self.client.get('/customers/')
+
+        self.assertEqual(len(response.data['results']), 50)
+        self.assertIsNotNone(response.data['next'])
+
+
+class ReferenceDataCacheTests(TestCase):
+    """
+    Cities, units and categories are served from the cache until a row
+    changes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        _reference_data.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.city = City.objects.create(name='City', postal_code='0')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cached_rows_cost_no_queries(self):
+        response = self.client.get('/cities/')
+        self.assertEqual(response.json(), [{'id': self.city.id, 'name': 'City', 'postal_code': '0'}])
+        self.assertIn('max-age=', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/cities/').json(), response.json())
+            self.assertEqual(self.client.get(f'/cities/{self.city.id}/').json()['name'], 'City')
+            self.assertEqual(self.client.get('/cities/0/').status_code, 404)
+            self.assertEqual(
+                self.client.get('/cities/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+            )
+
+    def test_edits_invalidate_the_cache(self):
+        etag = self.client.get('/cities/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.city.name = 'Renamed'
+            self.city.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Category')
+
+        response = self.client.get('/cities/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'Renamed')
+        self.assertEqual(self.client.get('/categories/').json()[0]['name'], 'Category')
+
+    @override_settings(REFERENCE_DATA_CACHE={'ALIAS': None})
+    def test_in_process_cache_without_shared_backend(self):
+        self.client.get('/units/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Unit.objects.create(name='pieces', abv='pcs')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/units/').json()[0]['abv'], 'pcs')
+        with self.assertNumQueries(0):
+            self.client.get('/units/')
+
+
+    @override_settings(REFERENCE_DATA_CACHE={'ALIAS': 'default'})
+    def test_per_process_alias_is_not_shared(self):
+        self.client.get('/units/')
+        self.assertIsNone(cache.get('reference-version:root.unit'))
+
+    def test_shared_alias_reaches_other_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            CACHES={**settings.CACHES, 'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory,
+            }},
+            REFERENCE_DATA_CACHE={'ALIAS': 'shared'},
+        ):
+            self.client.get('/units/')
+            # another process: no in-process copy, the shared payload is used
+            _reference_data.clear()
+            with self.assertNumQueries(0):
+                self.client.get('/units/')
+
+            # an edit made in another process
+            version = caches['shared'].get('reference-version:root.unit')
+            Unit.objects.create(name='pieces', abv='pcs')
+            caches['shared'].set('reference-version:root.unit', 'other', None)
+            self.assertNotEqual(version, 'other')
+            self.assertEqual(self.client.get('/units/').json()[0]['abv'], 'pcs')
+
+
+class BulkDeleteTests(TestCase):
+    """
+    Bulk deletes run in chunks scoped to the business, recompute what the
+    cascade touched once per chunk and can be left to the job queue.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        unit = Unit.objects.create(name='pieces', abv='pcs')
+        customer = Customer.objects.create(
+            business=self.business, name='Customer', city=City.objects.create(name='City', postal_code='0')
+        )
+        self.products = [Product.objects.create(business=self.business, name=f'P{i}', unit=unit) for i in range(5)]
+        for product in self.products:
+            InventoryItem.objects.create(
+                business=self.business, inventory=self.business.inventory_glance,
+                product=product, quantity=10, quantity_on_hand=10
+            )
+
+        self.invoice = SalesInvoice.objects.create(business=self.business, customer=customer, created_by=self.user)
+        for product in self.products:
+            SalesInvoiceItem.objects.create(
+                business=self.business, sales_invoice=self.invoice, product=product, quantity=1, unit_price=10.0
+            )
+
+        other = Business.objects.create(name='Other', owner=self.user, phone='1', is_active=False)
+        self.foreign = Product.objects.create(business=other, name='Foreign', unit=unit)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_chunks_recompute_totals_once_each(self):
+        ids = [product.id for product in self.products[:4]] + [self.foreign.id]
+
+        with mock.patch.object(SalesInvoice, 'adjust_totals', autospec=True,
+                               side_effect=SalesInvoice.adjust_totals) as adjust_totals:
+            result = BulkDeleter(Product, self.business.id, chunk_size=2).run(ids)
+
+        self.assertEqual(adjust_totals.call_count, 2)
+        self.assertEqual(result['deleted'], 4)
+        self.assertEqual(result['cascaded']['inventory.InventoryItem'], 4)
+        self.assertEqual(result['cascaded']['sales.SalesInvoiceItem'], 4)
+        self.assertTrue(Product.objects.filter(pk=self.foreign.pk).exists())
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.sub_total, 10.0)
+        glance = Inventory.objects.get(business=self.business)
+        self.assertEqual(glance.total_quantity_on_hand, 10)
+
+    def test_background_delete_reports_progress(self):
+        response = self.client.post('/products/bulk-delete/', {
+            'product_ids': [product.id for product in self.products], 'background': True,
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+
+        [job] = Job.objects.claim('worker')
+        self.assertEqual(job.pk, response.data['job'])
+        self.assertTrue(job.run())
+
+        self.assertFalse(Product.objects.filter(business=self.business).exists())
+        response = self.client.get(f"/jobs/{job.pk}/")
+        self.assertEqual(response.data['status'], 'D')
+        self.assertEqual(response.data['progress']['done'], 5)
+        self.assertEqual(response.data['progress']['deleted']['root.Product'], 5)
+
+
+class AsyncDashboardTests(TestCase):
+    """
+    The async KPI, trend and search views answer like their sync twins.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        customer = Customer.objects.create(
+            business=self.business, name='Searchable', city=City.objects.create(name='City', postal_code='0')
+        )
+        SearchDocument.objects.index([customer])
+        Expense.objects.create(business=self.business, name='Rent', amount=100)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    async def call(self, view, path, user=True, **headers):
+        request = APIRequestFactory().get(path, **headers)
+        if user:
+            force_authenticate(request, self.user)
+        return await view.as_view()(request)
+
+    async def test_concurrent_queries_share_a_bounded_pool(self):
+        def thread_name(value):
+            time.sleep(0.01)
+            return value, threading.current_thread().name
+
+        with mock.patch('root.utils.can_query_concurrently', return_value=True):
+            first = await gather_queries(*[(thread_name, value) for value in range(10)])
+            second = await gather_queries(*[(thread_name, value) for value in range(10)])
+
+        self.assertEqual([value for value, _ in first], list(range(10)))
+        threads = {name for _, name in first + second}
+        self.assertLessEqual(len(threads), ASYNC_QUERY_WORKERS)
+        self.assertTrue(all(name.startswith('async-queries') for name in threads))
+
+    async def test_kpis_match_the_sync_view(self):
+        expected = (await sync_to_async(self.client.get)('/kpis/')).json()
+
+        response = await self.call(AsyncKeyPerformanceIndicatorsView, '/kpis/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), expected)
+        response = await self.call(AsyncKeyPerformanceIndicatorsView, '/kpis/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    async def test_trend_and_search(self):
+        response = await self.call(AsyncMonthlyExpensesTrendView, '/expenses-kpis/monthly-expenses-trend/')
+        trend = json.loads(response.content)['monthly_expenses_trend']
+        self.assertEqual(sum(day['value'] for day in trend), 100)
+
+        expected = (await sync_to_async(self.client.get)('/search/?search=searchable')).json()
+        response = await self.call(AsyncMultiModelSearchView, '/search/?search=searchable')
+        self.assertEqual(json.loads(response.content), expected)
+        self.assertEqual(
+            [result['count'] for result in expected if result['model'] == 'Customer'], [1]
+        )
+
+    async def test_anonymous_requests_are_refused(self):
+        response = await self.call(AsyncKeyPerformanceIndicatorsView, '/kpis/', user=False)
+        self.assertEqual(response.status_code, 401)
+
+
+class ParallelSearchTests(TransactionTestCase):
+    """
+    The global search reads the models with hits on the worker pool, from
+    committed rows, and reports a model that runs over its timeout.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        city = City.objects.create(name='City', postal_code='0')
+        Customer.objects.create(business=self.business, name='Acme Customer', city=city)
+        Supplier.objects.create(business=self.business, name='Acme Supplier')
+        Location.objects.create(business=self.business, name='Acme Store', address='Main street')
+
+    def search(self, **kwargs):
+        # the dev database is in memory; the test runner shares it across threads
+        with mock.patch.object(GlobalSearch, 'can_run_in_parallel', return_value=True):
+            return GlobalSearch.search('acme', self.business.id, parallel=True, **kwargs)
+
+    def test_parallel_results_match_the_serial_ones(self):
+        threads = set()
+        collect_in_thread = GlobalSearch.collect_in_thread
+
+        def record_thread(*args):
+            threads.add(threading.current_thread().name)
+            return collect_in_thread(*args)
+
+        with mock.patch.object(GlobalSearch, 'collect_in_thread', side_effect=record_thread):
+            results = self.search()
+
+        self.assertEqual(results, GlobalSearch.search('acme', self.business.id, parallel=False))
+        self.assertEqual(
+            {result['model']: result['count'] for result in results if result['count']},
+            {'Customer': 1, 'Supplier': 1, 'Location': 1},
+        )
+        self.assertTrue(threads and all(name.startswith('global-search') for name in threads))
+
+    def test_a_slow_model_times_out_alone(self):
+        release = threading.Event()
+        collect_in_thread = GlobalSearch.collect_in_thread
+
+        def stall_suppliers(model, *args):
+            if model is Supplier:
+                release.wait(5)
+                return GlobalSearch.timed_out(model)
+            return collect_in_thread(model, *args)
+
+        try:
+            with mock.patch.object(GlobalSearch, 'collect_in_thread', side_effect=stall_suppliers):
+                started = time.monotonic()
+                results = {result['model']: result for result in self.search(timeout=0.2)}
+                elapsed = time.monotonic() - started
+        finally:
+            release.set()
+
+        self.assertLess(elapsed, 2)
+        self.assertEqual(
+            (results['Supplier']['timed_out'], results['Supplier']['partial'], results['Supplier']['results']),
+            (True, True, []),
+        )
+        self.assertEqual((results['Customer']['count'], results['Customer']['timed_out']), (1, False))
+        self.assertEqual((results['Location']['count'], results['Location']['timed_out']), (1, False))
+
+
+class MetricsTests(TestCase):
+    """
+    Every request is recorded against its route and served to the
+    scraper, merged with the figures other processes published.
+    """
+
+    def setUp(self):
+        cache.clear()
+        registry.routes.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        self.city = City.objects.create(name='City', postal_code='0')
+        Customer.objects.create(business=self.business, name='Customer', city=self.city)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_requests_are_recorded_per_route(self):
+        response = self.client.get('/customers/')
+        self.client.get(f'/customers/{self.business.customers.get().id}/')
+
+        figures = registry.routes[('customers/', 'GET')]
+        self.assertEqual(figures['requests'], {'2xx': 1})
+        self.assertEqual(figures['latency'][-2], 1)
+        self.assertGreater(figures['queries'][-1], 0)
+        self.assertGreater(figures['db_seconds'], 0)
+        self.assertGreater(figures['serializer_seconds'], 0)
+        self.assertEqual(figures['response_bytes'], len(response.content))
+        self.assertIn(('customers/(?P<pk>[^/.]+)/', 'GET'), registry.routes)
+
+    @override_settings(METRICS={'TOKEN': 'secret'})
+    def test_endpoint_requires_the_token(self):
+        self.client.get('/customers/')
+        client = APIClient()
+
+        self.assertEqual(client.get('/metrics/').status_code, 401)
+        self.assertEqual(client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+        response = client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('http_requests_total{route="customers/",method="GET",status="2xx"} 1\n', response.content.decode())
+        self.assertIn('# TYPE http_request_duration_seconds histogram', response.content.decode())
+        # the scrapes themselves are not recorded
+        self.assertNotIn('route="metrics/"', response.content.decode())
+
+    def shared_cache(self, directory):
+        return override_settings(
+            CACHES={**settings.CACHES, 'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory,
+            }},
+            METRICS={'TOKEN': 'secret', 'CACHE_ALIAS': 'shared'},
+        )
+
+    def test_published_processes_are_merged(self):
+        with tempfile.TemporaryDirectory() as directory, self.shared_cache(directory):
+            self.client.get('/customers/')
+            registry.flush(force=True)
+
+            shared = caches['shared']
+            shared.set('metrics:other:1', registry.snapshot())
+            shared.set('metrics:processes', {**shared.get('metrics:processes'), 'other:1': time.time()})
+
+            response = APIClient().get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn('http_requests_total{route="customers/",method="GET",status="2xx"} 2\n', response.content.decode())
+
+    def test_stopped_processes_are_pruned(self):
+        with tempfile.TemporaryDirectory() as directory, self.shared_cache(directory):
+            self.client.get('/customers/')
+            shared = caches['shared']
+            shared.set('metrics:gone:1', registry.snapshot())
+            shared.set('metrics:processes', {'gone:1': time.time() - 3600})
+
+            response = APIClient().get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertIn('status="2xx"} 1\n', response.content.decode())
+            registry.flush(force=True)
+            self.assertEqual(set(shared.get('metrics:processes')), {registry.process})
+
+    @override_settings(METRICS={'TOKEN': 'secret', 'CACHE_ALIAS': 'default'})
+    def test_per_process_cache_is_not_published(self):
+        self.client.get('/customers/')
+        registry.flush(force=True)
+
+        self.assertIsNone(cache.get('metrics:processes'))
+        response = APIClient().get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn('http_requests_total{route="customers/",method="GET",status="2xx"} 1\n', response.content.decode())
+
+
+class SeedTenantTests(TestCase):
+    """
+    The synthetic tenant is consistent with what the signals would have
+    maintained, and the same seed generates the same one.
+    """
+
+    COUNTS = {'products': 8, 'customers': 5, 'suppliers': 2, 'sales_invoices': 30,
+              'purchase_invoices': 6, 'expenses': 4, 'days': 20}
+
+    def test_seeded_tenant_is_consistent(self):
+        out = io.StringIO()
+        call_command('seed_tenant', *[f"--{key.replace('_', '-')}={value}" for key, value in self.COUNTS.items()], stdout=out)
+        business = Business.objects.get()
+        self.assertIn(f'Seeded business {business.id}', out.getvalue())
+
+        self.assertEqual(SalesInvoice.objects.filter(business=business).count(), 30)
+        self.assertEqual(Product.objects.filter(business=business).count(), 8)
+        self.assertFalse(InventoryItem.objects.filter(business=business, quantity_on_hand__lt=0).exists())
+
+        invoices = SalesInvoice.objects.filter(business=business)
+        self.assertGreater((timezone.now() - invoices.earliest('created_at').created_at).days, 0)
+        self.assertAlmostEqual(
+            DailyRollup.objects.filter(business=business).aggregate(total=Sum('sales_total'))['total'],
+            invoices.aggregate(total=Sum('total'))['total'],
+        )
+        # the ledger adds up to the stock on hand
+        for item in InventoryItem.objects.filter(business=business):
+            self.assertEqual(item.movements.aggregate(total=Sum('quantity'))['total'], item.quantity_on_hand)
+
+    def test_same_seed_same_tenant(self):
+        first = TenantSeeder(seed=3, **self.COUNTS).run()
+        second = TenantSeeder(seed=3, **self.COUNTS).run()
+
+        def names(business):
+            return list(Product.objects.filter(business=business).order_by('id').values_list('name', flat=True))
+
+        self.assertEqual(names(first), names(second))
+        self.assertEqual(
+            list(SalesInvoice.objects.filter(business=first).order_by('id').values_list('total', flat=True)),
+            list(SalesInvoice.objects.filter(business=second).order_by('id').values_list('total', flat=True)),
+        )
+
+    def test_benchmark_flags_regressions(self):
+        business = TenantSeeder(**self.COUNTS).run()
+        results = benchmarks.run(business, repeat=2, warmup=1, endpoints=['sales-invoices', 'kpis'])
+        self.assertEqual(results['sales-invoices']['status'], 200)
+        self.assertGreater(results['kpis']['queries'], 0)
+
+        baseline = {name: dict(result) for name, result in results.items()}
+        self.assertEqual(benchmarks.compare(results, baseline), {})
+
+        baseline['kpis']['queries'] -= 1
+        baseline['sales-invoices']['p50_ms'] = results['sales-invoices']['p50_ms'] / 2 - 5
+        regressions = benchmarks.compare(results, baseline)
+        self.assertEqual(sorted(regressions), ['kpis', 'sales-invoices'])
+        self.assertTrue(regressions['kpis'][0].startswith('queries'))
+
+
+class DailyRollupTests(TestCase):
+    """
+    The rollup of a day is recomputed under a lock on its row, and the
+    history that predates the table is filled in by migration 0019.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        self.customer = Customer.objects.create(
+            business=self.business, name='Customer', city=City.objects.create(name='City', postal_code='0')
+        )
+        for total in (10.0, 15.0):
+            SalesInvoice.objects.create(
+                business=self.business, customer=self.customer, created_by=self.user, total=total
+            )
+
+    def test_refresh_recomputes_the_day(self):
+        today = timezone.localdate()
+        DailyRollup.objects.filter(business=self.business).update(sales_total=0, sales_invoices=0)
+
+        rollup, created = DailyRollup.objects.refresh(self.business.id, today, SalesInvoice.objects)
+        self.assertFalse(created)
+        self.assertEqual((rollup.sales_total, rollup.sales_invoices), (25.0, 2))
+        self.assertEqual(DailyRollup.objects.get(business=self.business, day=today).sales_total, 25.0)
+
+    def test_deleting_the_business_leaves_no_rollup(self):
+        product = Product.objects.create(business=self.business, name='Product', unit=Unit.objects.create(name='pcs'))
+        invoice = SalesInvoice.objects.filter(business=self.business).first()
+        item = SalesInvoiceItem.objects.create(
+            business=self.business, sales_invoice=invoice, product=product, quantity=1, unit_price=10.0
+        )
+        ReturnedItem.objects.create(business=self.business, invoice_item=item)
+        Expense.objects.create(business=self.business, name='Rent', amount=100)
+        self.assertTrue(DailyRollup.objects.filter(business=self.business).exists())
+
+        self.business.delete()
+
+        self.assertFalse(DailyRollup.objects.exists())
+        connection.check_constraints()
+
+    def test_migration_backfills_the_history(self):
+        from django.apps import apps
+        from importlib import import_module
+        backfill = import_module('root.migrations.0019_backfill_daily_rollups').backfill_daily_rollups
+
+        DailyRollup.objects.all().delete()
+        backfill(apps, None)
+
+        rollup = DailyRollup.objects.get(business=self.business)
+        self.assertEqual((rollup.day, rollup.sales_total, rollup.sales_invoices), (timezone.localdate(), 25.0, 2))
+
+
+class SearchIndexTests(TestCase):
+    """
+    The search index follows writes, including renames of the rows other
+    documents show, and answers per business in rank order.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        self.city = City.objects.create(name='City', postal_code='0')
+        self.customer = Customer.objects.create(business=self.business, name='Alice', city=self.city)
+        self.invoice = SalesInvoice.objects.create(
+            business=self.business, customer=self.customer, created_by=self.user, invoice_number='INV-1'
+        )
+
+    def search(self, key, business=None, models=(SalesInvoice, Customer)):
+        return SearchDocument.objects.search((business or self.business).id, key, models)
+
+    def test_index_follows_writes_and_renames(self):
+        self.assertEqual(self.search('alice'), {
+            'sales.salesinvoice': [self.invoice.id], 'root.customer': [self.customer.id],
+        })
+
+        self.customer.name = 'Bob'
+        self.customer.save()
+        self.assertEqual(self.search('alice'), {})
+        self.assertEqual(self.search('bob')['sales.salesinvoice'], [self.invoice.id])
+
+        self.city.name = 'Springfield'
+        self.city.save()
+        self.assertEqual(self.search('springfield'), {'root.customer': [self.customer.id]})
+
+        self.invoice.delete()
+        self.assertEqual(self.search('bob'), {'root.customer': [self.customer.id]})
+
+    def test_unrelated_saves_reindex_nothing(self):
+        with mock.patch.object(SearchDocument.objects, 'reindex_dependents') as reindex:
+            self.customer.phone = '123'
+            self.customer.save()
+            self.customer.save(update_fields=['notes'])
+        reindex.assert_not_called()
+
+    def test_results_are_scoped_to_the_business(self):
+        other = Business.objects.create(name='Other', owner=self.user, phone='0')
+        Customer.objects.create(business=other, name='Alice', city=self.city)
+
+        self.assertEqual(self.search('alice')['root.customer'], [self.customer.id])
+        self.assertEqual(len(self.search('alice', other)['root.customer']), 1)
+        self.assertNotIn(self.customer.id, self.search('alice', other)['root.customer'])
+
+    def test_closer_matches_rank_first(self):
+        unit = Unit.objects.create(name='pcs')
+        # created first, so a plain newest-first order would put it last
+        close = Product.objects.create(business=self.business, name='Coffee', unit=unit)
+        loose = Product.objects.create(
+            business=self.business, name='Breakfast tea', unit=unit,
+            desc='A black tea blend, strong enough for milk, with a hint of coffee in the finish'
+        )
+
+        self.assertEqual(SearchDocument.objects.search(self.business.id, 'coffee', [Product]), {
+            'root.product': [close.id, loose.id],
+        })
+
+    def test_migration_backfills_existing_rows(self):
+        from django.apps import apps
+        from importlib import import_module
+        backfill = import_module('root.migrations.0020_backfill_search_documents').backfill_search_documents
+
+        SearchDocument.objects.all().delete()
+        backfill(apps, None)
+
+        self.assertEqual(self.search('alice'), {
+            'sales.salesinvoice': [self.invoice.id], 'root.customer': [self.customer.id],
+        })
@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested.routers import NestedDefaultRouter
-from .views import BusinessViewSet, CategoryViewSet, CityViewSet, CustomerKPIViewSet, CustomerViewSet, ExpenseKPIViewSet, ExpenseViewSet, KeyPerformanceIndicatorsViewSet, LocationKPIViewSet, LocationViewSet, MultiModelSearchView, ProductKPIViewSet, SupplierKPIViewSet, SupplierViewSet, UnitViewSet, ProductViewSet
+from .views import AsyncKeyPerformanceIndicatorsView, AsyncMonthlyExpensesTrendView, AsyncMultiModelSearchView, BusinessViewSet, CategoryViewSet, CityViewSet, CustomerKPIViewSet, CustomerViewSet, ExpenseKPIViewSet, ExpenseViewSet, KeyPerformanceIndicatorsViewSet, LocationKPIViewSet, LocationViewSet, MultiModelSearchView, BulkImportView, JobStatusView, MetricsView, ProductKPIViewSet, SupplierKPIViewSet, SupplierViewSet, UnitViewSet, ProductViewSet
 
 router = DefaultRouter()
 router.register('business', BusinessViewSet, basename='business')
@@ -19,7 +20,18 @@ router.register('product-kpis', ProductKPIViewSet, basename='products-kpis')
 router.register('location-kpis', LocationKPIViewSet, basename='locations-kpis')
 router.register('supplier-kpis', SupplierKPIViewSet, basename='supplier-kpis')
 router.register('expenses-kpis', ExpenseKPIViewSet, basename='expenses-kpis')
+router.register('kpis', KeyPerformanceIndicatorsViewSet, basename='kpis')
 
-urlpatterns = [
-    path('search/', MultiModelSearchView.as_view())
+# async twins of the dashboard reads, served in place of the sync ones under ASGI
+async_urlpatterns = [
+    path('kpis/', AsyncKeyPerformanceIndicatorsView.as_view()),
+    path('expenses-kpis/monthly-expenses-trend/', AsyncMonthlyExpensesTrendView.as_view()),
+    path('search/', AsyncMultiModelSearchView.as_view()),
+] if settings.ASYNC_DASHBOARD else []
+
+urlpatterns = async_urlpatterns + [
+    path('search/', MultiModelSearchView.as_view()),
+    path('import/<str:kind>/', BulkImportView.as_view()),
+    path('jobs/<int:pk>/', JobStatusView.as_view()),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ] + router.urls
\ No newline at end of file
@@ -1,20 +1,551 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from asgiref.sync import sync_to_async
 from django.template.loader import get_template
 from django.conf import settings
-from django.db.models import Q, Model
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import F, Q, Model, QuerySet
+from django.http import Http404, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from django.views import View
 from rest_framework.viewsets import ModelViewSet
-from .models import Business
+from .models import Business, BusinessConfig, CollectionVersion
+
+logger = logging.getLogger(__name__)
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+def shared_cache(alias):
+    """
+    caches[alias] if every process shares it, else None: entries in a
+    per-process cache (LocMem, the default without CACHES) could neither
+    be seen nor invalidated by the other workers.
+    """
+    if not alias or alias not in settings.CACHES:
+        return None
+    if settings.CACHES[alias].get('BACKEND') in PROCESS_LOCAL_CACHES:
+        return None
+    return caches[alias]
+
+# a shared cache alias, or None to resolve the active business once per request
+ACTIVE_BUSINESS_CACHE = getattr(settings, 'ACTIVE_BUSINESS_CACHE', None)
+ACTIVE_BUSINESS_CACHE_TIMEOUT = getattr(settings, 'ACTIVE_BUSINESS_CACHE_TIMEOUT', 60 * 15)
+
+def active_business_cache_key(user_id):
+    return f"active-business:{user_id}"
+
+def invalidate_active_business(user_id):
+    shared = shared_cache(ACTIVE_BUSINESS_CACHE)
+    if shared is not None:
+        shared.delete(active_business_cache_key(user_id))
+
+def resolve_active_business(user_id):
+    """
+    Returns {"business": Business | None, "config": BusinessConfig | None}
+    for a user. The business carries `inventory_id`, the id of its
+    inventory, so reaching the inventory costs no query.
+
+    Cached until invalidate_active_business() only when
+    ACTIVE_BUSINESS_CACHE names a shared cache; otherwise each request
+    resolves it afresh, since activating a business in one worker could
+    not evict the copies held by the others.
+    """
+    shared = shared_cache(ACTIVE_BUSINESS_CACHE)
+    key = active_business_cache_key(user_id)
+    if shared is not None:
+        resolved = shared.get(key)
+        if resolved is not None:
+            return resolved
+
+    businesses = list(
+        Business.objects.annotate(inventory_id=F('inventory_glance__id')).filter(owner_id=user_id, is_active=True)[:2]
+    )
+    if len(businesses) > 1:
+        logger.warning("User %s has more than one active business.", user_id)
+
+    resolved = {
+        "business": businesses[0] if len(businesses) == 1 else None,
+        "config": BusinessConfig.objects.filter(user_id = user_id).first(),
+    }
+    if shared is not None:
+        shared.set(key, resolved, ACTIVE_BUSINESS_CACHE_TIMEOUT)
+    return resolved
+
+def _resolve_for_request(request):
+    # Memoise on the underlying HttpRequest so DRF's Request wrapper and
+    # plain Django views share one resolution per request.
+    http_request = getattr(request, '_request', request)
+    resolved = getattr(http_request, '_active_business', None)
+    if resolved is None:
+        resolved = resolve_active_business(request.user.id)
+        http_request._active_business = resolved
+    return resolved
 
 def get_active_business(request):
 
     if request.user and request.user.is_authenticated:
-        try:
-            return Business.objects.get(owner_id = request.user.id, is_active=True)
-        except Exception as error:
-            print(error)
-            return None
+        return _resolve_for_request(request)["business"]
+    return None
+
+def get_business_config(request):
+
+    if request.user and request.user.is_authenticated:
+        return _resolve_for_request(request)["config"]
     return None
 
+_batched = threading.local()
+
+
+@contextmanager
+def batched_side_effects():
+    """
+    Coalesce the calls requested through run_batched() inside the block
+    into one call per distinct (function, arguments), made as the block
+    ends. Used around bulk deletes, where every cascaded row would refresh
+    the same glance or rollup again. Nested blocks join the outer one.
+    """
+    if getattr(_batched, 'calls', None) is not None:
+        yield
+        return
+
+    _batched.calls = {}
+    try:
+        yield
+        while _batched.calls:
+            _, (function, args, kwargs) = _batched.calls.popitem()
+            function(*args, **kwargs)
+    finally:
+        _batched.calls = None
+
+
+def in_batched_side_effects():
+    """
+    True inside a batched_side_effects() block.
+    """
+    return getattr(_batched, 'calls', None) is not None
+
+
+def run_batched(function, *args, **kwargs):
+    """
+    Call `function` when the surrounding batched_side_effects() block
+    ends, or right away outside of one.
+    """
+    calls = getattr(_batched, 'calls', None)
+    if calls is None:
+        return function(*args, **kwargs)
+    calls[(function, args, tuple(sorted(kwargs.items())))] = (function, args, kwargs)
+
+
+def collect_batched(function, item, *args):
+    """
+    Call function(*args, items) once with every item collected inside the
+    surrounding batched_side_effects() block, or function(*args, [item])
+    right away outside of one.
+    """
+    calls = getattr(_batched, 'calls', None)
+    if calls is None:
+        return function(*args, [item])
+    key = (function, args, 'collect')
+    if key not in calls:
+        calls[key] = (function, (*args, []), {})
+    calls[key][1][-1].append(item)
+
+class EagerLoadingViewSetMixin:
+    """
+    Applies the serializer's eager loading plan (see
+    root.serializers.EagerLoadingMixin) to every queryset the viewset
+    lists or looks objects up in.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        setup_eager_loading = getattr(self.get_serializer_class(), 'setup_eager_loading', None)
+        if setup_eager_loading and isinstance(queryset, QuerySet):
+            queryset = setup_eager_loading(queryset)
+        return queryset
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+    default_detail = ''
+
+
+def collection_validators(business_id, user_id, collections, window=None):
+    """
+    (ETag, Last-Modified) of a response built from a business'
+    `collections`, see CollectionVersion. With a `window` (seconds) the
+    ETag also rolls over periodically and there is no Last-Modified.
+    """
+    versions, last_modified = CollectionVersion.objects.current(business_id, collections)
+    seed = [business_id, user_id, sorted(versions.items())]
+    if window:
+        seed.append(int(time.time() // window))
+        last_modified = None
+    return quote_etag(hashlib.sha1(json.dumps(seed).encode()).hexdigest()), last_modified
+
+
+def not_modified(request, etag, last_modified):
+    """
+    Whether the request's If-None-Match / If-Modified-Since still match.
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+    return bool(last_modified and if_modified_since and int(last_modified.timestamp()) <= if_modified_since)
+
+
+class ConditionalGetViewSetMixin:
+    """
+    Answers GET requests whose If-None-Match / If-Modified-Since still match
+    the business' `versioned_collections` (see CollectionVersion) with a
+    304, checked after authentication with one query and before the
+    handler runs, so neither queryset nor serializer is touched. Responses
+    carry the ETag and Last-Modified to revalidate with.
+
+    `version_window` (seconds) also rolls the ETag over periodically, for
+    responses like KPIs that depend on the time as well as on the rows.
+    """
+
+    versioned_collections = []
+    version_window = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self.conditional_validators = None
+        business = get_active_business(request) if self.versioned_collections else None
+        if request.method not in ('GET', 'HEAD') or not business:
+            return
+
+        etag, last_modified = collection_validators(
+            business.id, request.user.pk, self.versioned_collections, self.version_window
+        )
+        self.conditional_validators = (etag, last_modified)
+        if not_modified(request, etag, last_modified):
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        validators = getattr(self, 'conditional_validators', None)
+        if validators and response.status_code in (200, 304) and not response.has_header('ETag'):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def can_query_concurrently():
+    """
+    Worker threads open their own connections, so they cannot see an
+    in-memory SQLite database or rows of a still open transaction.
+    """
+    if connection.in_atomic_block:
+        return False
+    return not (connection.vendor == 'sqlite' and connection.is_in_memory_db())
+
+
+ASYNC_QUERY_WORKERS = getattr(settings, 'ASYNC_QUERY_WORKERS', 4)
+
+_query_executor = None
+_query_executor_lock = threading.Lock()
+
+
+def query_executor():
+    """
+    The worker threads of gather_queries(), shared by all requests of the
+    process: at most ASYNC_QUERY_WORKERS connections however many
+    requests run at once, each kept open by its thread between calls.
+    """
+    global _query_executor
+    with _query_executor_lock:
+        if _query_executor is None:
+            _query_executor = ThreadPoolExecutor(max_workers=ASYNC_QUERY_WORKERS, thread_name_prefix='async-queries')
+    return _query_executor
+
+
+async def gather_queries(*calls):
+    """
+    Run independent ORM calls, `(function, *args)` each, concurrently and
+    return their results in order. The calls go to the query_executor()
+    threads, whose connections persist across requests, so a request
+    neither opens connections of its own nor runs more than
+    ASYNC_QUERY_WORKERS calls at a time; Django's async ORM would run all
+    queries of a request on one thread, one after the other. Where other
+    connections could not see the rows (see can_query_concurrently) the
+    calls run in turn on the request's connection.
+    """
+    if not await sync_to_async(can_query_concurrently)():
+        return [await sync_to_async(function)(*args) for function, *args in calls]
+
+    def run(function, *args):
+        try:
+            return function(*args)
+        finally:
+            # reconnect on the next call rather than reuse a broken connection
+            if connection.errors_occurred:
+                connection.close()
+
+    executor = query_executor()
+    return await asyncio.gather(*(
+        sync_to_async(run, thread_sensitive=False, executor=executor)(*call) for call in calls
+    ))
+
+
+class AsyncBusinessView(View):
+    """
+    Base of the async read-only endpoints (dashboard KPIs, trends, search)
+    served when the project runs under ASGI, see backend/asgi.py. The
+    request is authenticated the way the DRF views do it and the active
+    business resolved off the event loop, then `aget(request, business)`
+    returns the JSON-able data. Like ConditionalGetViewSetMixin, requests
+    still matching `versioned_collections` are answered with a 304.
+    """
+
+    versioned_collections = []
+    version_window = None
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            business, validators = await sync_to_async(self.resolve)(request)
+        except APIException as error:
+            detail = error.detail if isinstance(error.detail, (dict, list)) else {'detail': error.detail}
+            return JsonResponse(detail, status=error.status_code, safe=False)
+        if not business:
+            return JsonResponse({'detail': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        if validators and not_modified(request, *validators):
+            response = HttpResponseNotModified()
+        else:
+            data = await self.aget(request, business, *args, **kwargs)
+            if isinstance(data, JsonResponse):
+                return data
+            response = JsonResponse(data, encoder=JSONEncoder, safe=False)
+
+        if validators:
+            etag, last_modified = validators
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def resolve(self, request):
+        request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        business = get_active_business(request)
+        if not business or not self.versioned_collections:
+            return business, None
+        return business, collection_validators(
+            business.id, request.user.pk, self.versioned_collections, self.version_window
+        )
+
+    async def aget(self, request, business, *args, **kwargs):
+        raise NotImplementedError
+
+
+REFERENCE_DATA_CACHE = {
+    'ALIAS': None,              # shared cache holding versions and payloads; None for in-process only
+    'TIMEOUT': 60 * 60 * 24,    # payloads in the shared cache
+    'LOCAL_TIMEOUT': 60 * 5,    # in-process copies, when there is no shared cache to check against
+    'MAX_AGE': 60 * 60,         # Cache-Control max-age of the responses
+}
+
+_reference_data = {}            # {label: (version, expires, payload)}
+
+
+def reference_data_config():
+    return {**REFERENCE_DATA_CACHE, **getattr(settings, 'REFERENCE_DATA_CACHE', {})}
+
+
+def reference_data_cache():
+    """
+    The shared cache of ALIAS, or None (in-process copies only) when it
+    is unset or names a per-process backend, whose versions the other
+    processes could not see.
+    """
+    return shared_cache(reference_data_config()['ALIAS'])
+
+
+def reference_data_version(label):
+    """
+    The current version token of a reference table, from the shared cache
+    when there is one, so every process sees an invalidation at once.
+    """
+    shared = reference_data_cache()
+    if shared is None:
+        cached = _reference_data.get(label)
+        return cached[0] if cached else None
+
+    key = f"reference-version:{label}"
+    version = shared.get(key)
+    if version is None:
+        shared.add(key, uuid.uuid4().hex, None)
+        version = shared.get(key)
+    return version
+
+
+def invalidate_reference_data(label):
+    _reference_data.pop(label, None)
+    shared = reference_data_cache()
+    if shared is not None:
+        shared.set(f"reference-version:{label}", uuid.uuid4().hex, None)
+
+
+def resolve_reference_data(label, load):
+    """
+    Returns {"etag", "rows"} of a reference table: the
+    in-process copy while its version is current, else the shared cache's
+    copy, else `load()` (the serialized rows) run once and stored in both.
+    Without a shared cache the in-process copy lives LOCAL_TIMEOUT only.
+    """
+    config = reference_data_config()
+    version = reference_data_version(label)
+    cached = _reference_data.get(label)
+    if cached and cached[0] == version and cached[1] > time.monotonic():
+        return cached[2]
+
+    shared = reference_data_cache()
+    key = f"reference-data:{label}:{version}"
+    payload = shared.get(key) if shared is not None else None
+    if payload is None:
+        rows = load()
+        payload = {
+            'etag': quote_etag(hashlib.sha1(json.dumps(rows, sort_keys=True, default=str).encode()).hexdigest()),
+            'rows': rows,
+        }
+        if shared is not None:
+            shared.set(key, payload, config['TIMEOUT'])
+
+    if version is None:
+        version = uuid.uuid4().hex
+    expires = time.monotonic() + (config['LOCAL_TIMEOUT'] if shared is None else config['TIMEOUT'])
+    _reference_data[label] = (version, expires, payload)
+    return payload
+
+
+class ReferenceDataViewSetMixin:
+    """
+    Serves a small, near-static read-only table (cities, units, ...) from
+    resolve_reference_data(), so listing or retrieving rows costs no
+    queries once cached. Saving or deleting a row (the admin) invalidates
+    it, see root.signals. Responses may be reused by the client for
+    MAX_AGE seconds and revalidated against their ETag after.
+    """
+
+    def reference_data(self):
+        model = self.get_queryset().model
+
+        def load():
+            return [dict(row) for row in self.get_serializer(self.get_queryset().order_by('pk'), many=True).data]
+
+        return resolve_reference_data(model._meta.label_lower, load)
+
+    def cached_response(self, request, data, etag):
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Cache-Control'] = f"private, max-age={reference_data_config()['MAX_AGE']}"
+        return response
+
+    def list(self, request, *args, **kwargs):
+        payload = self.reference_data()
+        return self.cached_response(request, payload['rows'], payload['etag'])
+
+    def retrieve(self, request, *args, **kwargs):
+        payload = self.reference_data()
+        pk = str(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        for row in payload['rows']:
+            if str(row.get('id')) == pk:
+                return self.cached_response(request, row, payload['etag'])
+        raise Http404
+
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def stream_csv(queryset, fields, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    A CSV download of `fields` (value paths) of every row of `queryset`.
+    Rows are read as values() through a server-side cursor and written out
+    a chunk at a time, so memory stays flat however many rows there are and
+    the first bytes leave before the query is exhausted.
+    """
+    def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+
+        values = queryset.order_by(*queryset.query.order_by or ['pk']).values_list(*fields)
+        for count, row in enumerate(values.iterator(chunk_size=chunk_size), start=1):
+            writer.writerow([
+                json.dumps(value) if isinstance(value, (dict, list)) else value
+                for value in row
+            ])
+            if count % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    response = StreamingHttpResponse(rows(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+class ExportViewSetMixin:
+    """
+    Adds GET <list>/export/, a streamed CSV of `export_fields` for every row
+    the list would return under the same search and filter parameters,
+    unpaginated and without the serializer (or its eager loading).
+    """
+
+    export_fields = []
+
+    def export_queryset(self):
+        queryset = self.get_queryset()
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(self.request, queryset, self)
+
+        business = get_active_business(self.request)
+        return queryset.filter(business_id=business.id)
+
+    @action(['GET'], detail=False, url_path='export', url_name='export')
+    def export(self, request, *args, **kwargs):
+        if not get_active_business(request):
+            return Response({'detail': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        return stream_csv(self.export_queryset(), self.export_fields, self.basename or 'export')
+
 def generateTransactionId(instance: Model):
     
     """
@@ -27,10 +558,8 @@ def generateTransactionId(instance: Model):
 
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
 
-    try:
-        product_id = instance.product.id
-    except AttributeError:
-        product_id = "UNKNOWN"
+    # product_id avoids loading the product just for its key
+    product_id = getattr(instance, 'product_id', None) or "UNKNOWN"
 
     # Try extracting `quantity`
     quantity = getattr(instance, "quantity", None)
@@ -1,35 +1,44 @@
+import hmac
 from datetime import datetime
+from django.http import HttpResponse, JsonResponse
 from rest_framework import status
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet, GenericViewSet, ViewSet
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .utils import get_active_business
+from .deletes import BulkDeleteViewSetMixin
+from .utils import AsyncBusinessView, ConditionalGetViewSetMixin, EagerLoadingViewSetMixin, ExportViewSetMixin, ReferenceDataViewSetMixin, gather_queries, get_active_business, invalidate_active_business
+from .pagination import CreatedAtCursorPagination
 from .serializers import (
     BusinessCreateSerializer, CategorySerializer, CitySerializer, CustomerSerializer, ExpenseSerializer, LocationSerializer, SimpleCustomerSerializer, SupplierSerializer, UnitSerializer,
     BusinessSerializer,
     ProductCreateUpdateSerializer, ProductSerializer
 )
-from .models import Business, Category, City, Customer, Expense, Location, Product, Supplier, Unit
+from .models import Business, Category, City, Customer, DailyRollup, Expense, Job, Location, Product, Supplier, Unit
 from .filters import GlobalSearch
+from .imports import IMPORTERS, readRows
+from .metrics import metrics_config, registry
+from inventory.models import Inventory
+from sales.models import PurchaseInvoice, ReturnedItem, SalesInvoice, SalesInvoiceItem
 
-class CategoryViewSet(ReadOnlyModelViewSet):
+class CategoryViewSet(ReferenceDataViewSetMixin, ReadOnlyModelViewSet):
 
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 
 
-class CityViewSet(ReadOnlyModelViewSet):
+class CityViewSet(ReferenceDataViewSetMixin, ReadOnlyModelViewSet):
 
     queryset = City.objects.all()
     serializer_class = CitySerializer
 
 
-class UnitViewSet(ReadOnlyModelViewSet):
+class UnitViewSet(ReferenceDataViewSetMixin, ReadOnlyModelViewSet):
 
     queryset = Unit.objects.all()
     serializer_class = UnitSerializer
@@ -73,6 +82,7 @@ class BusinessViewSet(ModelViewSet):
                 business.is_active = (business.id == int(self.kwargs['pk']))
 
             Business.objects.bulk_update(businesses, ['is_active'])
+            invalidate_active_business(self.request.user.id)
 
             return Response({
                 "detail": "OK"
@@ -85,8 +95,12 @@ class BusinessViewSet(ModelViewSet):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, EagerLoadingViewSetMixin, ModelViewSet):
 
+    versioned_collections = ['products']
+    bulk_delete_field = 'product_ids'
+
+    pagination_class = CreatedAtCursorPagination
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = ['unit__name', 'is_active']
     search_fields = [
@@ -116,29 +130,11 @@ class ProductViewSet(ModelViewSet):
             "business_id": business.id
         }
 
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
-
-        product_ids = request.data.get('product_ids', [])
-        if not product_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            Product.objects.filter(id__in=product_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ProductKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
 
-class ProductKPIViewSet(GenericViewSet):
+    versioned_collections = ['products']
+    version_window = 60 * 5
 
     serializer_class = None
 
@@ -162,7 +158,10 @@ class ProductKPIViewSet(GenericViewSet):
         }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class SupplierViewSet(ModelViewSet):
+class SupplierViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['suppliers']
+    bulk_delete_field = 'supplier_ids'
 
     filter_backends = [SearchFilter]
     search_fields = [
@@ -187,29 +186,11 @@ class SupplierViewSet(ModelViewSet):
             'business_id': business.id,
         }
 
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
 
-        supplier_ids = request.data.get('supplier_ids', [])
-        if not supplier_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            Supplier.objects.filter(id__in=supplier_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+class SupplierKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
 
-
-class SupplierKPIViewSet(GenericViewSet):
+    versioned_collections = ['suppliers']
+    version_window = 60 * 5
 
     serializer_class = None
 
@@ -234,7 +215,10 @@ class SupplierKPIViewSet(GenericViewSet):
     
 
 
-class LocationViewSet(ModelViewSet):
+class LocationViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['locations']
+    bulk_delete_field = 'location_ids'
 
     filter_backends = [SearchFilter]
     search_fields = [
@@ -261,29 +245,11 @@ class LocationViewSet(ModelViewSet):
             'business_id': business.id
         }
 
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
-
-        location_ids = request.data.get('location_ids', [])
-        if not location_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            Location.objects.filter(id__in=location_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class LocationKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
 
-class LocationKPIViewSet(GenericViewSet):
+    versioned_collections = ['locations']
+    version_window = 60 * 5
 
     serializer_class = None
 
@@ -307,8 +273,12 @@ class LocationKPIViewSet(GenericViewSet):
         }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class CustomerViewSet(ModelViewSet):
+class CustomerViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, EagerLoadingViewSetMixin, ModelViewSet):
 
+    versioned_collections = ['customers']
+    bulk_delete_field = 'customer_ids'
+
+    pagination_class = CreatedAtCursorPagination
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = ['city__name']
     search_fields = [
@@ -336,29 +306,11 @@ class CustomerViewSet(ModelViewSet):
             'business_id': business.id
         }
 
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
 
-        customer_ids = request.data.get('customer_ids', [])
-        if not customer_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
+class CustomerKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
 
-        try:
-            Customer.objects.filter(id__in=customer_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-class CustomerKPIViewSet(GenericViewSet):
+    versioned_collections = ['customers']
+    version_window = 60 * 5
 
     serializer_class = None
 
@@ -382,13 +334,17 @@ class CustomerKPIViewSet(GenericViewSet):
         }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
     
 
-class ExpenseViewSet(ModelViewSet):
+class ExpenseViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, ExportViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['expenses']
+    bulk_delete_field = 'expense_ids'
     serializer_class = ExpenseSerializer
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = ['name', 'desc', 'amount']
     search_fields = [
         'id', 'name', 'desc', 'amount', 'created_at'
     ]
+    export_fields = ['id', 'name', 'desc', 'amount', 'created_at']
 
     def get_queryset(self):
         business = get_active_business(self.request)
@@ -405,29 +361,11 @@ class ExpenseViewSet(ModelViewSet):
             'business_id': business.id
         }
 
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
-
-        expense_ids = request.data.get('expense_ids', [])
-        if not expense_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            Expense.objects.filter(id__in=expense_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ExpenseKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
 
-class ExpenseKPIViewSet(GenericViewSet):
+    versioned_collections = ['expenses']
+    version_window = 60 * 5
 
     serializer_class = None
 
@@ -492,14 +430,27 @@ class ExpenseKPIViewSet(GenericViewSet):
 
 class MultiModelSearchView(APIView):
 
+    MAX_RESULTS_PER_MODEL = 50
+
     def get(self, request):
         
+        business = get_active_business(request)
+        if not business:
+            return Response({
+                'detail': 'Unauthorized'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
         query = request.query_params.get("search", "")
         if not query or not query.strip():
             return Response({"detail": "Query parameter 'search' is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(int(request.query_params.get("limit", 10)), self.MAX_RESULTS_PER_MODEL)
+        except ValueError:
+            return Response({"detail": "Query parameter 'limit' must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            results = GlobalSearch.search(query)
+            results = GlobalSearch.search(query, business.id, max(limit, 1))
         except Exception as error:
             print(f"There was an error performing the search: {error}")
             return Response({"detail": "Internal Server Error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -507,7 +458,232 @@ class MultiModelSearchView(APIView):
         return Response(results, status=status.HTTP_200_OK)
     
 
-class KeyPerformanceIndicatorsViewSet(ViewSet):
+class BulkImportView(APIView):
+    """
+    POST a CSV or JSONL `file` to /import/<kind>/ (products, customers,
+    suppliers or opening-stock). Valid rows are created, invalid ones
+    reported by line.
+    """
+
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, kind):
+
+        business = get_active_business(request)
+        if not business:
+            return Response({
+                'detail': 'Unauthorized'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        importer_class = IMPORTERS.get(kind)
+        upload = request.FILES.get('file')
+        if not importer_class or not upload:
+            return Response({
+                'detail': 'Bad Request.'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        importer = importer_class(business.id)
+        try:
+            result = importer.run(readRows(upload, request.data.get('format')))
+        except (ValueError, UnicodeDecodeError) as error:
+            # the chunks before the error are kept, say how far it got
+            return Response({
+                'detail': str(error),
+                **importer.result(),
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class JobStatusView(APIView):
+    """
+    GET /jobs/<id>/: how far a background job of the active business
+    (a bulk delete, ...) got.
+    """
+
+    def get(self, request, pk):
+
+        business = get_active_business(request)
+        if not business:
+            return Response({
+                'detail': 'Unauthorized'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        job = Job.objects.filter(pk=pk, business_id=business.id).first()
+        if not job:
+            return Response({
+                'detail': 'Not Found.'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'id': job.id,
+            'task': job.task,
+            'status': job.status,
+            'attempts': job.attempts,
+            'progress': job.progress,
+            'created_at': job.created_at,
+            'finished_at': job.finished_at,
+        }, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    GET /metrics/: the per-route figures of root.metrics in the Prometheus
+    text format, for a scraper sending `Authorization: Bearer <METRICS
+    TOKEN>` or a staff user.
+    """
+
+    permission_classes = []
+
+    def get(self, request):
+
+        token = metrics_config()['TOKEN']
+        header = request.headers.get('Authorization', '')
+        if not (token and hmac.compare_digest(header.encode(), f"Bearer {token}".encode())) and not request.user.is_staff:
+            return Response({
+                'detail': 'Unauthorized'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class KeyPerformanceIndicatorsViewSet(ConditionalGetViewSetMixin, ViewSet):
+
+    """
+    Every dashboard KPI in one response. Each table is read with a single
+    conditional aggregate (see the `kpis()` manager methods) instead of one
+    COUNT/SUM per metric and one HTTP round trip per card.
+    """
+
+    versioned_collections = [
+        'sales-invoices', 'purchase-invoices', 'returned-items', 'inventory',
+        'products', 'customers', 'suppliers', 'locations', 'expenses',
+    ]
+    version_window = 60 * 5
+
+    def list(self, request):
+
+        business = get_active_business(request)
+        if not business:
+            return Response({
+                'detail': 'Unauthorized'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        return Response(
+            self.collect(business.id), 
+            status=status.HTTP_200_OK
+        )
+
+    @staticmethod
+    def queries(business_id):
+        """
+        The independent reads the response is built from, as
+        {name: (function, *args)}.
+        """
+        return {
+            'business': (Business.objects.kpis, business_id),
+            'rollup': (DailyRollup.objects.kpis, business_id),
+            'sales': (SalesInvoice.objects.kpis, business_id),
+            'sales_trend': (SalesInvoice.objects.monthly_sales_trend, business_id),
+            'recent_sales': (SalesInvoice.objects.recent_sales, business_id),
+            'purchases': (PurchaseInvoice.objects.kpis, business_id),
+            'expenses': (Expense.objects.kpis, business_id),
+            'expenses_trend': (Expense.objects.monthly_expenses_trend, business_id),
+            'returned_items': (ReturnedItem.objects.kpis, business_id),
+            'inventory': (Inventory.objects.kpis, business_id),
+        }
+
+    @classmethod
+    def collect(cls, business_id):
+        return cls.assemble({
+            name: function(*args) for name, (function, *args) in cls.queries(business_id).items()
+        })
+
+    @staticmethod
+    def assemble(results):
+
+        rollup = results['rollup']
+        def period(**keys):
+            return {key: rollup[field] for key, field in keys.items()}
+
+        sales = results['sales']
+        sales.update(period(
+            daily_total_sales='daily_sales_total', daily_total_invoices='daily_sales_invoices',
+            daily_total_items='daily_items_sold', monthly_total_sales='monthly_sales_total',
+            monthly_total_invoices='monthly_sales_invoices', monthly_total_items='monthly_items_sold',
+        ))
+        sales['monthly_sales_trend'] = results['sales_trend']
+        sales['recent_sales'] = results['recent_sales']
+
+        purchases = results['purchases']
+        purchases.update(period(
+            monthly_total_purchases='monthly_purchases_total',
+            monthly_total_invoices='monthly_purchase_invoices',
+        ))
+
+        expenses = results['expenses']
+        expenses.update(period(
+            monthly_total_expenses='monthly_expenses',
+            monthly_total_expense_amount='monthly_expenses_total',
+        ))
+        expenses['monthly_expenses_trend'] = results['expenses_trend']
+
+        returned_items = results['returned_items']
+        returned_items.update(period(
+            monthly_returned_items='monthly_returned_items',
+            monthly_returned_quantity='monthly_returned_quantity',
+        ))
+
+        return {
+            **results['business'],
+            "sales": sales,
+            "purchases": purchases,
+            "expenses": expenses,
+            "inventory": results['inventory'],
+            "returned_items": returned_items,
+        }
+
+
+### async twins of the dashboard reads, routed in place of the sync
+### ones when the project runs under ASGI (settings.ASYNC_DASHBOARD)
+class AsyncKeyPerformanceIndicatorsView(AsyncBusinessView):
+    """
+    GET /kpis/ with the independent reads run concurrently.
+    """
+
+    versioned_collections = KeyPerformanceIndicatorsViewSet.versioned_collections
+    version_window = KeyPerformanceIndicatorsViewSet.version_window
+
+    async def aget(self, request, business):
+        queries = KeyPerformanceIndicatorsViewSet.queries(business.id)
+        results = await gather_queries(*queries.values())
+        return KeyPerformanceIndicatorsViewSet.assemble(dict(zip(queries, results)))
+
+
+class AsyncMonthlyExpensesTrendView(AsyncBusinessView):
+
+    versioned_collections = ['expenses']
+    version_window = 60 * 5
+
+    async def aget(self, request, business):
+        return {
+            "monthly_expenses_trend": await Expense.objects.amonthly_expenses_trend(business.id)
+        }
+
+
+class AsyncMultiModelSearchView(AsyncBusinessView):
+    """
+    GET /search/ with the matched models read concurrently.
+    """
+
+    async def aget(self, request, business):
+        query = request.GET.get("search", "")
+        if not query or not query.strip():
+            return JsonResponse({"detail": "Query parameter 'search' is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(int(request.GET.get("limit", 10)), MultiModelSearchView.MAX_RESULTS_PER_MODEL)
+        except ValueError:
+            return JsonResponse({"detail": "Query parameter 'limit' must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
 
-    pass   
-    
\ No newline at end of file
+        return await GlobalSearch.asearch(query, business.id, max(limit, 1))
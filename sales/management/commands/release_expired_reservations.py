@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sales.models import SalesReservation
+from sales.utils import releaseSalesReservations
+
+
+class Command(BaseCommand):
+    help = "Release the stock held by sales reservations that have expired."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, help="Only release reservations of this business id.")
+
+    def handle(self, *args, **options):
+        expired = SalesReservation.objects.filter(expires_at__lte=timezone.now())
+        if options.get('business'):
+            expired = expired.filter(sales_invoice__business_id=options['business'])
+
+        released = releaseSalesReservations(expired)
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations."))
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('root', '0014_customer_customer_business_cursor_idx_and_more'),
+        ('sales', '0009_alter_purchaseinvoiceitemrestock_received_at_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchaseinvoice',
+            index=models.Index(fields=['business', '-created_at', 'id'], name='pi_business_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='returneditem',
+            index=models.Index(fields=['business', '-created_at', 'id'], name='ri_business_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='salesinvoice',
+            index=models.Index(fields=['business', '-created_at', 'id'], name='si_business_cursor_idx'),
+        ),
+    ]
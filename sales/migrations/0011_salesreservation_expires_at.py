@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0010_purchaseinvoice_pi_business_cursor_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesreservation',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
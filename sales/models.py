@@ -1,13 +1,14 @@
 from calendar import monthrange
 from typing import Dict
 from datetime import date, datetime, timedelta
-from django.db import models
-from django.db.models import Sum
-from django.db.models.functions import TruncDate
+from django.db import models, transaction
+from django.db.models import Avg, Count, Q, Sum
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast, Coalesce, TruncDate
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from root.utils import generateTransactionId
-from root.models import Business, BusinessConfig, Customer, BaseItem, Supplier, Location, BaseQuerySet
+from root.models import Business, BusinessConfig, Customer, BaseItem, DailyRollup, Supplier, Location, BaseQuerySet
 
 
 # Create your models here.
@@ -42,26 +43,46 @@ class SalesInvoiceQuerySet(BaseQuerySet):
 
 class SalesInvoiceManager(models.Manager):
 
+    ROLLUP = {
+        'sales_total': Coalesce(Sum('total'), 0.0),
+        'sales_invoices': Count('id'),
+    }
+
     def get_queryset(self):
         return SalesInvoiceQuerySet(self.model)
 
-    def total_sales(self, business_id, num_days=None):
-        queryset = self.get_queryset().for_business(business_id)
+    def daily_rollup(self, business_id=None, day=None):
+        return self.get_queryset().daily_rollup(self.ROLLUP, business_id, day)
 
+    def total_sales(self, business_id, num_days=None):
         if num_days:
-            queryset = queryset.in_period(num_days)
+            return DailyRollup.objects.period_totals(business_id, num_days)['sales_total']
 
+        queryset = self.get_queryset().for_business(business_id)
         return queryset.aggregate(total=Sum("total"))["total"] or 0
 
     def total_invoices(self, business_id, num_days=None):
-        return self.get_queryset().for_business(business_id).in_period(num_days).count() 
+        if num_days:
+            return DailyRollup.objects.period_totals(business_id, num_days)['sales_invoices']
+
+        return self.get_queryset().for_business(business_id).count()
 
     def monthly_sales_trend(self, business_id):
-        return self.get_queryset().monthly_trend(business_id, 'total')
+        return DailyRollup.objects.monthly_trend(business_id, 'sales_total')
+
+    async def amonthly_sales_trend(self, business_id):
+        return await DailyRollup.objects.amonthly_trend(business_id, 'sales_total')
+
+    def kpis(self, business_id):
+        return self.get_queryset().for_business(business_id).aggregate(
+            total_sales=Coalesce(Sum('total'), 0.0),
+            total_invoices=Count('id'),
+            avg_order_value=Coalesce(Avg('total'), 0.0),
+        )
 
     def recent_sales(self, business_id):
         queryset = self.get_queryset().for_business(
-            business_id).order_by('-created_at')[:4]
+            business_id).order_by('-created_at').prefetch_related('invoice_items__product')[:4]
 
         res = []
         for sale in queryset:
@@ -76,16 +97,15 @@ class SalesInvoiceManager(models.Manager):
 
         return res[:6]
 
-    def average_order_value(self, business_id):
-        queryset = self.get_queryset().for_business(business_id)
-
-        quantity = 0
-        total_value = 0
-        for invoice in queryset:
-            total_value += invoice.total
-            quantity += 1
+    def average_order_value(self, business_id, num_days=None):
+        if num_days:
+            totals = DailyRollup.objects.period_totals(business_id, num_days)
+            if not totals['sales_invoices']:
+                return 0
+            return int(totals['sales_total'] / totals['sales_invoices'])
 
-        return int(total_value/quantity)
+        queryset = self.get_queryset().for_business(business_id)
+        return int(queryset.aggregate(avg=Avg("total"))["avg"] or 0)
 
 
 class SalesInvoice(models.Model):
@@ -141,6 +161,28 @@ class SalesInvoice(models.Model):
 
     objects = SalesInvoiceManager()
 
+    def save(self, *args, **kwargs):
+        """
+        Save the invoice and bring its stock in line with its status
+        (reserve, deduct or release, see sales.utils.updateInventoryOnSale)
+        in one transaction. An existing invoice is posted before its row is
+        written, so a stock shortfall leaves the stored status as it was.
+        Saves limited to other columns (adjust_totals) post nothing.
+        """
+        from .utils import updateInventoryOnSale
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'status' not in update_fields:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                updateInventoryOnSale(self)
+            else:
+                updateInventoryOnSale(self)
+                super().save(*args, **kwargs)
+
     def update_deduction_flags(self):
         items = self.invoice_items.all()
         deducted = 0
@@ -164,13 +206,30 @@ class SalesInvoice(models.Model):
         return f"{self.id}-{self.invoice_number}-{self.total}-{self.status}"
 
     def adjust_totals(self):
-        items = self.invoice_items.all()
-        if not items:
+        """
+        Recompute sub_total and total from the invoice items, read with a
+        single aggregate query.
+        """
+        discount_value = Cast(KT('discount__value'), models.FloatField())
+        totals = self.invoice_items.aggregate(
+            count=Count('id'),
+            sub_total=Sum(models.ExpressionWrapper(
+                models.F('quantity') * models.F('unit_price'), output_field=models.FloatField()
+            ), default=0.0),
+            item_discount=Sum(models.Case(
+                models.When(discount__type='percentage', then=models.F('unit_price') * discount_value / 100),
+                models.When(discount__type='amount', then=discount_value),
+                default=models.Value(0.0),
+                output_field=models.FloatField(),
+            ), default=0.0),
+        )
+        if not totals['count']:
             return
 
-        subtotal = sum(item.quantity * item.unit_price for item in items)
+        subtotal = totals['sub_total']
 
-        # Calculate total discount on the order.
+        # Calculate total discount on the order, the item discounts
+        # only apply when the invoice has none of its own.
         discount = 0
         if self.discount:
             if self.discount["type"] == "percentage":
@@ -183,18 +242,7 @@ class SalesInvoice(models.Model):
                 raise Exception("incorrect value")
 
         else:
-            for item in items:
-                if not item.discount:
-                    continue
-
-                if item.discount["type"] == "percentage":
-                    discount += item.unit_price * (item.discount["value"]/100)
-
-                elif item.tax["type"] == "amount":
-                    discount += item.discount["value"]
-
-                else:
-                    raise Exception("incorrect value")
+            discount = totals['item_discount']
 
         # Calculate tax on the Invoice
         tax = 0
@@ -233,6 +281,10 @@ class SalesInvoice(models.Model):
                 name='is_deducted_and_is_partially_deducted_mutually_exclusive_si'
             )
         ]
+        indexes = [
+            # backs the (-created_at, id) cursor of the list endpoint
+            models.Index(fields=['business', '-created_at', 'id'], name='si_business_cursor_idx'),
+        ]
 
 
 class SalesInvoiceItemQuerySet(BaseQuerySet):
@@ -241,17 +293,25 @@ class SalesInvoiceItemQuerySet(BaseQuerySet):
 
 class SalesInvoiceItemManager(models.Manager):
 
+    ROLLUP = {
+        'items_sold': Coalesce(Sum('quantity'), 0),
+    }
+
     def get_queryset(self):
         return SalesInvoiceItemQuerySet(self.model)
-    
-    def total_items_sold(self, business_id, num_days):
-        queryset = self.get_queryset().for_business(business_id).in_period(num_days)
-        total_items = 0
 
-        for item in queryset:
-            total_items += item.quantity
+    def daily_rollup(self, business_id=None, day=None):
+        # Items are attributed to the day of their invoice.
+        return self.get_queryset().daily_rollup(
+            self.ROLLUP, business_id, day, date_field='sales_invoice__created_at'
+        )
+    
+    def total_items_sold(self, business_id, num_days=None):
+        if num_days:
+            return DailyRollup.objects.period_totals(business_id, num_days)['items_sold']
 
-        return total_items
+        queryset = self.get_queryset().for_business(business_id)
+        return queryset.aggregate(total=Sum("quantity"))["total"] or 0
 
 
 class SalesInvoiceItem(BaseItem):
@@ -272,6 +332,28 @@ class SalesInvoiceItem(BaseItem):
 
     objects = SalesInvoiceItemManager()
 
+    def save(self, *args, **kwargs):
+        """
+        Save the line and, on an open invoice, reserve its quantity (see
+        sales.utils.reserveSalesInvoiceItem) in one transaction. An
+        existing line is reserved before its row is written, so a stock
+        shortfall leaves the stored line as it was. Saves limited to other
+        columns (the deduction and return flags) reserve nothing.
+        """
+        from .utils import reserveSalesInvoiceItem
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'product', 'product_id', 'quantity'} & set(update_fields):
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                reserveSalesInvoiceItem(self)
+            else:
+                reserveSalesInvoiceItem(self)
+                super().save(*args, **kwargs)
+
     def compute_restock_delta(self) -> int:
         """
         Sum up all past restocks to find out how many units remain to add.
@@ -314,19 +396,29 @@ class PurchaseInvoiceQuerySet(BaseQuerySet):
 
 class PurchaseInvoiceManager(models.Manager):
 
+    ROLLUP = {
+        'purchases_total': Coalesce(Sum('total'), 0.0),
+        'purchase_invoices': Count('id'),
+    }
+
     def get_queryset(self):
         return PurchaseInvoiceQuerySet(self.model)
 
-    def total_purchases(self, business_id, num_days=None):
-        queryset = self.get_queryset().for_business(business_id)
+    def daily_rollup(self, business_id=None, day=None):
+        return self.get_queryset().daily_rollup(self.ROLLUP, business_id, day)
 
+    def total_purchases(self, business_id, num_days=None):
         if num_days:
-            queryset = queryset.in_period(num_days)
+            return DailyRollup.objects.period_totals(business_id, num_days)['purchases_total']
 
+        queryset = self.get_queryset().for_business(business_id)
         return queryset.aggregate(total=Sum("total"))["total"] or 0
 
     def total_invoices(self, business_id, num_days=None):
-        return self.get_queryset().for_business(business_id).in_period(num_days).count() 
+        if num_days:
+            return DailyRollup.objects.period_totals(business_id, num_days)['purchase_invoices']
+
+        return self.get_queryset().for_business(business_id).count()
 
     def total_pending_invoices(self, business_id):
         return self.get_queryset().for_business(business_id).filter(payment_status="PEN").count() 
@@ -336,6 +428,16 @@ class PurchaseInvoiceManager(models.Manager):
 
         return queryset.aggregate(total=Sum("total"))["total"] or 0
 
+    def kpis(self, business_id):
+        pending = Q(payment_status="PEN")
+
+        return self.get_queryset().for_business(business_id).aggregate(
+            total_purchases=Coalesce(Sum('total'), 0.0),
+            total_invoices=Count('id'),
+            total_pending_invoices=Count('id', filter=pending),
+            total_pending_payment=Coalesce(Sum('total', filter=pending), 0.0),
+        )
+
 
 class PurchaseInvoice(models.Model):
 
@@ -390,9 +492,13 @@ class PurchaseInvoice(models.Model):
         return f"{self.id}-{self.invoice_number}-{self.total}-{self.status}"
 
     def adjust_totals(self):
-        # Assuming related_name='items' in SalesInvoiceItem
-        items = self.invoice_items.all()
-        subtotal = sum(item.quantity * item.unit_cost for item in items)
+        """
+        Recompute sub_total and total from the invoice items, read with a
+        single aggregate query.
+        """
+        subtotal = self.invoice_items.aggregate(sub_total=Sum(models.ExpressionWrapper(
+            models.F('quantity') * models.F('unit_cost'), output_field=models.FloatField()
+        ), default=0.0))['sub_total']
 
         # Calculate tax on the Invoice
         tax = 0
@@ -451,6 +557,9 @@ class PurchaseInvoice(models.Model):
                 name='is_restocked_and_is_partially_restocked_mutually_exclusive_pi'
             )
         ]
+        indexes = [
+            models.Index(fields=['business', '-created_at', 'id'], name='pi_business_cursor_idx'),
+        ]
 
 
 class PurchaseInvoiceItem(BaseItem):
@@ -545,6 +654,7 @@ class SalesReservation(BaseRestock):
         SalesInvoice, models.CASCADE, related_name='deductions')
     sales_invoice_item = models.ForeignKey(
         SalesInvoiceItem, models.CASCADE, related_name='deductions')
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"{self.sales_invoice.id}: {self.sales_invoice_item.product.name} x {self.quantity}"
@@ -620,9 +730,17 @@ class ReturnedItemsQuerySet(BaseQuerySet):
 
 class ReturnedItemManager(models.Manager):
 
+    ROLLUP = {
+        'returned_items': Count('id'),
+        'returned_quantity': Coalesce(Sum('quantity'), 0),
+    }
+
     def get_queryset(self):
         return ReturnedItemsQuerySet(self.model)
 
+    def daily_rollup(self, business_id=None, day=None):
+        return self.get_queryset().daily_rollup(self.ROLLUP, business_id, day)
+
     def total_returned_items(self, business_id, num_days=None):
         queryset = self.get_queryset().for_business(business_id)
 
@@ -631,6 +749,11 @@ class ReturnedItemManager(models.Manager):
 
         return queryset.count()
 
+    def kpis(self, business_id):
+        return self.get_queryset().for_business(business_id).aggregate(
+            total_returned_items=Count('id'),
+        )
+
 
 class ReturnedItem(models.Model):
     business = models.ForeignKey(
@@ -649,3 +772,8 @@ class ReturnedItem(models.Model):
 
     def __str__(self):
         return f"Return for {self.invoice_item.product.name} from Invoice {self.invoice_item.sales_invoice.invoice_number}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', '-created_at', 'id'], name='ri_business_cursor_idx'),
+        ]
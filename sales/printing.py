@@ -0,0 +1,154 @@
+import hashlib
+import io
+import json
+import zipfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.template.loader import get_template
+
+from .models import SalesInvoice, SalesInvoiceItem
+
+
+INVOICE_TEMPLATE = 'invoice.html'
+INVOICE_RENDER_CACHE_TIMEOUT = getattr(settings, 'INVOICE_RENDER_CACHE_TIMEOUT', 60 * 60 * 24 * 30)
+
+
+def printableInvoices(queryset=None):
+    """
+    Invoices with everything the template shows loaded up front, two
+    queries however many invoices are rendered.
+    """
+    queryset = SalesInvoice.objects.all() if queryset is None else queryset
+    return queryset.select_related('business', 'customer').prefetch_related(
+        Prefetch('invoice_items', SalesInvoiceItem.objects.select_related('product').order_by('id'))
+    )
+
+
+def itemDiscount(item: SalesInvoiceItem):
+    """
+    The discount of one line as SalesInvoice.adjust_totals() sums it: a
+    percentage of the unit price or a flat amount, once per line.
+    """
+    spec = item.discount or {}
+    if spec.get('type') == 'percentage':
+        return round((item.unit_price or 0) * spec['value'] / 100, 2)
+    if spec.get('type') == 'amount':
+        return round(spec['value'], 2)
+    return 0
+
+
+def invoiceContext(invoice: SalesInvoice):
+    """
+    The template context of an invoice, with discount and tax applied the
+    way SalesInvoice.adjust_totals() does: the item discounts count, in
+    their lines and the discount line, when the invoice has no discount
+    of its own.
+    """
+    item_discounts = not invoice.discount
+    items = []
+    for item in invoice.invoice_items.all():
+        discount = itemDiscount(item) if item_discounts else 0
+        items.append({
+            'name': item.product.name,
+            'quantity': item.quantity,
+            'rate': item.unit_price,
+            'discount': discount,
+            'total': round(item.quantity * (item.unit_price or 0) - discount, 2),
+        })
+    subtotal = invoice.sub_total or 0
+
+    def charge(spec):
+        spec = spec or {}
+        if spec.get('type') == 'percentage':
+            return round(subtotal * spec['value'] / 100, 2)
+        return round(spec.get('value', 0), 2)
+
+    if item_discounts:
+        discount_amount = round(sum(item['discount'] for item in items), 2)
+    else:
+        discount_amount = charge(invoice.discount)
+
+    business, customer = invoice.business, invoice.customer
+    return {
+        'business': {
+            'name': business.name, 'address': business.address, 'phone': business.phone,
+            'logo': business.logo.url if business.logo else '',
+        },
+        'customer': {'name': customer.name, 'phone': customer.phone, 'address': customer.address},
+        'invoice': {
+            'id': invoice.id,
+            'number': invoice.invoice_number or invoice.id,
+            'created_at': invoice.created_at.strftime('%Y-%m-%d %H:%M'),
+            'items': items,
+            'subtotal': subtotal,
+            'discount': bool(discount_amount),
+            'discount_type': (invoice.discount or {}).get('type'),
+            'discount_value': (invoice.discount or {}).get('value'),
+            'discount_amount': discount_amount,
+            'tax': bool(invoice.tax),
+            'tax_type': (invoice.tax or {}).get('type'),
+            'tax_value': (invoice.tax or {}).get('value'),
+            'tax_amount': charge(invoice.tax),
+            'net_amount': invoice.total,
+        },
+    }
+
+
+_template_digest = None
+
+
+def templateDigest():
+    global _template_digest
+    if _template_digest is None:
+        source = get_template(INVOICE_TEMPLATE).template.source
+        _template_digest = hashlib.sha256(source.encode()).hexdigest()
+    return _template_digest
+
+
+def invoiceContentHash(context):
+    """
+    Hash of everything the printed invoice shows, plus the template, so a
+    cached render is reused exactly as long as it would come out the same.
+    """
+    content = json.dumps([templateDigest(), context], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def renderInvoice(invoice: SalesInvoice):
+    """
+    (html, content hash) of an invoice, from the render cache when an
+    invoice with the same content was rendered before.
+    """
+    context = invoiceContext(invoice)
+    digest = invoiceContentHash(context)
+    key = f"invoice-html:{digest}"
+
+    html = cache.get(key)
+    if html is None:
+        html = get_template(INVOICE_TEMPLATE).render(context)
+        cache.set(key, html, INVOICE_RENDER_CACHE_TIMEOUT)
+    return html, digest
+
+
+def renderInvoiceArchive(invoices):
+    """
+    A zip of the rendered invoices, one HTML file each, with the cached
+    renders fetched in one round trip.
+    """
+    contexts = {invoice.id: invoiceContext(invoice) for invoice in invoices}
+    keys = {pk: f"invoice-html:{invoiceContentHash(context)}" for pk, context in contexts.items()}
+    cached = cache.get_many(keys.values())
+
+    rendered = {}
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip:
+        for pk, context in contexts.items():
+            html = cached.get(keys[pk])
+            if html is None:
+                html = rendered[keys[pk]] = get_template(INVOICE_TEMPLATE).render(context)
+            zip.writestr(f"invoice-{pk}.html", html)
+
+    cache.set_many(rendered, INVOICE_RENDER_CACHE_TIMEOUT)
+    return archive.getvalue()
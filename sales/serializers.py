@@ -1,18 +1,22 @@
 from django.db import transaction
+from django.db.models import Count, Sum
 from rest_framework import serializers
 
 from core.serializers import SimpleUserSerializer
-from root.models import Location
+from root.models import Location, SearchDocument
 from root.serializers import (
     BusinessSerializer, CustomerSerializer, SimpleBusinessSerializer, SimpleCustomerSerializer, SimpleProductSerializer, SimpleSupplierSerializer, 
-    SupplierSerializer, BaseItemSerializer
+    SupplierSerializer, BaseItemSerializer, EagerLoadingMixin
 )
-from inventory.models import InventoryItem
-from .models import PurchaseInvoice, PurchaseInvoiceItem, SalesInvoice, SalesInvoiceItem, ReturnedItem
+from inventory.models import Inventory, InventoryItem, StockMovement
+from .models import PurchaseInvoice, PurchaseInvoiceItem, SalesInvoice, SalesInvoiceItem, SalesReservation, ReturnedItem
 from .utils import (
     checkPurchaseInvoiceItemFields, 
     checkPurchaseInvoiceCreateFields,
     checkSalesInvoiceItemCreateFields,
+    checkSalesInvoiceItemsStock,
+    OPEN_SALES_STATUSES,
+    adjust_totals_later, deferred_totals,
     updateInventoryOnSale
 )
 
@@ -82,7 +86,9 @@ class PurchaseInvoiceItemUpdateSerializer(serializers.Serializer):
         return instance
 
 
-class SimplePurchaseInvoiceItemSerializer(serializers.ModelSerializer):
+class SimplePurchaseInvoiceItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['product']
 
     product = SimpleProductSerializer(read_only=True)
 
@@ -94,7 +100,10 @@ class SimplePurchaseInvoiceItemSerializer(serializers.ModelSerializer):
         ]
 
 
-class PurchaseInvoiceSerializer(serializers.ModelSerializer):
+class PurchaseInvoiceSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['created_by']
+    prefetch_related = ['invoice_items__product']
 
     invoice_items = SimplePurchaseInvoiceItemSerializer(many=True, read_only=True)
     # business = SimpleBusinessSerializer(read_only=True)
@@ -111,12 +120,18 @@ class PurchaseInvoiceSerializer(serializers.ModelSerializer):
         ]
 
 
-class SimplePurchaseInvoiceSerializer(serializers.ModelSerializer):
+class SimplePurchaseInvoiceSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['supplier']
+    annotations = {'total_items_count': Count('invoice_items')}
 
     supplier = SimpleSupplierSerializer(read_only=True, required=False)
     total_items = serializers.SerializerMethodField()
 
     def get_total_items(self, obj):
+        count = getattr(obj, 'total_items_count', None)
+        if count is not None:
+            return count
         return len(obj.invoice_items.all())
 
     class Meta:
@@ -178,7 +193,7 @@ class PurchaseInvoiceAndItemsCreateSerializer(serializers.ModelSerializer):
         items = self.validated_data.pop('items')
 
         try:
-            with transaction.atomic():
+            with deferred_totals():
                 purchase_invoice = PurchaseInvoice.objects.create(
                     business_id = self.context['business_id'],
                     created_by_id = self.context['user_id'],
@@ -193,8 +208,9 @@ class PurchaseInvoiceAndItemsCreateSerializer(serializers.ModelSerializer):
                     unit_cost = item['unit_cost']
                 ) for item in items]
                 invoice_items = PurchaseInvoiceItem.objects.bulk_create(invoice_items)
+                SearchDocument.objects.index(invoice_items)
+                adjust_totals_later(purchase_invoice)
 
-            purchase_invoice.adjust_totals()
             return purchase_invoice
         
         except Exception as error:
@@ -224,7 +240,7 @@ class PurchaseInvoiceAndItemsUpdateSerializer(serializers.ModelSerializer):
         items = self.validated_data.pop('items')
 
         try:
-            with transaction.atomic():
+            with deferred_totals():
                 for attr, value in self.validated_data.items():
                     setattr(self.instance, attr, value)
 
@@ -271,10 +287,11 @@ class PurchaseInvoiceAndItemsUpdateSerializer(serializers.ModelSerializer):
                     ])
 
                 updated_ids = [item.id for item in updated_items]
-                existing_items = existing_items.exclude(id__in=updated_ids)
+                new_ids = [item.id for item in new_items]
+                existing_items = existing_items.exclude(id__in=updated_ids+new_ids)
                 existing_items.delete()
-                
-            self.instance.adjust_totals()
+                adjust_totals_later(self.instance)
+
             return self.instance
     
         except Exception as error:
@@ -297,7 +314,9 @@ class PurchaseInvoiceAndItemsUpdateSerializer(serializers.ModelSerializer):
         ]
 
 
-class SalesInvoiceItemSerializer(serializers.ModelSerializer):
+class SalesInvoiceItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['product']
 
     product = SimpleProductSerializer(read_only=True)
 
@@ -317,7 +336,9 @@ class SalesInvoiceItemSerializer(serializers.ModelSerializer):
         return instance
 
 
-class SimpleSalesInvoiceItemSerializer(serializers.ModelSerializer):
+class SimpleSalesInvoiceItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['product']
 
     product = SimpleProductSerializer(read_only=True)
 
@@ -363,8 +384,25 @@ class SalesInvoiceItemUpdateSerializer(serializers.Serializer):
     unit_price = serializers.FloatField()
     quantity_received = serializers.IntegerField(default=True)
 
+    def validate(self, attrs):
+        if self.instance.sales_invoice.status not in OPEN_SALES_STATUSES:
+            return super().validate(attrs)
+
+        # what the line already holds counts as available
+        reserved = dict(
+            SalesReservation.objects
+            .filter(sales_invoice_item=self.instance)
+            .values_list('sales_invoice_item__product_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        )
+        checkSalesInvoiceItemsStock(
+            self.context['business_id'], [{**attrs, 'product_id': self.instance.product_id}], reserved
+        )
+        return super().validate(attrs)
+
     def update(self, instance, validated_data):
-        
+
         for attr, value in self.validated_data.items():
             setattr(instance, attr, value)
 
@@ -372,7 +410,10 @@ class SalesInvoiceItemUpdateSerializer(serializers.Serializer):
         return instance
 
 
-class SalesInvoiceSerializer(serializers.ModelSerializer):
+class SalesInvoiceSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['customer__city']
+    prefetch_related = ['invoice_items__product']
 
     invoice_items = SimpleSalesInvoiceItemSerializer(many=True, read_only=True)
     customer = SimpleCustomerSerializer(read_only=True)
@@ -386,13 +427,18 @@ class SalesInvoiceSerializer(serializers.ModelSerializer):
         ]
 
 
-class SimpleSalesInvoiceSerializer(serializers.ModelSerializer):
+class SimpleSalesInvoiceSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['customer__city']
+    annotations = {'total_items_count': Count('invoice_items')}
 
     customer = SimpleCustomerSerializer(read_only=True)
     total_items = serializers.SerializerMethodField()
 
     def get_total_items(self, obj):
-
+        count = getattr(obj, 'total_items_count', None)
+        if count is not None:
+            return count
         return len(obj.invoice_items.all())
 
     class Meta:
@@ -510,19 +556,41 @@ class RestockSerializer(serializers.Serializer):
                 'location', 'quantity', 'quantity_on_hand',
                 'unit_cost', 'notes'
             ])
+            restocked = new_inventory_items + list(inventory_items)
+            StockMovement.objects.record(
+                'P', PurchaseInvoice(pk=self.context['purchase_invoice_id']),
+                {item: invoice_items_map[item.product_id].quantity for item in restocked}
+            )
+            SearchDocument.objects.index(restocked)
+            Inventory.objects.refresh_glance(pk=self.context['inventory_id'])
 
         return True
     
 
+class SalesInvoiceLineSerializer(serializers.Serializer):
+    """
+    One line of the items list of the create/update-with-items endpoints;
+    `id` picks the line to update, new lines leave it out.
+    """
+    id = serializers.IntegerField(default=None, allow_null=True)
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    unit_price = serializers.FloatField()
+
+
 class SalesInvoiceAndItemsCreateSerializer(serializers.ModelSerializer):
     
-    items = serializers.ListField()
+    items = serializers.ListField(child=SalesInvoiceLineSerializer())
+
+    def validate_items(self, items):
+        checkSalesInvoiceItemsStock(self.context['business_id'], items)
+        return items
 
     def save(self, **kwargs):
         items = self.validated_data.pop('items')
 
         try:
-            with transaction.atomic():
+            with deferred_totals():
                 sales_invoice = SalesInvoice.objects.create(
                     business_id = self.context['business_id'],
                     created_by_id = self.context['user_id'],
@@ -538,12 +606,16 @@ class SalesInvoiceAndItemsCreateSerializer(serializers.ModelSerializer):
                     unit_price = item['unit_price']
                 ) for item in items]
                 invoice_items = SalesInvoiceItem.objects.bulk_create(invoice_items)
-            
-            sales_invoice.refresh_from_db()
-            sales_invoice.adjust_totals()
-            updateInventoryOnSale(sales_invoice) ### No need to call this, it's called in adjust_totals.
+                SearchDocument.objects.index(invoice_items)
+                adjust_totals_later(sales_invoice)
+                # a stock shortfall rolls the whole invoice back
+                updateInventoryOnSale(sales_invoice)
+
             return sales_invoice
         
+        except serializers.ValidationError:
+            raise
+
         except Exception as error:
             print(error)
             return None
@@ -567,68 +639,77 @@ class SalesInvoiceAndItemsCreateSerializer(serializers.ModelSerializer):
 class SalesInvoiceAndItemsUpdateSerializer(serializers.ModelSerializer):
     
 
-    items = serializers.ListField()
+    items = serializers.ListField(child=SalesInvoiceLineSerializer())
+
+    def validate_items(self, items):
+        reserved = dict(
+            SalesReservation.objects
+            .filter(sales_invoice=self.instance)
+            .values_list('sales_invoice_item__product_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        )
+        checkSalesInvoiceItemsStock(self.context['business_id'], items, reserved)
+        return items
 
     def save(self, **kwargs):
         items = self.validated_data.pop('items')
 
         try:
-            # with transaction.atomic():
-            for attr, value in self.validated_data.items():
-                setattr(self.instance, attr, value)
-            self.instance.save()
+            with deferred_totals():
+                existing_items = SalesInvoiceItem.objects.filter(
+                    sales_invoice_id = self.instance.id
+                )
+                existing_items_map = {
+                    item.id: item for item in existing_items
+                }
+                existing_item_ids = set(existing_items.values_list('id', flat=True))
 
-            existing_items = SalesInvoiceItem.objects.filter(
-                sales_invoice_id = self.instance.id
-            )
-            existing_items_map = {
-                item.id: item for item in existing_items
-            }
-            existing_item_ids = set(existing_items.values_list('id', flat=True))
-
-            new_items = []
-            updated_items = []
-
-            for item in items:
-                print(item)
-                if item['id'] in existing_item_ids:
-                    invoice_item = existing_items_map.get(item['id'])
-                    invoice_item.product_id = item['product_id']
-                    invoice_item.quantity = item['quantity']
-                    invoice_item.unit_price = item['unit_price']
-                    updated_items.append(invoice_item)
-                else:
-                    new_items.append(SalesInvoiceItem(
-                        business_id = self.context['business_id'],
-                        sales_invoice = self.instance,
-                        product_id = item['product_id'],
-                        quantity = item['quantity'],
-                        unit_price = item['unit_price']
-                    ))
-
-            if new_items:
-                print("Creating new items:", new_items)
-                for item in new_items:
-                    for attr, value in item.__dict__.items():
-                        print(f"{attr}: {value}")
-
-                new_items = SalesInvoiceItem.objects.bulk_create(new_items)
-            
-            if updated_items:
-                SalesInvoiceItem.objects.bulk_update(updated_items, [
-                    'product', 'quantity', 'unit_price'
-                ])
-
-            updated_ids = [item.id for item in updated_items]
-            new_ids = [item.id for item in new_items]
-            existing_items = existing_items.exclude(id__in=updated_ids+new_ids,)
-            existing_items.delete()
+                new_items = []
+                updated_items = []
+
+                for item in items:
+                    if item['id'] in existing_item_ids:
+                        invoice_item = existing_items_map.get(item['id'])
+                        invoice_item.product_id = item['product_id']
+                        invoice_item.quantity = item['quantity']
+                        invoice_item.unit_price = item['unit_price']
+                        updated_items.append(invoice_item)
+                    else:
+                        new_items.append(SalesInvoiceItem(
+                            business_id = self.context['business_id'],
+                            sales_invoice = self.instance,
+                            product_id = item['product_id'],
+                            quantity = item['quantity'],
+                            unit_price = item['unit_price']
+                        ))
+
+                # the dropped lines go first, so a new or updated line may
+                # take over their product (one line per product)
+                existing_items.exclude(id__in=[item.id for item in updated_items]).delete()
+
+                if updated_items:
+                    SalesInvoiceItem.objects.bulk_update(updated_items, [
+                        'product', 'quantity', 'unit_price'
+                    ])
+
+                if new_items:
+                    new_items = SalesInvoiceItem.objects.bulk_create(new_items)
+
+                SearchDocument.objects.index(new_items + updated_items)
             
-            self.instance.refresh_from_db()
-            self.instance.adjust_totals()
-            updateInventoryOnSale(self.instance)
+                adjust_totals_later(self.instance)
+
+                # saved last, so the stock is posted for the new lines
+                for attr, value in self.validated_data.items():
+                    setattr(self.instance, attr, value)
+                self.instance.save()
+
             return self.instance
         
+        except serializers.ValidationError:
+            raise
+
         except Exception as error:
             print(error)
             return None
@@ -649,7 +730,10 @@ class SalesInvoiceAndItemsUpdateSerializer(serializers.ModelSerializer):
         ]
 
 
-class ReturnedItemSerializer(serializers.ModelSerializer):
+class ReturnedItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+
+    select_related = ['invoice_item__product', 'invoice_item__sales_invoice__customer__city']
+    prefetch_related = ['invoice_item__sales_invoice__invoice_items']
 
     invoice_item = CompleteSalesInvoiceItemSerializer(read_only=True)
 
@@ -1,12 +1,11 @@
-from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
-from root.utils import generateTransactionId
-from .models import PurchaseInvoice, PurchaseInvoiceItem, SalesInvoice, SalesInvoiceItem, ReturnedItem
-from .utils import (
-    getRestockField, update_inventory, spiltNewAndOldProducts, 
-    logRestockEvent, createInventoryItemFromRestock
-)
+from root.models import DailyRollup
+from root.utils import run_batched
+from .models import PurchaseInvoice, PurchaseInvoiceItem, SalesInvoice, SalesInvoiceItem, SalesReservation, ReturnedItem
+from .utils import adjust_totals_later, releaseSalesReservations, updateInventoryOnPurchase
 
 
 ### update invoice totals
@@ -14,41 +13,53 @@ from .utils import (
 @receiver(post_delete, sender=SalesInvoiceItem)
 def updateTotalsAfterSalesInvoiceItem(sender, instance, **kwargs):
     if instance.sales_invoice:
-        instance.sales_invoice.adjust_totals()
+        adjust_totals_later(instance.sales_invoice)
 
 
-### automatically update inventory on purchase
-@receiver(post_save, sender=PurchaseInvoice)
-def updateInventoryOnPurchase(sender, instance: PurchaseInvoice, **kwargs):
-    if instance.is_restocked: return
+### keep the daily rollup in step with invoices and returns
+@receiver(post_save, sender=SalesInvoice)
+@receiver(post_delete, sender=SalesInvoice)
+def refreshDailyRollupAfterSalesInvoice(sender, instance: SalesInvoice, **kwargs):
+    run_batched(
+        DailyRollup.objects.refresh,
+        instance.business_id, timezone.localdate(instance.created_at),
+        SalesInvoice.objects, SalesInvoiceItem.objects
+    )
 
-    if instance.status in ('R', 'PR'):
-        
-        if instance.status == 'R' and not instance.is_restocked:
-            quantity_field = getRestockField(False)
-        else:
-            quantity_field = getRestockField(True)
 
-        product_item_mapping = instance.map_to_products()
-        product_ids = set(product_item_mapping)
-        existing, _, new_ids = spiltNewAndOldProducts(product_ids, instance.business.id)
+@receiver(post_delete, sender=SalesInvoiceItem)
+def refreshDailyRollupAfterSalesInvoiceItem(sender, instance: SalesInvoiceItem, **kwargs):
+    run_batched(
+        DailyRollup.objects.refresh,
+        instance.business_id, timezone.localdate(instance.sales_invoice.created_at),
+        SalesInvoiceItem.objects
+    )
 
-        for inventory_item in existing:
-            item = product_item_mapping[inventory_item.product_id]
-            morphed_item = item.morph()
-            delta = item.compute_restock_delta()
-            if delta > 0:
-                inventory_item.apply_restock_delta(False, delta, morphed_item['last_transaction'])
-                logRestockEvent(item, delta, instance)
-                item.update_restock_flags()
 
-        for pid in new_ids:
-            item = product_item_mapping[pid]
-            inventory_item = createInventoryItemFromRestock(item, quantity_field)
-            logRestockEvent(item, getattr(item, quantity_field), instance)
-            item.update_restock_flags()
+@receiver(post_save, sender=PurchaseInvoice)
+@receiver(post_delete, sender=PurchaseInvoice)
+def refreshDailyRollupAfterPurchaseInvoice(sender, instance: PurchaseInvoice, **kwargs):
+    run_batched(
+        DailyRollup.objects.refresh,
+        instance.business_id, timezone.localdate(instance.created_at),
+        PurchaseInvoice.objects
+    )
+
 
-        instance.update_restock_flags()
+@receiver(post_save, sender=ReturnedItem)
+@receiver(post_delete, sender=ReturnedItem)
+def refreshDailyRollupAfterReturnedItem(sender, instance: ReturnedItem, **kwargs):
+    run_batched(
+        DailyRollup.objects.refresh,
+        instance.business_id, timezone.localdate(instance.created_at),
+        ReturnedItem.objects
+    )
+
+
+### automatically update inventory on purchase
+@receiver(post_save, sender=PurchaseInvoice)
+def updateStockAfterPurchaseInvoice(sender, instance: PurchaseInvoice, **kwargs):
+    updateInventoryOnPurchase(instance)
 
 
 ### update invoice totals
@@ -56,35 +67,20 @@ def updateInventoryOnPurchase(sender, instance: PurchaseInvoice, **kwargs):
 @receiver(post_delete, sender=PurchaseInvoiceItem)
 def updateTotalsAfterPurchaseInvoiceItem(sender, instance, **kwargs):
     if instance.purchase_invoice:
-        instance.purchase_invoice.adjust_totals()
+        adjust_totals_later(instance.purchase_invoice)
 
-### Create delete signal
-### automatically update inventory on sale
-@receiver(post_save, sender=SalesInvoice)
-def updateInventoryOnSale(sender, instance: SalesInvoice, **kwargs):
-    if instance.is_deducted: return
-
-    if instance.status in ('C', 'PC'):
-
-        if instance.status == 'C' and not instance.is_deducted:
-            quantity_field = getRestockField(False)
-        else:
-            quantity_field = getRestockField(True)
-
-        invoice_items_dict = instance.map_to_products()
-        product_ids = set(invoice_items_dict)
-        existing, _, new_ids = spiltNewAndOldProducts(product_ids, instance.business.id)
-
-        for inventory_item in existing:
-            item = invoice_items_dict[inventory_item.product_id]
-            delta = item.compute_restock_delta()
-            if delta > 0:
-                inventory_item.apply_restock_delta(True, delta, generateTransactionId(instance))
-                logRestockEvent(item, delta, instance)
-                item.update_restock_flags()
-
-        ### Fix logic here
-        instance.update_deduction_flags()
+### invoices and their lines reserve stock as they are saved, see
+### SalesInvoice.save() and SalesInvoiceItem.save()
+
+### pre_delete: the reservations are still there to be released
+@receiver(pre_delete, sender=SalesInvoice)
+def releaseStockBeforeSalesInvoiceDelete(sender, instance: SalesInvoice, **kwargs):
+    releaseSalesReservations(SalesReservation.objects.filter(sales_invoice=instance))
+
+
+@receiver(pre_delete, sender=SalesInvoiceItem)
+def releaseStockBeforeSalesInvoiceItemDelete(sender, instance: SalesInvoiceItem, **kwargs):
+    releaseSalesReservations(SalesReservation.objects.filter(sales_invoice_item=instance))
 
 
 @receiver(post_save, sender=ReturnedItem)
@@ -1,3 +1,633 @@
-from django.test import TestCase
+import io
+import tracemalloc
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from core.models import User
+from root.models import Business, City, Customer, Job, Product, Supplier, Unit
+from inventory.models import InventoryItem
+from .models import (
+    PurchaseInvoice, PurchaseInvoiceItem, PurchaseInvoiceItemRestock,
+    ReturnedItem, SalesInvoice, SalesInvoiceItem, SalesReservation
+)
+from .printing import invoiceContext, printableInvoices
+from .serializers import SalesInvoiceAndItemsCreateSerializer
+from .utils import checkSalesInvoiceItemsStock, deferred_totals
+
+
+class SalesAggregateBenchmarkTests(TestCase):
+    """
+    average_order_value() and total_items_sold() must be single SQL
+    aggregates: one query, and Python memory that does not grow with the
+    number of invoices.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        cls.customer = Customer.objects.create(
+            name='Customer', business=cls.business,
+            city=City.objects.create(name='City', postal_code='0')
+        )
+        cls.product = Product.objects.create(
+            business=cls.business, name='Product', unit=Unit.objects.create(name='pcs')
+        )
+
+    def seed(self, count):
+        invoices = SalesInvoice.objects.bulk_create([
+            SalesInvoice(
+                business=self.business, customer=self.customer,
+                created_by=self.user, total=100.0
+            ) for _ in range(count)
+        ])
+        SalesInvoiceItem.objects.bulk_create([
+            SalesInvoiceItem(
+                business=self.business, product=self.product,
+                sales_invoice=invoice, quantity=2, unit_price=50.0
+            ) for invoice in invoices
+        ])
+
+    def measure(self, func):
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            result = func(self.business.id)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, len(queries), peak
+
+    def test_average_order_value_without_invoices(self):
+        self.assertEqual(SalesInvoice.objects.average_order_value(self.business.id), 0)
+
+    def test_aggregates_use_constant_queries_and_memory(self):
+        self.seed(50)
+        small = {
+            'aov': self.measure(SalesInvoice.objects.average_order_value),
+            'items': self.measure(SalesInvoiceItem.objects.total_items_sold),
+        }
+
+        self.seed(2000)
+        large = {
+            'aov': self.measure(SalesInvoice.objects.average_order_value),
+            'items': self.measure(SalesInvoiceItem.objects.total_items_sold),
+        }
+
+        self.assertEqual(large['aov'][0], 100)
+        self.assertEqual(large['items'][0], 2 * 2050)
+
+        for key in ('aov', 'items'):
+            _, small_queries, small_peak = small[key]
+            _, large_queries, large_peak = large[key]
+            self.assertEqual(small_queries, 1)
+            self.assertEqual(large_queries, 1)
+            # 41x the rows, same footprint give or take allocator noise.
+            self.assertLess(large_peak, small_peak * 2 + 16 * 1024)
+
+
+class InvoiceListQueryCountTests(TestCase):
+    """
+    List endpoints apply their serializer's eager loading plan, so the
+    number of queries does not depend on how many rows are returned.
+    """
+
+    # each count includes the active business and its config, resolved
+    # per request, and the collection versions read for the ETag
+    ENDPOINTS = {
+        '/sales-invoices/': 4,
+        '/purchase-invoices/': 4,
+        '/returned-items/': 5,
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner@example.com', 'password')
+        self.business = Business.objects.create(name='Shop', owner=self.user, phone='0', is_active=True)
+        self.customer = Customer.objects.create(
+            name='Customer', business=self.business,
+            city=City.objects.create(name='City', postal_code='0')
+        )
+        self.supplier = Supplier.objects.create(name='Supplier', business=self.business)
+        unit = Unit.objects.create(name='pcs')
+        self.products = [
+            Product.objects.create(business=self.business, name=f'Product {i}', unit=unit)
+            for i in range(3)
+        ]
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def seed(self, count):
+        for _ in range(count):
+            sales_invoice = SalesInvoice.objects.create(
+                business=self.business, customer=self.customer, created_by=self.user
+            )
+            purchase_invoice = PurchaseInvoice.objects.create(
+                business=self.business, supplier=self.supplier, created_by=self.user
+            )
+            for product in self.products:
+                sales_item = SalesInvoiceItem.objects.create(
+                    business=self.business, product=product, sales_invoice=sales_invoice,
+                    quantity=1, unit_price=10.0
+                )
+                PurchaseInvoiceItem.objects.create(
+                    business=self.business, product=product, purchase_invoice=purchase_invoice,
+                    quantity=1, unit_cost=5.0
+                )
+            ReturnedItem.objects.create(business=self.business, invoice_item=sales_item)
+
+    def test_list_query_count_is_independent_of_size(self):
+        for count in (2, 10):
+            self.seed(count)
+            for url, queries in self.ENDPOINTS.items():
+                with self.subTest(url=url, invoices=count), self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_total_items_is_annotated(self):
+        self.seed(1)
+        response = self.client.get('/sales-invoices/')
+        self.assertEqual(response.json()['results'][0]['total_items'], len(self.products))
+
+    def test_export_streams_the_filtered_rows(self):
+        self.seed(3)
+        SalesInvoice.objects.filter(pk=SalesInvoice.objects.first().pk).update(status='C')
+
+        # the active business and its config, then the export itself
+        with self.assertNumQueries(4):
+            response = self.client.get('/sales-invoices/export/?status=C')
+            rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(len(rows), 1 + 1)
+        self.assertTrue(rows[0].startswith('id,invoice_number,'))
+
+        response = self.client.get('/sales-invoices/export-items/?status=C')
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 1 + len(self.products))
+
+    def test_rendered_invoice_is_cached_by_content(self):
+        self.seed(1)
+        invoice = SalesInvoice.objects.get()
+        url = f'/sales-invoices/{invoice.pk}/render-invoice/'
+
+        response = self.client.get(url)
+        self.assertContains(response, 'Product 0')
+        etag = response['ETag']
+
+        with mock.patch('sales.printing.get_template') as get_template:
+            self.assertEqual(self.client.get(url).content, response.content)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            get_template.assert_not_called()
+
+        SalesInvoiceItem.objects.filter(sales_invoice=invoice).update(unit_price=99.0)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_item_discounts_are_printed_like_the_totals(self):
+        self.seed(1)
+        invoice = SalesInvoice.objects.get()
+        item = invoice.invoice_items.order_by('id').first()
+        item.discount = {'type': 'percentage', 'value': 10}
+        item.save()
+        invoice.refresh_from_db()
+
+        context = invoiceContext(printableInvoices().get(pk=invoice.pk))['invoice']
+        self.assertEqual((context['items'][0]['discount'], context['items'][0]['total']), (1.0, 9.0))
+        self.assertEqual(context['discount_amount'], 1.0)
+        self.assertTrue(context['discount'])
+        self.assertAlmostEqual(context['subtotal'] - context['discount_amount'], context['net_amount'])
+
+        # the invoice's own discount replaces the item ones
+        invoice.discount = {'type': 'amount', 'value': 5}
+        invoice.save()
+        invoice.adjust_totals()
+        context = invoiceContext(printableInvoices().get(pk=invoice.pk))['invoice']
+        self.assertEqual((context['items'][0]['discount'], context['items'][0]['total']), (0, 10.0))
+        self.assertEqual(context['discount_amount'], 5.0)
+        self.assertAlmostEqual(context['subtotal'] - 5.0, context['net_amount'])
+
+    def test_invoices_render_into_one_archive(self):
+        self.seed(3)
+
+        response = self.client.get('/sales-invoices/render-invoices/')
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(response.content)).namelist()), 3)
+
+
+class DeferredTotalsTests(TestCase):
+    """
+    Item saves inside deferred_totals() recompute the invoice totals once,
+    when the block commits, and bulk created items are included.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        cls.customer = Customer.objects.create(
+            name='Customer', business=cls.business,
+            city=City.objects.create(name='City', postal_code='0')
+        )
+        unit = Unit.objects.create(name='pcs')
+        cls.products = [
+            Product.objects.create(business=cls.business, name=f'Product {i}', unit=unit)
+            for i in range(5)
+        ]
+
+    def test_totals_are_recomputed_once_per_invoice(self):
+        invoice = SalesInvoice.objects.create(
+            business=self.business, customer=self.customer, created_by=self.user,
+            tax={'type': 'percentage', 'value': 10}
+        )
+
+        with mock.patch.object(SalesInvoice, 'adjust_totals', autospec=True,
+                               side_effect=SalesInvoice.adjust_totals) as adjust_totals:
+            with deferred_totals():
+                for product in self.products:
+                    SalesInvoiceItem.objects.create(
+                        business=self.business, sales_invoice=invoice,
+                        product=product, quantity=2, unit_price=10.0
+                    )
+
+        self.assertEqual(adjust_totals.call_count, 1)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.sub_total, 100.0)
+        self.assertAlmostEqual(invoice.total, 110.0)
+
+    def test_create_with_items_totals_include_bulk_created_items(self):
+        InventoryItem.objects.bulk_create([
+            InventoryItem(
+                business=self.business, inventory=self.business.inventory_glance,
+                product=product, quantity=1, quantity_on_hand=1
+            ) for product in self.products
+        ])
+        serializer = SalesInvoiceAndItemsCreateSerializer(data={
+            'customer': self.customer.id,
+            'items': [
+                {'product_id': product.id, 'quantity': 1, 'unit_price': 25.0}
+                for product in self.products
+            ],
+        }, context={'business_id': self.business.id, 'user_id': self.user.id})
+        serializer.is_valid(raise_exception=True)
+        invoice = serializer.save()
+
+        self.assertEqual(SalesInvoice.objects.get(pk=invoice.pk).total, 125.0)
+
+
+class PurchaseReceiptPostingTests(TestCase):
+    """
+    Receiving a purchase invoice posts every line with a query count that
+    does not depend on the number of lines.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        cls.supplier = Supplier.objects.create(name='Supplier', business=cls.business)
+        unit = Unit.objects.create(name='pcs')
+        cls.products = Product.objects.bulk_create([
+            Product(business=cls.business, name=f'Product {i}', unit=unit) for i in range(40)
+        ])
+        # half of the products are already stocked
+        InventoryItem.objects.bulk_create([
+            InventoryItem(
+                business=cls.business, inventory=cls.business.inventory_glance,
+                product=product, quantity=5, quantity_on_hand=5
+            ) for product in cls.products[::2]
+        ])
+
+    def receive(self, lines):
+        invoice = PurchaseInvoice.objects.create(
+            business=self.business, supplier=self.supplier, created_by=self.user, status='D'
+        )
+        PurchaseInvoiceItem.objects.bulk_create([
+            PurchaseInvoiceItem(
+                business=self.business, purchase_invoice=invoice, product=product,
+                quantity=10, quantity_received=10, unit_cost=2.0
+            ) for product in self.products[:lines]
+        ])
+
+        invoice.status = 'R'
+        with CaptureQueriesContext(connection) as queries:
+            invoice.save()
+        return invoice, len(queries)
+
+    def test_query_count_is_independent_of_lines(self):
+        _, small = self.receive(4)
+        _, large = self.receive(40)
+        self.assertEqual(small, large)
+
+    def test_stock_and_flags_are_posted_once(self):
+        invoice, _ = self.receive(4)
+        invoice.save()
+
+        self.assertEqual(InventoryItem.objects.get(product=self.products[0]).quantity_on_hand, 15)
+        self.assertEqual(InventoryItem.objects.get(product=self.products[1]).quantity_on_hand, 10)
+        self.assertEqual(PurchaseInvoiceItemRestock.objects.filter(purchase_invoice=invoice).count(), 4)
+        self.assertTrue(PurchaseInvoice.objects.get(pk=invoice.pk).is_restocked)
+
+
+class SalesDeductionTests(TestCase):
+    """
+    Completing a sales invoice deducts stock with conditional updates:
+    all lines or none, and never below zero.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        cls.customer = Customer.objects.create(
+            name='Customer', business=cls.business,
+            city=City.objects.create(name='City', postal_code='0')
+        )
+        unit = Unit.objects.create(name='pcs')
+        cls.products = Product.objects.bulk_create([
+            Product(business=cls.business, name=f'Product {i}', unit=unit) for i in range(20)
+        ])
+
+    def setUp(self):
+        InventoryItem.objects.bulk_create([
+            InventoryItem(
+                business=self.business, inventory=self.business.inventory_glance,
+                product=product, quantity=5, quantity_on_hand=5
+            ) for product in self.products
+        ])
+
+    def complete(self, lines, quantity=2):
+        invoice = SalesInvoice.objects.create(
+            business=self.business, customer=self.customer, created_by=self.user, status='D'
+        )
+        SalesInvoiceItem.objects.bulk_create([
+            SalesInvoiceItem(
+                business=self.business, sales_invoice=invoice, product=product,
+                quantity=quantity, quantity_received=quantity, unit_price=1.0
+            ) for product in self.products[:lines]
+        ])
+
+        invoice.status = 'C'
+        with CaptureQueriesContext(connection) as queries:
+            invoice.save()
+        return invoice, len(queries)
+
+    def test_query_count_is_independent_of_lines(self):
+        _, small = self.complete(2)
+        _, large = self.complete(20)
+        self.assertEqual(small, large)
+
+    def test_shortfall_deducts_nothing(self):
+        self.complete(1, quantity=4)
+
+        with self.assertRaises(ValidationError) as error:
+            self.complete(3, quantity=2)
+
+        self.assertEqual(
+            [line['product'] for line in error.exception.detail['shortfalls']],
+            [str(self.products[0].id)]
+        )
+        self.assertEqual(
+            list(InventoryItem.objects.filter(product__in=self.products[:3])
+                 .order_by('product_id').values_list('quantity_on_hand', flat=True)),
+            [1, 5, 5]
+        )
+
+    def test_shortfall_through_the_api_keeps_the_status(self):
+        invoice = SalesInvoice.objects.create(
+            business=self.business, customer=self.customer, created_by=self.user, status='S'
+        )
+        # bulk_create: the lines are not reserved, as if the stock was sold since
+        SalesInvoiceItem.objects.bulk_create([SalesInvoiceItem(
+            business=self.business, sales_invoice=invoice, product=self.products[0],
+            quantity=8, quantity_received=8, unit_price=1.0
+        )])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(f'/sales-invoices/{invoice.id}/', {'status': 'C'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.status, invoice.is_deducted), ('S', False))
+        self.assertEqual(InventoryItem.objects.get(product=self.products[0]).quantity_on_hand, 5)
+
+        InventoryItem.objects.filter(product=self.products[0]).update(quantity_on_hand=10)
+        response = client.patch(f'/sales-invoices/{invoice.id}/', {'status': 'C'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.status, invoice.is_deducted), ('C', True))
+        self.assertEqual(InventoryItem.objects.get(product=self.products[0]).quantity_on_hand, 2)
+
+    @override_settings(JOB_QUEUE={'BACKGROUND_POSTING': True})
+    def test_background_posting_is_left_to_the_worker(self):
+        invoice, _ = self.complete(2)
+        invoice.save()
+
+        self.assertFalse(SalesInvoice.objects.get(pk=invoice.pk).is_deducted)
+        [job] = Job.objects.claim('worker')
+        self.assertTrue(job.run())
+
+        self.assertTrue(SalesInvoice.objects.get(pk=invoice.pk).is_deducted)
+        self.assertEqual(
+            list(InventoryItem.objects.filter(product__in=self.products[:2]).values_list('quantity_on_hand', flat=True)),
+            [3, 3]
+        )
+
+
+class SalesReservationTests(TestCase):
+    """
+    Open invoices hold stock through reservations, which are released on
+    cancel and converted on completion.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        cls.customer = Customer.objects.create(
+            name='Customer', business=cls.business,
+            city=City.objects.create(name='City', postal_code='0')
+        )
+        cls.product = Product.objects.create(
+            business=cls.business, name='Product', unit=Unit.objects.create(name='pcs')
+        )
+
+    def setUp(self):
+        InventoryItem.objects.create(
+            business=self.business, inventory=self.business.inventory_glance,
+            product=self.product, quantity=5, quantity_on_hand=5
+        )
+
+    def invoice(self, quantity, status='D'):
+        invoice = SalesInvoice.objects.create(
+            business=self.business, customer=self.customer, created_by=self.user, status=status
+        )
+        SalesInvoiceItem.objects.create(
+            business=self.business, sales_invoice=invoice, product=self.product,
+            quantity=quantity, quantity_received=quantity, unit_price=1.0
+        )
+        return invoice
+
+    def available(self):
+        return InventoryItem.objects.available_to_promise(self.business.id)[self.product.id]
+
+    def test_reserve_release_and_convert(self):
+        invoice = self.invoice(3)
+        self.assertEqual(self.available(), 2)
+
+        with self.assertRaises(ValidationError):
+            self.invoice(3)
+
+        invoice.status = 'X'
+        invoice.save()
+        self.assertEqual(self.available(), 5)
+
+        invoice.status = 'S'
+        invoice.save()
+        invoice.status = 'C'
+        invoice.save()
+
+        item = InventoryItem.objects.get(product=self.product)
+        self.assertEqual((item.quantity_on_hand, item.quantity_reserved), (2, 0))
+        self.assertFalse(SalesReservation.objects.exists())
+
+    def test_deleting_an_open_invoice_releases_its_stock(self):
+        self.invoice(4).delete()
+        self.assertEqual(self.available(), 5)
+
+    def test_a_line_above_stock_is_not_written(self):
+        with self.assertRaises(ValidationError):
+            self.invoice(6)
+        self.assertFalse(SalesInvoiceItem.objects.exists())
+        self.assertEqual(self.available(), 5)
+
+        item = self.invoice(3).invoice_items.get()
+        item.quantity = 4
+        item.save()
+        self.assertEqual(self.available(), 1)
+
+        item.quantity = 6
+        with self.assertRaises(ValidationError):
+            item.save()
+        self.assertEqual(SalesInvoiceItem.objects.get().quantity, 4)
+        self.assertEqual(SalesReservation.objects.get().quantity, 4)
+        self.assertEqual(self.available(), 1)
+
+    def test_a_line_update_above_stock_is_a_bad_request(self):
+        item = self.invoice(3).invoice_items.get()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = f'/sales-invoices/{item.sales_invoice_id}/items/{item.id}/'
+
+        response = client.patch(url, {'quantity': 6, 'unit_price': 1.0}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(SalesInvoiceItem.objects.get().quantity, 3)
+
+        response = client.patch(url, {'quantity': 5, 'unit_price': 1.0}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.available(), 0)
+
+
+class SalesInvoiceStockValidationTests(TestCase):
+    """
+    checkSalesInvoiceItemsStock() checks every line with one query and
+    reports all shortfalls together.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner@example.com', 'password')
+        cls.business = Business.objects.create(name='Shop', owner=cls.user, phone='0', is_active=True)
+        unit = Unit.objects.create(name='pcs')
+        cls.products = Product.objects.bulk_create([
+            Product(business=cls.business, name=f'Product {i}', unit=unit) for i in range(3)
+        ])
+        InventoryItem.objects.bulk_create([
+            InventoryItem(
+                business=cls.business, inventory=cls.business.inventory_glance,
+                product=product, quantity=5, quantity_on_hand=5
+            ) for product in cls.products[:2]
+        ])
+
+    def test_all_shortfalls_are_reported(self):
+        first, second, unstocked = self.products
+        lines = [
+            {'product_id': first.id, 'quantity': 6, 'unit_price': 1.0},
+            {'product_id': second.id, 'quantity': 5, 'unit_price': 1.0},
+            {'product_id': unstocked.id, 'quantity': 1, 'unit_price': 1.0},
+        ]
+
+        with self.assertNumQueries(1), self.assertRaises(ValidationError) as error:
+            checkSalesInvoiceItemsStock(self.business.id, lines)
+
+        self.assertEqual(
+            [int(line['line']) for line in error.exception.detail['shortfalls']], [0, 2]
+        )
+
+    def test_duplicate_product_lines_are_a_bad_request(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        customer = Customer.objects.create(
+            name='Customer', business=self.business, city=City.objects.create(name='City', postal_code='0')
+        )
+        line = {'product_id': self.products[0].id, 'quantity': 1, 'unit_price': 1.0}
+
+        response = client.post('/sales-invoices/create-with-items/', {
+            'customer': customer.id, 'items': [line, {**line, 'quantity': 2}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['items'], [
+            {'line': '1', 'product': str(self.products[0].id), 'detail': 'product is already on line 0'}
+        ])
+        self.assertFalse(SalesInvoice.objects.filter(business=self.business).exists())
+
+        # a dropped line's product may be taken over by a new line
+        response = client.post('/sales-invoices/create-with-items/', {
+            'customer': customer.id, 'items': [line],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        invoice = SalesInvoice.objects.get(business=self.business)
+        response = client.post(f'/sales-invoices/{invoice.id}/update-with-items/', {
+            'customer': customer.id, 'items': [{**line, 'quantity': 2}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(invoice.invoice_items.values_list('product_id', 'quantity')), [(self.products[0].id, 2)])
+
+    def test_reserved_stock_counts_as_available(self):
+        lines = [{'product_id': self.products[0].id, 'quantity': 7, 'unit_price': 1.0}]
+        checkSalesInvoiceItemsStock(self.business.id, lines, {self.products[0].id: 2})
+
+    def test_malformed_lines_are_a_bad_request(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        customer = Customer.objects.create(
+            name='Customer', business=self.business, city=City.objects.create(name='City', postal_code='0')
+        )
+
+        for line in (
+            {'product_id': self.products[0].id, 'quantity': 'two', 'unit_price': 1.0},
+            {'quantity': 1, 'unit_price': 1.0},
+            {'product_id': self.products[0].id, 'quantity': 1, 'unit_price': 'free'},
+        ):
+            with self.subTest(line=line):
+                response = client.post('/sales-invoices/create-with-items/', {
+                    'customer': customer.id, 'items': [line],
+                }, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('items', response.json())
+
+        response = client.post('/sales-invoices/create-with-items/', {
+            'customer': customer.id,
+            'items': [{'product_id': str(self.products[0].id), 'quantity': '2', 'unit_price': '1.5'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
@@ -1,5 +1,8 @@
+from django.conf import settings
+from django.urls import path
 from rest_framework_nested.routers import NestedDefaultRouter, DefaultRouter
 from .views import (
+    AsyncMonthlySalesTrendView,
     PurchaseInvoiceItemViewSet, 
     PurchaseInvoiceViewSet,
     PurchasesKPIViewSet,
@@ -25,4 +28,9 @@ purchase_invoice_router.register('items', PurchaseInvoiceItemViewSet, basename='
 sales_invoice_router = NestedDefaultRouter(router, 'sales-invoices', lookup='sales_invoice')
 sales_invoice_router.register('items', SalesInvoiceItemViewSet, basename='sales_invoice_items')
 
-urlpatterns = router.urls + purchase_invoice_router.urls + sales_invoice_router.urls
\ No newline at end of file
+# async twins of the dashboard reads, served in place of the sync ones under ASGI
+async_urlpatterns = [
+    path('sales-kpis/monthly-sales-trend/', AsyncMonthlySalesTrendView.as_view()),
+] if settings.ASYNC_DASHBOARD else []
+
+urlpatterns = async_urlpatterns + router.urls + purchase_invoice_router.urls + sales_invoice_router.urls
\ No newline at end of file
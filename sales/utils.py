@@ -1,13 +1,64 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from django.conf import settings
 from django.db import transaction
 from typing import Dict, Set, Tuple
 from django.db.models import QuerySet
-from django.db.models import Sum
+from django.db.models import Case, CharField, Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
 from rest_framework.exceptions import ValidationError
-from .models import PurchaseInvoiceItem, PurchaseInvoiceItemRestock, SalesInvoice, SalesInvoiceItem, SalesInvoiceItemDeduction
-from inventory.models import InventoryItem
+from .models import PurchaseInvoiceItem, PurchaseInvoiceItemRestock, SalesInvoice, SalesInvoiceItem, SalesInvoiceItemDeduction, SalesReservation
+from inventory.models import Inventory, InventoryItem, StockMovement
 from .models import PurchaseInvoice
 from .models import PurchaseInvoiceItemRestock
-from root.utils import generateTransactionId
+from root.models import CollectionVersion, Job, Location, SearchDocument
+from root.utils import generateTransactionId, run_batched
+
+
+SALES_RESERVATION_TTL = getattr(settings, 'SALES_RESERVATION_TTL', timedelta(days=7))
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_totals():
+    """
+    Run the block in a transaction and coalesce every adjust_totals()
+    requested inside it (see adjust_totals_later) into one recompute per
+    invoice, done as the block commits. Nested blocks join the outer one.
+    """
+    if getattr(_deferred, 'invoices', None) is not None:
+        yield
+        return
+
+    _deferred.invoices = {}
+    try:
+        with transaction.atomic():
+            yield
+            while _deferred.invoices:
+                _, invoice = _deferred.invoices.popitem()
+                try:
+                    invoice.refresh_from_db()
+                except type(invoice).DoesNotExist:
+                    continue    # deleted inside the block
+                invoice.adjust_totals()
+    finally:
+        _deferred.invoices = None
+
+
+def adjust_totals_later(invoice):
+    """
+    Recompute the invoice totals when the surrounding deferred_totals()
+    block commits, or right away outside of one.
+    """
+    invoices = getattr(_deferred, 'invoices', None)
+    if invoices is None:
+        invoice.adjust_totals()
+    else:
+        invoices[(type(invoice), invoice.pk)] = invoice
 
 
 def getRestockField(is_partial: bool) -> str:
@@ -57,6 +108,115 @@ def createInventoryItemFromRestock(item, qty_field: str) -> 'InventoryItem':
             last_transaction = data['last_transaction']
         )
 
+def postPurchaseReceipt(invoice: PurchaseInvoice):
+        """
+        Post what was received on a purchase invoice to inventory. Lines
+        are posted up to `quantity` once the invoice is RECEIVED and up to
+        `quantity_received` while PARTIALLY_RECEIVED, minus what earlier
+        postings already restocked.
+
+        The deltas come from one grouped query and are applied with one
+        UPDATE for the existing inventory rows, one bulk insert each for
+        new inventory rows and restock records, and one UPDATE for the
+        line flags, so the query count does not grow with the lines.
+        """
+        quantity_field = getRestockField(invoice.status != 'R')
+
+        with transaction.atomic():
+            # concurrent postings of the same invoice wait for each other
+            list(PurchaseInvoice.objects.select_for_update().filter(pk=invoice.pk).values_list('pk'))
+
+            items = list(
+                invoice.invoice_items
+                .annotate(restocked=Sum('restocks__quantity', default=0))
+                .order_by()
+            )
+            deltas = {item.id: getattr(item, quantity_field) - item.restocked for item in items}
+            posted = [item for item in items if deltas[item.id] > 0]
+
+            if posted:
+                business_id = invoice.business_id
+                inventory_id = Inventory.objects.filter(business_id=business_id).values_list('id', flat=True).first()
+                location_id = Location.objects.filter(
+                    business_id=business_id, is_default=True
+                ).values_list('id', flat=True).first()
+                existing = dict(InventoryItem.objects.filter(
+                    business_id=business_id, product_id__in=[item.product_id for item in posted]
+                ).values_list('product_id', 'id'))
+
+                updated = [item for item in posted if item.product_id in existing]
+                if updated:
+                    def per_product(value, output_field):
+                        return Case(*[
+                            When(product_id=item.product_id, then=Value(value(item)))
+                            for item in updated
+                        ], output_field=output_field)
+
+                    delta = per_product(lambda item: deltas[item.id], IntegerField())
+                    InventoryItem.objects.filter(
+                        business_id=business_id, product_id__in=[item.product_id for item in updated]
+                    ).update(
+                        quantity=F('quantity') + delta,
+                        quantity_on_hand=F('quantity_on_hand') + delta,
+                        last_transaction=per_product(generateTransactionId, CharField()),
+                    )
+
+                created = InventoryItem.objects.bulk_create([
+                    InventoryItem(
+                        business_id=business_id,
+                        inventory_id=inventory_id,
+                        location_id=location_id,
+                        product_id=item.product_id,
+                        quantity=deltas[item.id],
+                        quantity_on_hand=deltas[item.id],
+                        track_code=item.track_code,
+                        notes=item.notes,
+                        unit_cost=item.unit_cost,
+                        last_transaction=generateTransactionId(item),
+                    ) for item in posted if item.product_id not in existing
+                ])
+
+                PurchaseInvoiceItemRestock.objects.bulk_create([
+                    PurchaseInvoiceItemRestock(
+                        purchase_invoice_id=invoice.id,
+                        purchase_invoice_item_id=item.id,
+                        quantity=deltas[item.id],
+                    ) for item in posted
+                ])
+
+                fully_received = Q(quantity_received__gte=F('quantity'))
+                PurchaseInvoiceItem.objects.filter(pk__in=[item.id for item in posted]).update(
+                    is_restocked=Case(When(fully_received, then=Value(True)), default=Value(False)),
+                    is_partially_restocked=Case(When(fully_received, then=Value(False)), default=Value(True)),
+                )
+
+                item_ids = {**existing, **{row.product_id: row.id for row in created}}
+                received = {}
+                for item in posted:
+                    key = (item_ids[item.product_id], item.product_id, business_id)
+                    received[key] = received.get(key, 0) + deltas[item.id]
+                StockMovement.objects.record('P', invoice, received)
+
+                Inventory.objects.refresh_glance(pk=inventory_id)
+                SearchDocument.objects.index(created)
+
+            lines = invoice.invoice_items.aggregate(
+                total=Count('id'),
+                restocked=Count('id', filter=Q(is_restocked=True)),
+                partially_restocked=Count('id', filter=Q(is_partially_restocked=True)),
+            )
+            if lines['total'] and lines['restocked'] == lines['total']:
+                invoice.is_restocked, invoice.is_partially_restocked, invoice.status = True, False, 'R'
+            elif lines['partially_restocked']:
+                invoice.is_partially_restocked = True
+
+            PurchaseInvoice.objects.filter(pk=invoice.pk).update(
+                is_restocked=invoice.is_restocked,
+                is_partially_restocked=invoice.is_partially_restocked,
+                status=invoice.status,
+            )
+            CollectionVersion.objects.bump(invoice.business_id, 'purchase-invoices')
+
 def update_inventory(instance, is_partially_received):
     updated_invoice_items = []
     restock_objs = []
@@ -177,40 +337,445 @@ def checkPurchaseInvoiceCreateFields(attrs):
     
 def checkSalesInvoiceItemCreateFields(attrs):
 
-    if attrs.get('quantity') <= 0:
-        raise ValidationError("quantity must be greater than 0")
+    product = attrs.get('product')
+    checkSalesInvoiceItemsStock(product.business_id, [{**attrs, 'product_id': product.id}])
+
+
+def checkSalesInvoiceItemsStock(business_id, items, reserved: Dict[int, int] = None):
+    """
+    Validate all lines of a sales invoice at once. Each line needs a
+    positive quantity and unit_price and a product of its own (an invoice
+    holds one line per product); stock is checked with a single
+    available-to-promise read for the business. `reserved`
+    ({product_id: quantity}) is stock the invoice already holds and
+    counts as available.
+
+    Raises one ValidationError with the errors of every offending line.
+    """
+    errors = []
+    requested = {}
+    lines = {}
+    for index, item in enumerate(items):
+        if item.get('product_id') in lines:
+            errors.append({
+                'line': index, 'product': item['product_id'],
+                'detail': f"product is already on line {lines[item['product_id']]}"
+            })
+        elif not item.get('quantity') or item['quantity'] <= 0:
+            errors.append({'line': index, 'product': item.get('product_id'), 'detail': "quantity must be greater than 0"})
+        elif not item.get('unit_price') or item['unit_price'] <= 0:
+            errors.append({'line': index, 'product': item.get('product_id'), 'detail': "unit_price must be greater than 0"})
+        else:
+            requested[item['product_id']] = item['quantity']
+        lines.setdefault(item.get('product_id'), index)
 
-    if attrs.get('unit_price') <= 0:
-        raise ValidationError("unit_price must be greater than 0")
+    if errors:
+        raise ValidationError(errors)
 
-    product_id = attrs.get('product').id
-    if not InventoryItem.objects.filter(product_id=product_id, quantity_on_hand__gte=attrs.get('quantity')).exists():
-        raise ValidationError(f"Insufficient stock.")
-    
-def reserveSalesInvoiceItem(item):
+    reserved = reserved or {}
+    available = InventoryItem.objects.available_to_promise(business_id, list(requested))
+    available = {
+        product_id: available.get(product_id, 0) + reserved.get(product_id, 0)
+        for product_id in requested
+    }
+
+    shortfalls = [
+        {
+            'line': index,
+            'product': item['product_id'],
+            'requested': requested[item['product_id']],
+            'available': available[item['product_id']],
+        }
+        for index, item in enumerate(items)
+        if requested[item['product_id']] > available[item['product_id']]
+    ]
+    if shortfalls:
+        raise ValidationError({'detail': 'Insufficient stock.', 'shortfalls': shortfalls})
+
+
+OPEN_SALES_STATUSES = ('D', 'S', 'O')
+
+
+class StockShortfall(Exception):
     pass
 
-def updateInventoryOnSale(instance: SalesInvoice):
-    if instance.is_deducted: return
 
+def raiseStockShortfall(business_id, requested: Dict[SalesInvoiceItem, int], reserved: Dict[int, int] = None):
+    """
+    Raise one ValidationError listing every line whose request exceeds
+    what is available to promise. `reserved` holds what each line already
+    has reserved, which is counted as available to that line.
+    """
+    reserved = reserved or {}
+    available = InventoryItem.objects.available_to_promise(
+        business_id, [item.product_id for item in requested]
+    )
+
+    raise ValidationError({
+        'detail': 'Insufficient stock.',
+        'shortfalls': [
+            {
+                'invoice_item': item.id,
+                'product': item.product_id,
+                'requested': quantity,
+                'available': available.get(item.product_id, 0) + reserved.get(item.id, 0),
+            }
+            for item, quantity in requested.items()
+            if available.get(item.product_id, 0) + reserved.get(item.id, 0) < quantity
+        ],
+    })
+
+
+def reservedQuantity():
+    return Subquery(
+        SalesReservation.objects
+        .filter(sales_invoice_item_id=OuterRef('pk'))
+        .order_by()
+        .values('sales_invoice_item_id')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+
+
+def deductedQuantity():
+    return Subquery(
+        SalesInvoiceItemDeduction.objects
+        .filter(sales_invoice_item_id=OuterRef('pk'))
+        .order_by()
+        .values('sales_invoice_item_id')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+
+
+def reservationExpiry(invoice: SalesInvoice):
+    if invoice.date_due:
+        return datetime.combine(
+            invoice.date_due, time.max, tzinfo=timezone.get_current_timezone()
+        )
+    return timezone.now() + SALES_RESERVATION_TTL
+
+
+def syncSalesReservations(invoice: SalesInvoice):
+        """
+        Bring the stock reserved for an invoice in line with its status:
+        open invoices (draft, sent, overdue) reserve every line in full,
+        partially completed ones keep what is still to be handed over, and
+        completed or cancelled ones nothing.
+
+        quantity_reserved of all affected inventory rows changes in one
+        UPDATE, with increases guarded by on hand - reserved >= n so stock
+        is never promised twice. Products without an inventory row are not
+        reserved.
+        """
+        business_id = invoice.business_id
+
+        with transaction.atomic():
+            items = list(
+                invoice.invoice_items
+                .annotate(
+                    reserved=Coalesce(reservedQuantity(), 0),
+                    deducted=Coalesce(deductedQuantity(), 0),
+                )
+                .order_by()
+            )
+            stocked = dict(InventoryItem.objects.filter(
+                business_id=business_id, product_id__in=[item.product_id for item in items]
+            ).values_list('product_id', 'id'))
+
+            targets = {}
+            for item in items:
+                if item.product_id not in stocked:
+                    target = 0
+                elif invoice.status in OPEN_SALES_STATUSES:
+                    target = item.quantity
+                elif invoice.status == 'PC':
+                    # completion only ever converts, it never reserves more
+                    target = min(item.reserved, max(item.quantity - item.deducted, 0))
+                else:
+                    target = 0
+                targets[item] = target
+
+            changed = {item: target - item.reserved for item, target in targets.items() if target != item.reserved}
+            if not changed:
+                return
+
+            guard = Q()
+            for item, delta in changed.items():
+                if delta > 0:
+                    guard |= Q(product_id=item.product_id, quantity_on_hand__gte=F('quantity_reserved') + delta)
+                else:
+                    guard |= Q(product_id=item.product_id)
+
+            try:
+                with transaction.atomic():
+                    reserved = InventoryItem.objects.filter(business_id=business_id).filter(guard).update(
+                        quantity_reserved=F('quantity_reserved') + Case(*[
+                            When(product_id=item.product_id, then=Value(delta))
+                            for item, delta in changed.items()
+                        ], output_field=IntegerField())
+                    )
+                    if reserved != len(changed):
+                        raise StockShortfall()
+            except StockShortfall:
+                raiseStockShortfall(
+                    business_id,
+                    {item: targets[item] for item, delta in changed.items() if delta > 0},
+                    {item.id: item.reserved for item in changed},
+                )
+
+            SalesReservation.objects.filter(sales_invoice_item__in=list(changed)).delete()
+            expires_at = reservationExpiry(invoice)
+            SalesReservation.objects.bulk_create([
+                SalesReservation(
+                    sales_invoice_id=invoice.id,
+                    sales_invoice_item_id=item.id,
+                    quantity=targets[item],
+                    expires_at=expires_at,
+                ) for item in changed if targets[item] > 0
+            ])
+
+            Inventory.objects.refresh_glance(business_id=business_id)
+
+
+def reserveSalesInvoiceItem(item: SalesInvoiceItem):
+        """
+        syncSalesReservations() for a single line of an open invoice: what
+        the line holds is moved to its quantity, touching only its own
+        reservation and inventory row (and the one of its former product
+        when the product changed), so saving each of N lines costs the
+        same instead of re-syncing the whole invoice every time.
+
+        Called by SalesInvoiceItem.save() inside its transaction; raises
+        the ValidationError of raiseStockShortfall() when the stock is not
+        there, rolling the line back with it.
+        """
+        invoice = item.sales_invoice
+        if invoice.status not in OPEN_SALES_STATUSES:
+            return
+
+        business_id = item.business_id
+        # the stored product, an existing line being reserved before it is written
+        held = dict(
+            SalesReservation.objects
+            .filter(sales_invoice_item_id=item.pk)
+            .values_list('sales_invoice_item__product_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        ) if item.pk else {}
+
+        deltas = {product_id: -quantity for product_id, quantity in held.items()}
+        deltas[item.product_id] = deltas.get(item.product_id, 0) + item.quantity
+        if not any(deltas.values()):
+            return
+
+        rows = InventoryItem.objects.filter(business_id=business_id)
+        target = item.quantity
+        for product_id, delta in deltas.items():
+            if delta < 0:
+                rows.filter(product_id=product_id).update(quantity_reserved=F('quantity_reserved') + delta)
+            elif delta > 0 and not rows.filter(
+                product_id=product_id, quantity_on_hand__gte=F('quantity_reserved') + delta
+            ).update(quantity_reserved=F('quantity_reserved') + delta):
+                if rows.filter(product_id=product_id).exists():
+                    raiseStockShortfall(business_id, {item: item.quantity}, {item.id: held.get(product_id, 0)})
+                # products without an inventory row are not reserved
+                target = 0
+        if not held and not target:
+            return
+
+        SalesReservation.objects.filter(sales_invoice_item_id=item.pk).delete()
+        if target > 0:
+            SalesReservation.objects.create(
+                sales_invoice_id=invoice.id,
+                sales_invoice_item_id=item.pk,
+                quantity=target,
+                expires_at=reservationExpiry(invoice),
+            )
+
+        run_batched(Inventory.objects.refresh_glance, business_id=business_id)
+
+
+def releaseSalesReservations(reservations: QuerySet):
+        """
+        Give the stock held by `reservations` back and delete them, with
+        one UPDATE for all affected inventory rows. Used when invoices or
+        lines are deleted and when reservations expire.
+        """
+        with transaction.atomic():
+            held = list(
+                reservations
+                .order_by()
+                .values('sales_invoice_item__business_id', 'sales_invoice_item__product_id')
+                .annotate(total=Sum('quantity'))
+            )
+            if not held:
+                return 0
+
+            lines = [
+                (row['sales_invoice_item__business_id'], row['sales_invoice_item__product_id'], row['total'])
+                for row in held
+            ]
+            rows = Q()
+            for business_id, product_id, _ in lines:
+                rows |= Q(business_id=business_id, product_id=product_id)
+
+            InventoryItem.objects.filter(rows).update(
+                quantity_reserved=F('quantity_reserved') - Case(*[
+                    When(business_id=business_id, product_id=product_id, then=Value(total))
+                    for business_id, product_id, total in lines
+                ], output_field=IntegerField())
+            )
+            released, _ = reservations.delete()
+
+            for business_id in {business_id for business_id, _, _ in lines}:
+                Inventory.objects.refresh_glance(business_id=business_id)
+
+        return released
+
+
+def updateInventoryOnSale(instance: SalesInvoice):
     if instance.status in ('C', 'PC'):
+        if not instance.is_deducted:
+            postInventoryLater('sales.utils.runSalesDeduction', instance)
+    else:
+        syncSalesReservations(instance)
 
-        if instance.status == 'C' and not instance.is_deducted:
-            quantity_field = getRestockField(False)
-        else:
-            quantity_field = getRestockField(True)
-
-        invoice_items_dict = instance.map_to_products()
-        product_ids = set(invoice_items_dict)
-        existing, _, new_ids = spiltNewAndOldProducts(product_ids, instance.business.id)
-
-        for inventory_item in existing:
-            item = invoice_items_dict[inventory_item.product_id]
-            delta = item.compute_restock_delta()
-            if delta > 0:
-                inventory_item.apply_restock_delta(True, delta, generateTransactionId(instance))
-                logRestockEvent(item, delta, instance)
-                item.update_restock_flags()
-
-        instance.update_deduction_flags()
-        instance.save()
+
+def updateInventoryOnPurchase(instance: PurchaseInvoice):
+    if instance.status in ('R', 'PR') and not instance.is_restocked:
+        postInventoryLater('sales.utils.runPurchaseReceipt', instance)
+
+
+def postInventoryLater(task: str, invoice):
+    """
+    Run an inventory posting now, or, with JOB_QUEUE['BACKGROUND_POSTING'],
+    queue it for `manage.py run_jobs` so the request returns right away.
+    Postings only apply what is not posted yet, so one queued job per
+    invoice covers any number of saves before it runs.
+    """
+    if not Job.objects.config()['BACKGROUND_POSTING']:
+        return import_string(task)(invoice.pk, invoice)
+
+    Job.objects.enqueue(
+        task, {'invoice_id': invoice.pk},
+        key=f"{task}:{invoice.pk}", business_id=invoice.business_id,
+    )
+
+
+def runPurchaseReceipt(invoice_id: int, invoice: PurchaseInvoice = None):
+    invoice = invoice or PurchaseInvoice.objects.filter(pk=invoice_id).first()
+    if invoice and invoice.status in ('R', 'PR') and not invoice.is_restocked:
+        postPurchaseReceipt(invoice)
+
+
+def runSalesDeduction(invoice_id: int, invoice: SalesInvoice = None):
+    invoice = invoice or SalesInvoice.objects.filter(pk=invoice_id).first()
+    if invoice and invoice.status in ('C', 'PC') and not invoice.is_deducted:
+        postSalesDeduction(invoice)
+
+
+def postSalesDeduction(invoice: SalesInvoice):
+        """
+        Deduct what a completed sales invoice hands over from inventory.
+        Lines are deducted up to `quantity` once the invoice is COMPLETED
+        and up to `quantity_received` while PARTIALLY_COMPLETED, minus
+        earlier deductions. Products without an inventory row are skipped.
+
+        Stock is taken with one conditional UPDATE per invoice, requiring
+        on hand - reserved >= n where the line's own reservation counts as
+        available, so concurrent checkouts never oversell or lose an
+        update. The reservation is then converted, see
+        syncSalesReservations(). When any line is short nothing is
+        deducted and a ValidationError lists the shortfalls.
+        """
+        quantity_field = getRestockField(invoice.status != 'C')
+        business_id = invoice.business_id
+
+        with transaction.atomic():
+            # concurrent postings of the same invoice wait for each other
+            list(SalesInvoice.objects.select_for_update().filter(pk=invoice.pk).values_list('pk'))
+
+            items = list(
+                invoice.invoice_items
+                .annotate(
+                    reserved=Coalesce(reservedQuantity(), 0),
+                    deducted=Coalesce(deductedQuantity(), 0),
+                )
+                .order_by()
+            )
+            deltas = {item.id: getattr(item, quantity_field) - item.deducted for item in items}
+            stocked = dict(InventoryItem.objects.filter(
+                business_id=business_id, product_id__in=[item.product_id for item in items]
+            ).values_list('product_id', 'id'))
+            posted = [item for item in items if deltas[item.id] > 0 and item.product_id in stocked]
+
+            if posted:
+                enough = Q()
+                for item in posted:
+                    enough |= Q(
+                        product_id=item.product_id,
+                        quantity_on_hand__gte=F('quantity_reserved') - item.reserved + deltas[item.id]
+                    )
+
+                delta = Case(*[
+                    When(product_id=item.product_id, then=Value(deltas[item.id]))
+                    for item in posted
+                ], output_field=IntegerField())
+
+                try:
+                    with transaction.atomic():
+                        deducted = InventoryItem.objects.filter(business_id=business_id).filter(enough).update(
+                            quantity=F('quantity') - delta,
+                            quantity_on_hand=F('quantity_on_hand') - delta,
+                            last_transaction=Value(generateTransactionId(invoice)),
+                        )
+                        if deducted != len(posted):
+                            raise StockShortfall()
+                except StockShortfall:
+                    raiseStockShortfall(
+                        business_id,
+                        {item: deltas[item.id] for item in posted},
+                        {item.id: item.reserved for item in posted},
+                    )
+
+                SalesInvoiceItemDeduction.objects.bulk_create([
+                    SalesInvoiceItemDeduction(
+                        sales_invoice_id=invoice.id,
+                        sales_invoice_item_id=item.id,
+                        quantity=deltas[item.id],
+                    ) for item in posted
+                ])
+
+                sold = {}
+                for item in posted:
+                    key = (stocked[item.product_id], item.product_id, business_id)
+                    sold[key] = sold.get(key, 0) - deltas[item.id]
+                StockMovement.objects.record('S', invoice, sold)
+
+                fully_received = Q(quantity_received__gte=F('quantity'))
+                SalesInvoiceItem.objects.filter(pk__in=[item.id for item in posted]).update(
+                    is_deducted=Case(When(fully_received, then=Value(True)), default=Value(False)),
+                    is_partially_deducted=Case(When(fully_received, then=Value(False)), default=Value(True)),
+                )
+
+                Inventory.objects.refresh_glance(business_id=business_id)
+
+            lines = invoice.invoice_items.aggregate(
+                total=Count('id'),
+                deducted=Count('id', filter=Q(is_deducted=True)),
+                partially_deducted=Count('id', filter=Q(is_partially_deducted=True)),
+            )
+            if lines['partially_deducted']:
+                invoice.is_deducted, invoice.is_partially_deducted, invoice.status = False, True, 'PC'
+            elif lines['total'] and lines['deducted'] == lines['total']:
+                invoice.is_deducted, invoice.is_partially_deducted, invoice.status = True, False, 'C'
+
+            SalesInvoice.objects.filter(pk=invoice.pk).update(
+                is_deducted=invoice.is_deducted,
+                is_partially_deducted=invoice.is_partially_deducted,
+                status=invoice.status,
+            )
+            CollectionVersion.objects.bump(business_id, 'sales-invoices')
+
+            syncSalesReservations(invoice)
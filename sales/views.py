@@ -2,16 +2,22 @@ from calendar import monthrange
 from datetime import datetime
 
 from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
 
 from rest_framework import status
 from rest_framework.viewsets import GenericViewSet, ModelViewSet, ViewSet
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.filters import SearchFilter
 from django_filters.rest_framework import DjangoFilterBackend
 
-from root.utils import get_active_business
+from root.deletes import BulkDeleteViewSetMixin
+from root.utils import AsyncBusinessView, ConditionalGetViewSetMixin, EagerLoadingViewSetMixin, ExportViewSetMixin, get_active_business, stream_csv
+from root.pagination import CreatedAtCursorPagination
 from .models import PurchaseInvoice, PurchaseInvoiceItem, ReturnedItem, SalesInvoice, SalesInvoiceItem
+from .printing import printableInvoices, renderInvoice, renderInvoiceArchive
 from .serializers import (
     PurchaseInvoiceAndItemsCreateSerializer,
     PurchaseInvoiceAndItemsUpdateSerializer,
@@ -42,14 +48,22 @@ from .serializers import (
 # Create your views here.
 
 
-class PurchaseInvoiceViewSet(ModelViewSet):
+class PurchaseInvoiceViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, EagerLoadingViewSetMixin, ExportViewSetMixin, ModelViewSet):
 
+    versioned_collections = ['purchase-invoices', 'suppliers', 'products']
+    bulk_delete_field = 'invoice_ids'
+
+    pagination_class = CreatedAtCursorPagination
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = ['supplier__name', 'status', 'payment_status', 'sub_total', 'total', 'goods_received']
     search_fields = [
         'id', 'invoice_number', 'supplier__name', 'status', 'payment_status',
         'sub_total', 'total', 'amount_paid', 'goods_received', 'delivery', 'notes'
     ]
+    export_fields = [
+        'id', 'invoice_number', 'created_at', 'date_due', 'supplier__name', 'status', 'payment_status',
+        'sub_total', 'tax', 'total', 'amount_paid', 'goods_received', 'delivery', 'is_restocked', 'notes'
+    ]
 
     def get_queryset(self):
         business = get_active_business(self.request)
@@ -88,6 +102,19 @@ class PurchaseInvoiceViewSet(ModelViewSet):
             'user_id': self.request.user.id
         }
 
+    @action(['GET'], detail=False, url_path='export-items', url_name='export-items')
+    def export_items(self, request):
+        """
+        The line items of every invoice the export would contain.
+        """
+        if not get_active_business(request):
+            return Response({'detail': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        items = PurchaseInvoiceItem.objects.filter(
+            purchase_invoice__in=self.export_queryset().order_by().values('pk')
+        ).order_by('purchase_invoice_id', 'id')
+        return stream_csv(items, PurchaseInvoiceItemViewSet.export_fields, 'purchase-invoice-items')
+
     @action(['POST'], detail=True)
     def restock(self, request, pk=None):
 
@@ -102,7 +129,7 @@ class PurchaseInvoiceViewSet(ModelViewSet):
             serializer = RestockSerializer(data=request.data, context={
                 'purchase_invoice_id': self.kwargs['pk'],
                 'business_id': business.id,
-                'inventory_id': business.inventory_glance.id
+                'inventory_id': business.inventory_id
             })
 
             try:
@@ -154,26 +181,6 @@ class PurchaseInvoiceViewSet(ModelViewSet):
                     'detail': 'Internal Server Error.'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
-        invoice_ids = request.data.get('invoice_ids', [])
-        if not invoice_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            PurchaseInvoice.objects.filter(id__in=invoice_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
     @action(['POST'], detail=True, url_path='update-with-items', url_name='update-with-items')
     @transaction.atomic()
     def update_invoice_and_items(self, request, pk=None):
@@ -263,17 +270,23 @@ class PurchaseInvoiceViewSet(ModelViewSet):
             #     }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class PurchaseInvoiceItemViewSet(ModelViewSet):
+class PurchaseInvoiceItemViewSet(ConditionalGetViewSetMixin, EagerLoadingViewSetMixin, ExportViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['purchase-invoices', 'products']
 
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = [
-        'purchase_invoice__id', 'purchase_invoice__invoice_number', 'is_restocked', 'is_partially_restocked'
+        'purchase_invoice__id', 'purchase_invoice__invoice_number', 'is_restocked', 'is_partially_restocked',
         'product__name', 'track_code', 'unit_cost', 'quantity_received',
     ]
     search_fields = [
         'id', 'purchase_invoice__id', 'purchase_invoice__invoice_number', 'product__name', 
         'track_code', 'notes', 'unit_cost', 'quantity_received'
     ]
+    export_fields = [
+        'id', 'purchase_invoice_id', 'purchase_invoice__invoice_number', 'product_id', 'product__name',
+        'track_code', 'quantity', 'quantity_received', 'unit_cost', 'is_restocked', 'notes', 'created_at'
+    ]
 
     def get_serializer_class(self):
 
@@ -304,7 +317,10 @@ class PurchaseInvoiceItemViewSet(ModelViewSet):
         }
 
 
-class PurchasesKPIViewSet(GenericViewSet):
+class PurchasesKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
+
+    versioned_collections = ['purchase-invoices']
+    version_window = 60 * 5
 
     ### MONTHLY METRICS
     @action(['GET'], detail=False, url_name='monthly-total-purchases', url_path='monthly-total-purchases')
@@ -407,13 +423,22 @@ class PurchasesKPIViewSet(GenericViewSet):
         }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class SalesInvoiceViewSet(ModelViewSet):
+class SalesInvoiceViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, EagerLoadingViewSetMixin, ExportViewSetMixin, ModelViewSet):
 
+    versioned_collections = ['sales-invoices', 'customers', 'products']
+    bulk_delete_field = 'invoice_ids'
+
+    pagination_class = CreatedAtCursorPagination
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = ['customer__name', 'status', 'payment_status', 'sub_total', 'total', 'is_deducted', 'is_partially_deducted']
     search_fields = [
         'id', 'invoice_number', 'customer__name', 'status', 'payment_status', 'sub_total', 'total', 'discount', 'tax', 'notes', 'created_by__email'
     ]
+    export_fields = [
+        'id', 'invoice_number', 'created_at', 'date_due', 'customer__name', 'status', 'payment_status',
+        'sub_total', 'discount', 'tax', 'total', 'is_deducted', 'notes', 'created_by__email'
+    ]
+    MAX_RENDERED_INVOICES = 500
 
     def get_queryset(self):
         business = get_active_business(self.request)
@@ -447,6 +472,19 @@ class SalesInvoiceViewSet(ModelViewSet):
             'user_id': self.request.user.id
         }
 
+    @action(['GET'], detail=False, url_path='export-items', url_name='export-items')
+    def export_items(self, request):
+        """
+        The line items of every invoice the export would contain.
+        """
+        if not get_active_business(request):
+            return Response({'detail': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        items = SalesInvoiceItem.objects.filter(
+            sales_invoice__in=self.export_queryset().order_by().values('pk')
+        ).order_by('sales_invoice_id', 'id')
+        return stream_csv(items, SalesInvoiceItemViewSet.export_fields, 'sales-invoice-items')
+
     @action(['POST'], detail=False, url_path='create-with-items', url_name='create-with-items')
     def create_invoice_and_items(self, request):
         if request.method == 'POST':
@@ -472,32 +510,15 @@ class SalesInvoiceViewSet(ModelViewSet):
                 res_serializer = SalesInvoiceSerializer(sales_invoice)
                 return Response(res_serializer.data, status=status.HTTP_201_CREATED)
 
+            except ValidationError as error:
+                return Response(error.detail, status=status.HTTP_400_BAD_REQUEST)
+
             except Exception as error:
                 print(error)
                 return Response({
                     'detail': 'Internal Server Error.'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
-        invoice_ids = request.data.get('invoice_ids', [])
-        if not invoice_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            SalesInvoice.objects.filter(id__in=invoice_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
-
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
     @action(['POST'], detail=True, url_path='update-with-items', url_name='update-with-items')
     def update_invoice_and_items(self, request, pk=None):
         if request.method == 'POST':
@@ -529,6 +550,9 @@ class SalesInvoiceViewSet(ModelViewSet):
                 res_serializer = SalesInvoiceSerializer(sales_invoice)
                 return Response(res_serializer.data, status=status.HTTP_200_OK)
 
+            except ValidationError as error:
+                return Response(error.detail, status=status.HTTP_400_BAD_REQUEST)
+
             except Exception as error:
                 print(error)
                 return Response({
@@ -543,8 +567,58 @@ class SalesInvoiceViewSet(ModelViewSet):
 
             return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(['GET'], detail=True, url_path='render-invoice', url_name='render-invoice')
+    def render_invoice(self, request, pk=None):
+        """
+        The invoice rendered to printable HTML. The ETag is the content
+        hash, so a client holding the current print gets a 304.
+        """
+        if not get_active_business(request):
+            return Response({'detail': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        sales_invoice = get_object_or_404(printableInvoices(self.get_queryset()), pk=pk)
+        html, digest = renderInvoice(sales_invoice)
+
+        etag = f'"{digest}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(html, content_type='text/html; charset=utf-8')
+        response['ETag'] = etag
+        return response
+
+    @action(['GET'], detail=False, url_path='render-invoices', url_name='render-invoices')
+    def render_invoices(self, request):
+        """
+        A zip of rendered invoices, for `?ids=1,2,3` or else every invoice
+        the export filters select, up to MAX_RENDERED_INVOICES.
+        """
+        if not get_active_business(request):
+            return Response({'detail': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        invoices = self.export_queryset()
+        if request.query_params.get('ids'):
+            try:
+                ids = [int(pk) for pk in request.query_params['ids'].split(',')]
+            except ValueError:
+                return Response({'detail': "Query parameter 'ids' must be a list of integers."}, status=status.HTTP_400_BAD_REQUEST)
+            invoices = invoices.filter(pk__in=ids)
+
+        invoices = list(printableInvoices(invoices)[:self.MAX_RENDERED_INVOICES + 1])
+        if len(invoices) > self.MAX_RENDERED_INVOICES:
+            return Response({
+                'detail': f'At most {self.MAX_RENDERED_INVOICES} invoices can be rendered at once.'
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-class SalesKPIViewSet(GenericViewSet):
+        response = HttpResponse(renderInvoiceArchive(invoices), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="invoices.zip"'
+        return response
+
+
+class SalesKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
+
+    versioned_collections = ['sales-invoices']
+    version_window = 60 * 5
 
     queryset = []
     serializer_class = None
@@ -683,7 +757,10 @@ class SalesKPIViewSet(GenericViewSet):
                     'detail': 'Unauthorized'
                 }, status=status.HTTP_401_UNAUTHORIZED)
 
-            avg_order_value = SalesInvoice.objects.average_order_value(business_id)
+            num_days = request.query_params.get('days', '')
+            avg_order_value = SalesInvoice.objects.average_order_value(
+                business_id, int(num_days) if num_days.isdigit() else None
+            )
             return Response({
                 "avg_order_value": avg_order_value
             }, status=status.HTTP_200_OK)
@@ -693,7 +770,24 @@ class SalesKPIViewSet(GenericViewSet):
         }, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class SalesInvoiceItemViewSet(ModelViewSet):
+class AsyncMonthlySalesTrendView(AsyncBusinessView):
+    """
+    GET /sales-kpis/monthly-sales-trend/ on the async ORM, routed in place
+    of SalesKPIViewSet's action under ASGI (settings.ASYNC_DASHBOARD).
+    """
+
+    versioned_collections = ['sales-invoices']
+    version_window = 60 * 5
+
+    async def aget(self, request, business):
+        return {
+            "monthly_sales_trend": await SalesInvoice.objects.amonthly_sales_trend(business.id)
+        }
+
+
+class SalesInvoiceItemViewSet(ConditionalGetViewSetMixin, EagerLoadingViewSetMixin, ExportViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['sales-invoices', 'products']
 
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = [
@@ -703,6 +797,10 @@ class SalesInvoiceItemViewSet(ModelViewSet):
     search_fields = [
        'id', 'sales_invoice__id', 'sales_invoice__invoice_number', 'product__name', 'track_code', 'quantity_received', 'unit_price', 'discount'
     ]
+    export_fields = [
+        'id', 'sales_invoice_id', 'sales_invoice__invoice_number', 'product_id', 'product__name', 'track_code',
+        'quantity', 'quantity_received', 'unit_price', 'discount', 'is_deducted', 'is_returned', 'created_at'
+    ]
 
     def get_queryset(self):
         business = get_active_business(self.request)
@@ -737,7 +835,7 @@ class SalesInvoiceItemViewSet(ModelViewSet):
         return {
             'business_id': business.id,
             'sales_invoice_id': self.kwargs['sales_invoice_pk'],
-            'inventory_id': business.inventory_glance.id
+            'inventory_id': business.inventory_id
         }
 
     @action(['POST'], detail=True, url_path='return', url_name='return')
@@ -774,8 +872,12 @@ class SalesInvoiceItemViewSet(ModelViewSet):
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class ReturnedItemsViewSet(ModelViewSet):
+class ReturnedItemsViewSet(ConditionalGetViewSetMixin, BulkDeleteViewSetMixin, EagerLoadingViewSetMixin, ModelViewSet):
+
+    versioned_collections = ['returned-items', 'sales-invoices', 'products']
+    bulk_delete_field = 'returned_item_ids'
 
+    pagination_class = CreatedAtCursorPagination
     filter_backends = [SearchFilter, DjangoFilterBackend]
     filterset_fields = [
         'invoice_item__sales_invoice__id', 'invoice_item__product__name', 'quantity'
@@ -803,29 +905,12 @@ class ReturnedItemsViewSet(ModelViewSet):
         return {
             'business_id': business.id
         }
-    
-    @action(['POST'], detail=False, url_path='bulk-delete', url_name='bulk-delete')
-    def bulk_delete(self, request):
-        returned_item_ids = request.data.get('returned_item_ids', [])
-        if not returned_item_ids:
-            return Response({
-                'detail': 'Bad Request.'
-            }, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            ReturnedItem.objects.filter(id__in=returned_item_ids).delete()
-            return Response({
-                'detail': 'Success.'
-            }, status=status.HTTP_200_OK)
 
-        except Exception as error:
-            print(error)
-            return Response({
-                'detail': 'Internal Server Error.'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
+class ReturnedItemsKPIViewSet(ConditionalGetViewSetMixin, GenericViewSet):
 
-class ReturnedItemsKPIViewSet(GenericViewSet):
+    versioned_collections = ['returned-items']
+    version_window = 60 * 5
 
     serializer_class = None
 